@@ -0,0 +1,119 @@
+"""
+List pages of the admin (/admin/<model>/) on a seeded SQLite database, next to Flask-Admin's stock ModelView
+registered for the same tables: time and queries of the first page and of a page deep in the table (OFFSET for
+the stock view, the keyset "next" link for ours). Also checks that following the next links from the first page
+visits every planet once in the sorted order, that searches match indexed columns exactly and that big tables
+show an estimated count. Exits with 1 if a check fails.
+
+    $ python benchmarks/admin_pages.py --users 5000 --favorites 20
+"""
+import os
+import re
+import sys
+import json
+import html
+import time
+import argparse
+import tempfile
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--users', type=int, default=5000)
+parser.add_argument('--planets', type=int, default=500)
+parser.add_argument('--favorites', type=int, default=20, help='favorite planets per user')
+parser.add_argument('--repeat', type=int, default=5)
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'admin_pages.db')
+os.environ['ENABLE_ADMIN'] = 'true'
+os.environ['ADMIN_EXACT_COUNT_THRESHOLD'] = '10000'
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['SLOW_QUERY_MS'] = '10000'
+
+from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import event, select
+from app import create_app
+from models import db, Planets, FavoritesPlanets
+from seed import seed
+
+app = create_app()
+admin = app.extensions['admin'][0]
+admin.add_view(ModelView(FavoritesPlanets, db.session, endpoint='stock_favoritesplanets', url='/admin/stock_favoritesplanets'))
+client = app.test_client()
+
+ROW_ID = re.compile(r'name="rowid" class="action-checkbox" value="(\d+)"')
+NEXT_LINK = re.compile(r'<li class="next"><a href="([^"#]+)"')
+
+def get_page(path):
+    statements = []
+    def count_statement(*arguments):
+        statements.append(arguments[2])
+    with app.app_context():
+        event.listen(db.engine, 'before_cursor_execute', count_statement)
+        try:
+            start = time.perf_counter()
+            body = client.get(path).get_data(as_text=True)
+            elapsed = time.perf_counter() - start
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', count_statement)
+    next_link = NEXT_LINK.search(body)
+    return {
+        'body': body,
+        'ids': [int(id) for id in ROW_ID.findall(body)],
+        'next': html.unescape(next_link.group(1)) if next_link else None,
+        'queries': len(statements),
+        'ms': elapsed * 1000,
+    }
+
+def measure(path):
+    pages = [get_page(path) for _ in range(args.repeat)]
+    return {'ms': round(min(page['ms'] for page in pages), 2), 'queries': pages[0]['queries'], 'rows': len(pages[0]['ids'])}
+
+def sort_index(view, column):
+    return [name for name, label in view._list_columns].index(column)
+
+if __name__ == '__main__':
+    with app.app_context():
+        seed(users=args.users, planets=args.planets, people=10, favorites=args.favorites)
+        favorites = db.session.scalar(select(db.func.count()).select_from(FavoritesPlanets))
+        deep_id = db.session.scalar(select(FavoritesPlanets.id).order_by(FavoritesPlanets.id).offset(favorites - 40).limit(1))
+        planets_order = list(db.session.scalars(select(Planets.id).order_by(Planets.favorites_count.desc(), Planets.id.desc())))
+        db.session.remove()
+    deep_page = (favorites - 40) // 20
+    results = {'favorites_planets_rows': favorites, 'pages': {}}
+    checks = {}
+
+    results['pages']['stock_first'] = measure('/admin/stock_favoritesplanets/')
+    results['pages']['stock_deep_offset'] = measure('/admin/stock_favoritesplanets/?page={}'.format(deep_page))
+    results['pages']['scalable_first'] = measure('/admin/favoritesplanets/')
+    results['pages']['scalable_deep_keyset'] = measure('/admin/favoritesplanets/?after=[{}]'.format(deep_id - 1))
+    checks['deep_page_same_queries'] = results['pages']['scalable_deep_keyset']['queries'] == results['pages']['scalable_first']['queries']
+    checks['estimated_count_shown'] = '~{} rows'.format(favorites) in get_page('/admin/favoritesplanets/')['body']
+
+    # Every planet once, by favorites_count descending, following the next links
+    planets_view = next(view for view in admin._views if getattr(view, 'model', None) is Planets and view.endpoint == 'planets')
+    path = '/admin/planets/?sort={}&desc=1'.format(sort_index(planets_view, 'favorites_count'))
+    visited = []
+    queries = set()
+    pages = 0
+    while path:
+        pages += 1
+        page = get_page(path)
+        visited += page['ids']
+        queries.add(page['queries'])
+        path = page['next']
+    results['planets_walk'] = {'pages': pages, 'queries_per_page': sorted(queries)}
+    checks['walk_visits_every_planet_in_order'] = visited == planets_order
+
+    search = get_page('/admin/user/?search=user42@example.com')
+    results['search_email'] = {'ids': search['ids'], 'queries': search['queries']}
+    checks['search_exact_email'] = search['ids'] == [42]
+    checks['search_substring_not_scanned'] = get_page('/admin/user/?search=user42')['ids'] == []
+
+    results['checks'] = checks
+    print(json.dumps(results, indent=2))
+    if not all(checks.values()):
+        raise SystemExit(1)
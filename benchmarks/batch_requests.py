@@ -0,0 +1,127 @@
+"""
+Loads a client home screen (/users/favorites/<id>, /users, several /people/<id> and /planets/<id>) from a gunicorn
+worker as separate requests, with a new connection each or over one keep-alive connection, and as one POST /batch.
+Also checks that every batch result has the status and body of the same call made on its own, and that duplicated
+GETs do not add queries (from the Server-Timing header). --rtt-ms adds a simulated network round trip per HTTP request.
+Exits with 1 if a check fails.
+
+    $ python benchmarks/batch_requests.py --screens 200 --rtt-ms 40
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', 'src')
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from loadgen import percentile, wait_until_ready
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--screens', type=int, default=200, help='home screens loaded per mode')
+parser.add_argument('--people', type=int, default=6, help='/people/<id> calls per screen')
+parser.add_argument('--planets', type=int, default=4, help='/planets/<id> calls per screen')
+parser.add_argument('--rtt-ms', type=float, default=0, help='simulated network round trip added to every HTTP request')
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'batch_requests.db')
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['SERVER_TIMING'] = 'true'
+os.environ['SLOW_QUERY_MS'] = '10000'
+
+from app import create_app
+from seed import seed
+
+app = create_app()
+with app.app_context():
+    seed(users=1000, planets=200, people=2000, favorites=10)
+
+PORT = 8761
+QUERIES = re.compile(r'"(\d+) queries"')
+
+# The calls of one home screen, some people appear twice like the homeworld of two favorites would
+def home_screen(generator):
+    people = [generator.randint(1, 2000) for _ in range(args.people - 1)]
+    paths = ['/users/favorites/{}'.format(generator.randint(1, 1000)), '/users?limit=10']
+    paths += ['/people/{}'.format(people_id) for people_id in people + people[:1]]
+    paths += ['/planets/{}'.format(generator.randint(1, 200)) for _ in range(args.planets)]
+    return paths
+
+def call(connection, method, path, body=None):
+    time.sleep(args.rtt_ms / 1000)
+    connection.request(method, path, body=json.dumps(body) if body is not None else None, headers={'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read()), response.getheader('Server-Timing')
+
+def new_connection():
+    return http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+
+def separate_connections(paths):
+    results = []
+    for path in paths:
+        connection = new_connection()
+        results.append(call(connection, 'GET', path)[:2])
+        connection.close()
+    return results
+
+def keep_alive(paths):
+    connection = new_connection()
+    results = [call(connection, 'GET', path)[:2] for path in paths]
+    connection.close()
+    return results
+
+def batch(paths):
+    connection = new_connection()
+    status, body = call(connection, 'POST', '/batch', {'requests': [{'path': path} for path in paths]})[:2]
+    connection.close()
+    assert status == 200, body
+    return [(result['status'], result['body']) for result in body['results']]
+
+def batch_queries(paths):
+    connection = new_connection()
+    server_timing = call(connection, 'POST', '/batch', {'requests': [{'path': path} for path in paths]})[2]
+    connection.close()
+    return int(QUERIES.search(server_timing).group(1))
+
+if __name__ == '__main__':
+    command = ['gunicorn', 'wsgi', '--workers', '1', '--threads', '4', '--chdir', SRC_DIR,
+               '--bind', '127.0.0.1:{}'.format(PORT), '--log-level', 'warning']
+    server = subprocess.Popen(command, env=os.environ.copy())
+    try:
+        wait_until_ready('http://127.0.0.1:{}'.format(PORT))
+        generator = random.Random(42)
+        screens = [home_screen(generator) for _ in range(args.screens)]
+        results = {'calls_per_screen': len(screens[0]), 'rtt_ms': args.rtt_ms, 'modes': {}}
+        checks = {'same_results': True}
+        for mode, load in (('separate_connections', separate_connections), ('keep_alive', keep_alive), ('batch', batch)):
+            latencies = []
+            for paths in screens:
+                start = time.perf_counter()
+                load(paths)
+                latencies.append(time.perf_counter() - start)
+            results['modes'][mode] = {
+                'http_requests_per_screen': 1 if mode == 'batch' else len(screens[0]),
+                'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+                'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            }
+        for paths in screens[:20]:
+            checks['same_results'] = checks['same_results'] and batch(paths) == keep_alive(paths)
+        # /users is not cached, every call of it that runs is one more query
+        results['queries_with_duplicates'] = batch_queries(['/users?limit=10'] * 3)
+        results['queries_without_duplicates'] = batch_queries(['/users?limit=10'])
+        checks['duplicates_run_once'] = results['queries_with_duplicates'] == results['queries_without_duplicates']
+    finally:
+        server.terminate()
+        server.wait()
+    results['checks'] = checks
+    print(json.dumps(results, indent=2))
+    if not all(checks.values()):
+        raise SystemExit(1)
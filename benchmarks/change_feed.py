@@ -0,0 +1,158 @@
+"""
+Cost of the favorites change feed (/users/<user_id>/favorites/stream) in the async serving mode:
+opens --clients idle streams against one uvicorn worker and reports its memory and CPU per client while
+they only get heartbeats, then the delay between a POST and its event, and checks resuming with Last-Event-ID.
+
+    $ python benchmarks/change_feed.py --clients 2000
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', 'src')
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from loadgen import percentile, wait_until_ready
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--clients', type=int, default=1000)
+parser.add_argument('--idle', type=float, default=5, help='seconds the idle clients are measured')
+parser.add_argument('--events', type=int, default=50)
+args = parser.parse_args()
+
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'change_feed.db')
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['SSE_HEARTBEAT'] = '1'
+os.environ['SLOW_QUERY_MS'] = '10000'
+
+from app import create_app
+from seed import seed
+
+app = create_app()
+with app.app_context():
+    seed(users=args.clients, planets=args.events + 10, people=10, favorites=0)
+
+PORT = 8741
+
+def worker_pid(master_pid):
+    for pid in os.listdir('/proc'):
+        if pid.isdigit():
+            try:
+                with open('/proc/{}/stat'.format(pid)) as stat:
+                    if int(stat.read().rsplit(')', 1)[1].split()[1]) == master_pid:
+                        return int(pid)
+            except OSError:
+                pass
+    raise RuntimeError('No worker found')
+
+def rss_kb(pid):
+    with open('/proc/{}/status'.format(pid)) as status:
+        return int(next(line for line in status if line.startswith('VmRSS')).split()[1])
+
+def cpu_seconds(pid):
+    with open('/proc/{}/stat'.format(pid)) as stat:
+        fields = stat.read().rsplit(')', 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+def post(path):
+    connection = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+    connection.request('POST', path)
+    status = connection.getresponse().status
+    connection.close()
+    return status
+
+async def open_stream(user_id, last_event_id=None):
+    reader, writer = await asyncio.open_connection('127.0.0.1', PORT)
+    headers = 'Last-Event-ID: {}\r\n'.format(last_event_id) if last_event_id else ''
+    writer.write('GET /users/{}/favorites/stream HTTP/1.1\r\nHost: localhost\r\nAccept: text/event-stream\r\n{}\r\n'.format(user_id, headers).encode())
+    await writer.drain()
+    return reader, writer
+
+# Next SSE event (id, event, data), comments and the retry field are skipped
+async def read_event(reader):
+    fields = {}
+    while True:
+        line = (await reader.readline()).decode().rstrip('\r\n')
+        if line == '' and fields:
+            return fields.get('id'), fields.get('event'), json.loads(fields['data']) if 'data' in fields else None
+        name, _, value = line.partition(': ')
+        if name in ('id', 'event', 'data'):
+            fields[name] = value
+
+async def skip_headers(reader):
+    while (await reader.readline()) not in (b'\r\n', b''):
+        pass
+
+async def main(pid):
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    rss_before = rss_kb(pid)
+    streams = []
+    for user_id in range(1, args.clients + 1):
+        reader, writer = await open_stream(user_id)
+        streams.append((reader, writer))
+    for reader, writer in streams:
+        await skip_headers(reader)
+        await read_event(reader)
+    cpu_before = cpu_seconds(pid)
+    await asyncio.sleep(args.idle)
+    cpu_used = cpu_seconds(pid) - cpu_before
+    results['idle'] = {
+        'clients': args.clients,
+        'rss_kb_per_client': round((rss_kb(pid) - rss_before) / args.clients, 2),
+        'cpu_percent': round(cpu_used / args.idle * 100, 2),
+        'heartbeat_seconds': 1,
+    }
+
+    # The first client watches its own favorites while they are added one at a time
+    reader, writer = streams[0]
+    latencies = []
+    event_ids = []
+    for planet_id in range(1, args.events + 1):
+        start = time.perf_counter()
+        status = await loop.run_in_executor(None, post, '/favorite/planet/{}/user/1'.format(planet_id))
+        assert status == 201, status
+        while True:
+            event_id, event, data = await read_event(reader)
+            if event == 'favorite':
+                break
+        latencies.append(time.perf_counter() - start)
+        event_ids.append(event_id)
+    results['post_to_event_ms'] = {'p50': round(percentile(latencies, 0.5) * 1000, 2), 'p99': round(percentile(latencies, 0.99) * 1000, 2)}
+    for reader, writer in streams:
+        writer.close()
+
+    # Reconnecting after the 10th event replays the ones after it, an unknown old id gets a reset
+    reader, writer = await open_stream(1, event_ids[9])
+    await skip_headers(reader)
+    replayed = [(await read_event(reader))[0] for _ in range(len(event_ids) - 10)]
+    writer.close()
+    reader, writer = await open_stream(1, '1-0')
+    await skip_headers(reader)
+    reset = (await read_event(reader))[1]
+    writer.close()
+    results['resume'] = {'replayed_all_missed': replayed == event_ids[10:], 'too_old_id': reset}
+    return results
+
+if __name__ == '__main__':
+    command = ['gunicorn', 'asgi:application', '-k', 'uvicorn.workers.UvicornWorker', '--workers', '1', '--chdir', SRC_DIR,
+               '--bind', '127.0.0.1:{}'.format(PORT), '--log-level', 'warning', '--backlog', str(max(2048, args.clients))]
+    server = subprocess.Popen(command, env=os.environ.copy())
+    try:
+        wait_until_ready('http://127.0.0.1:{}'.format(PORT))
+        results = asyncio.run(main(worker_pid(server.pid)))
+    finally:
+        server.terminate()
+        server.wait()
+    print(json.dumps(results, indent=2))
+    if not results['resume']['replayed_all_missed'] or results['resume']['too_old_id'] != 'reset':
+        raise SystemExit(1)
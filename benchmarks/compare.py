@@ -0,0 +1,35 @@
+"""
+Compares two reports of benchmarks/run.py, e.g. the one of main against the one of a branch.
+
+    $ python benchmarks/compare.py before.json after.json
+"""
+import sys
+import json
+
+def change(before, after):
+    if not before or after is None:
+        return '     n/a'
+    return '{:+7.1f}%'.format((after - before) * 100.0 / before)
+
+def main(before_path, after_path):
+    with open(before_path) as file:
+        before = json.load(file)
+    with open(after_path) as file:
+        after = json.load(file)
+    print('{} -> {}'.format(before.get('commit'), after.get('commit')))
+    for mode in ('client', 'http'):
+        if mode not in before or mode not in after:
+            continue
+        print('\n[{}] peak RSS {} kB -> {} kB'.format(mode, before[mode]['peak_rss_kb'], after[mode]['peak_rss_kb']))
+        print('{:<55} {:>10} {:>9} {:>10} {:>9}'.format('route', 'p95 ms', 'change', 'rps', 'change'))
+        for route, new in sorted(after[mode]['routes'].items()):
+            old = before[mode]['routes'].get(route, {})
+            print('{:<55} {:>10} {} {:>10} {}'.format(
+                route, new['p95_ms'], change(old.get('p95_ms'), new['p95_ms']),
+                new['throughput_rps'], change(old.get('throughput_rps'), new['throughput_rps'])
+            ))
+
+if __name__ == '__main__':
+    if len(sys.argv) != 3:
+        sys.exit('usage: compare.py before.json after.json')
+    main(sys.argv[1], sys.argv[2])
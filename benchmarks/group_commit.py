@@ -0,0 +1,95 @@
+"""
+Throughput of the single favorite endpoints (POST/DELETE /favorite/planet/<planet_id>/user/<user_id>) with one
+commit per request and with GROUP_COMMIT at growing batch sizes, against one gunicorn worker with --threads.
+SQLite runs with synchronous=FULL so every commit waits for an fsync like a durable database would.
+After each run the favorites_count of the planets is checked against the favorites table.
+
+    $ python benchmarks/group_commit.py --batch-sizes 1,8,32,128 --concurrency 64 --duration 10
+"""
+import os
+import sys
+import json
+import random
+import argparse
+import tempfile
+import subprocess
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', 'src')
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, SRC_DIR)
+
+from loadgen import run_load, wait_until_ready
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--database-url', default=None, help='defaults to a temporary SQLite file')
+parser.add_argument('--batch-sizes', default='1,8,32,128', help='comma separated GROUP_COMMIT_MAX_OPS values')
+parser.add_argument('--max-delay-ms', default='2')
+parser.add_argument('--concurrency', type=int, default=64)
+parser.add_argument('--duration', type=int, default=10)
+parser.add_argument('--users', type=int, default=500)
+parser.add_argument('--planets', type=int, default=500)
+args = parser.parse_args()
+
+database_url = args.database_url or 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'group_commit.db')
+os.environ['DATABASE_URL'] = database_url
+os.environ['SQLITE_SYNCHRONOUS'] = 'FULL'
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['SLOW_QUERY_MS'] = '10000'
+
+from app import create_app
+from models import db
+from seed import seed
+from leaderboard import rebuild_favorites_counts
+
+app = create_app()
+
+# Every favorite is added and then removed by the next request of the same client, so most requests change a row
+generator = random.Random(42)
+requests = []
+for _ in range(5000):
+    path = '/favorite/planet/{}/user/{}'.format(generator.randint(1, args.planets), generator.randint(1, args.users))
+    requests += [('POST', path, None), ('DELETE', path, None)]
+
+MODES = {'one_commit_per_request': {'GROUP_COMMIT': 'false'}}
+for batch_size in args.batch_sizes.split(','):
+    MODES['group_commit_{}'.format(batch_size)] = {'GROUP_COMMIT': 'true', 'GROUP_COMMIT_MAX_OPS': batch_size, 'GROUP_COMMIT_MAX_DELAY_MS': args.max_delay_ms}
+
+def batch_stats(base_url):
+    import http.client
+    from urllib.parse import urlsplit
+    url = urlsplit(base_url)
+    connection = http.client.HTTPConnection(url.hostname, url.port, timeout=10)
+    connection.request('GET', '/metrics')
+    stats = {}
+    for line in connection.getresponse().read().decode().splitlines():
+        if line.startswith('group_commit_'):
+            name, value = line.split()
+            stats[name] = int(float(value))
+    connection.close()
+    if stats.get('group_commit_batches_total'):
+        return round(stats['group_commit_operations_total'] / stats['group_commit_batches_total'], 1)
+    return None
+
+if __name__ == '__main__':
+    results = {}
+    for port, (mode, settings) in enumerate(MODES.items(), start=8751):
+        with app.app_context():
+            seed(users=args.users, planets=args.planets, people=10, favorites=0)
+        base_url = 'http://127.0.0.1:{}'.format(port)
+        command = ['gunicorn', 'wsgi', '--workers', '1', '--threads', str(args.concurrency), '--chdir', SRC_DIR,
+                   '--bind', '127.0.0.1:{}'.format(port), '--log-level', 'warning']
+        server = subprocess.Popen(command, env=dict(os.environ, **settings))
+        try:
+            wait_until_ready(base_url)
+            results[mode] = run_load(base_url, requests, concurrency=args.concurrency, duration=args.duration)
+            results[mode]['average_batch'] = batch_stats(base_url)
+        finally:
+            server.terminate()
+            server.wait()
+        with app.app_context():
+            results[mode]['wrong_counts'] = rebuild_favorites_counts('planets')
+            db.session.rollback()
+    print(json.dumps({'database': database_url.split('://')[0], 'concurrency': args.concurrency, 'results': results}, indent=2))
+    if any(result['wrong_counts'] or result['errors'] for result in results.values()):
+        raise SystemExit(1)
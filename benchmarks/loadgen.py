@@ -0,0 +1,84 @@
+"""
+Minimal concurrent HTTP load generator: each thread keeps one connection open and cycles through the requests.
+A request is either a path (GET) or a (method, path, json_body) tuple.
+"""
+import json
+import time
+import threading
+import http.client
+from urllib.parse import urlsplit
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def as_request(request):
+    if isinstance(request, str):
+        return 'GET', request, None
+    return request
+
+def run_load(base_url, paths, concurrency=32, duration=10):
+    url = urlsplit(base_url)
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker(offset):
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        own_latencies = []
+        own_errors = 0
+        index = offset
+        while time.perf_counter() < deadline:
+            method, path, body = as_request(paths[index % len(paths)])
+            index += 1
+            start = time.perf_counter()
+            try:
+                if body is None:
+                    connection.request(method, path)
+                else:
+                    connection.request(method, path, json.dumps(body), {'Content-Type': 'application/json'})
+                response = connection.getresponse()
+                response.read()
+                if response.status >= 500:
+                    own_errors += 1
+                own_latencies.append(time.perf_counter() - start)
+            except (OSError, http.client.HTTPException):
+                own_errors += 1
+                connection.close()
+                connection = http.client.HTTPConnection(url.hostname, url.port, timeout=30)
+        connection.close()
+        with lock:
+            latencies.extend(own_latencies)
+            errors[0] += own_errors
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    return {
+        'requests': len(latencies),
+        'errors': errors[0],
+        'throughput_rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+    }
+
+def wait_until_ready(base_url, path='/people?limit=1', timeout=30):
+    url = urlsplit(base_url)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection(url.hostname, url.port, timeout=2)
+            connection.request('GET', path)
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError('The server at {} did not start'.format(base_url))
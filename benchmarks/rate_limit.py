@@ -0,0 +1,103 @@
+"""
+Checks the token buckets of the rate limiter and measures their cost.
+- Many threads take from the same bucket at once, no more than capacity + refill may be allowed.
+- The favorite endpoints answer 429 with Retry-After once a user or an IP is over its limit,
+  and /metrics counts the decisions.
+The in-process store is used by default, --redis-url runs the same checks on the shared store
+(a local redis-server is enough).
+
+    $ python benchmarks/rate_limit.py --threads 16 --takes 20000
+    $ python benchmarks/rate_limit.py --redis-url redis://localhost:6379/15
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--threads', type=int, default=8)
+parser.add_argument('--takes', type=int, default=10000, help='takes of each thread')
+parser.add_argument('--redis-url', default=None)
+args = parser.parse_args()
+
+database_path = os.path.join(tempfile.mkdtemp(), 'rate_limit.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+os.environ['RATE_LIMIT_FAVORITES'] = '5/minute'
+if args.redis_url is not None:
+    os.environ['RATE_LIMIT_REDIS_URL'] = args.redis_url
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from app import create_app
+from seed import seed
+import ratelimit
+
+app = create_app()
+
+# Every thread takes from one shared bucket and from a bucket of its own
+def contention(capacity, rate):
+    allowed = [0] * args.threads
+    barrier = threading.Barrier(args.threads)
+
+    def worker(index):
+        barrier.wait()
+        for _ in range(args.takes):
+            if ratelimit.store.take(['bench:shared'], capacity, rate)[0]:
+                allowed[index] += 1
+            ratelimit.store.take(['bench:thread:{}'.format(index)], capacity, rate)
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.threads)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    takes = args.threads * args.takes * 2
+    return {
+        'takes': takes,
+        'takes_per_sec': round(takes / elapsed),
+        'allowed': sum(allowed),
+        'max_allowed': int(capacity + rate * elapsed),
+        'ok': sum(allowed) <= capacity + rate * elapsed,
+    }
+
+def endpoint_limits(client):
+    statuses = []
+    retry_after = None
+    # Same IP, one user: the 6th request of the minute is rejected before touching the database
+    for people_id in range(1, 8):
+        response = client.post('/favorite/people/{}/user/1'.format(people_id))
+        statuses.append(response.status_code)
+        if response.status_code == 429:
+            retry_after = response.headers.get('Retry-After')
+    # Another IP, same user: the bucket of the user is still empty
+    other_ip = client.post('/favorite/people/9/user/1', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code
+    metrics = [line for line in client.get('/metrics').get_data(as_text=True).splitlines() if line.startswith('rate_limit_requests_total{')]
+    return {
+        'statuses': statuses,
+        'retry_after': retry_after,
+        'other_ip_same_user': other_ip,
+        'metrics': metrics,
+        'ok': statuses[:5] == [201] * 5 and statuses[5:] == [429, 429] and retry_after is not None and other_ip == 429,
+    }
+
+if __name__ == '__main__':
+    with app.app_context():
+        seed(users=2, planets=10, people=10, favorites=0)
+    ratelimit.store.clear()
+    results = {
+        'store': type(ratelimit.store).__name__,
+        'threads': args.threads,
+        'contention': contention(capacity=100, rate=50),
+        'endpoints': endpoint_limits(app.test_client()),
+    }
+    ratelimit.store.clear()
+    print(json.dumps(results, indent=2))
+    os.remove(database_path)
+    if not (results['contention']['ok'] and results['endpoints']['ok']):
+        raise SystemExit(1)
@@ -0,0 +1,100 @@
+"""
+Checks the read replica routing with SQLite files standing in for the primary and the replicas.
+The primary is seeded and copied to two replicas, then planet 1 is renamed in each copy so every
+response tells which database answered it. A third replica points to a missing directory and must
+be skipped by the health checks. Exits with 1 if a check fails.
+
+    $ python benchmarks/replicas.py
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import tempfile
+
+directory = tempfile.mkdtemp()
+primary_path = os.path.join(directory, 'primary.db')
+replica_paths = [os.path.join(directory, 'replica_a.db'), os.path.join(directory, 'replica_b.db')]
+os.environ['DATABASE_URL'] = 'sqlite:///' + primary_path
+os.environ['DATABASE_REPLICA_URLS'] = ','.join(['sqlite:///' + path for path in replica_paths] + ['sqlite:///' + os.path.join(directory, 'missing', 'replica_c.db')])
+os.environ['REPLICA_MAX_LAG'] = '0.5'
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, BENCHMARKS_DIR)
+sys.path.insert(0, os.path.join(BENCHMARKS_DIR, '..', 'src'))
+
+from app import create_app
+from models import db, Planets, FavoritesPlanets
+from seed import seed
+
+app = create_app()
+
+def copy_primary():
+    with app.app_context():
+        seed(users=2, planets=5, people=5, favorites=0)
+        db.engine.dispose()
+    connection = sqlite3.connect(primary_path)
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    connection.close()
+    for path in replica_paths:
+        shutil.copyfile(primary_path, path)
+        connection = sqlite3.connect(path)
+        connection.execute("UPDATE planets SET name = ? WHERE id = 1", (os.path.basename(path),))
+        connection.commit()
+        connection.close()
+
+# Name of planet 1 as seen by a GET of the list, the entity cache is filled from the primary only
+def answered_by(client):
+    return client.get('/planets?limit=1').get_json()['results'][0]['name']
+
+def read_after_write_in_request():
+    seen = []
+    with app.test_request_context('/planets/1', method='GET'):
+        seen.append(db.session.get(Planets, 1).name)
+        db.session.expire_all()
+        db.session.add(FavoritesPlanets(user_id=2, planet_id=2))
+        db.session.flush()
+        seen.append(db.session.get(Planets, 1).name)
+        db.session.rollback()
+        db.session.remove()
+    return seen
+
+if __name__ == '__main__':
+    copy_primary()
+    client = app.test_client()
+    other_client = app.test_client()
+    results = {}
+    checks = {}
+
+    names = [answered_by(client) for _ in range(4)]
+    results['gets_round_robin'] = names
+    checks['gets_round_robin'] = sorted(set(names)) == ['replica_a.db', 'replica_b.db'] and names[0] != names[1]
+
+    status = client.post('/favorite/planet/1/user/1').status_code
+    after_write = answered_by(client)
+    other_after_write = answered_by(other_client)
+    time.sleep(0.6)
+    after_lag = answered_by(client)
+    results['post_status'] = status
+    results['get_right_after_write'] = after_write
+    results['other_client_get_right_after_write'] = other_after_write
+    results['get_after_max_lag'] = after_lag
+    checks['write_on_primary'] = status == 201
+    checks['read_after_write_on_primary'] = not after_write.endswith('.db')
+    checks['other_clients_stay_on_replicas'] = other_after_write.endswith('.db')
+    checks['replicas_after_max_lag'] = after_lag.endswith('.db')
+
+    results['read_after_write_in_request'] = read_after_write_in_request()
+    checks['read_after_write_in_request'] = results['read_after_write_in_request'][0].endswith('.db') and not results['read_after_write_in_request'][1].endswith('.db')
+
+    replicas = client.get('/db/pool').get_json()['results']['replicas']
+    results['replica_health'] = {replica['bind']: replica['healthy'] for replica in replicas}
+    checks['missing_replica_skipped'] = results['replica_health'] == {'replica_0': True, 'replica_1': True, 'replica_2': False}
+
+    results['checks'] = checks
+    print(json.dumps(results, indent=2))
+    shutil.rmtree(directory)
+    if not all(checks.values()):
+        raise SystemExit(1)
@@ -0,0 +1,74 @@
+"""
+Seeds a database with synthetic users, planets, people and favorites using multi-row inserts.
+
+    $ DATABASE_URL=sqlite:////tmp/bench.db python benchmarks/seed.py --planets 1000 --people 10000
+"""
+import os
+import sys
+import random
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+BATCH_SIZE = 5000
+
+def insert_batches(db, table, rows):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+
+# Drops and recreates every table, then fills them. The same seed always produces the same data.
+def seed(users=100, planets=100, people=1000, favorites=10, random_seed=42):
+    from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
+    from leaderboard import LEADERBOARDS, rebuild_favorites_counts
+    generator = random.Random(random_seed)
+    # Only the primary, the replicas (DATABASE_REPLICA_URLS) get the data from it
+    db.drop_all(bind_key=None)
+    db.create_all(bind_key=None)
+    insert_batches(db, User.__table__, (
+        {'id': i, 'email': 'user{}@example.com'.format(i), 'password': 'password', 'is_active': True}
+        for i in range(1, users + 1)
+    ))
+    insert_batches(db, Planets.__table__, (
+        {'id': i, 'name': 'Planet {}'.format(i), 'population': generator.randint(0, 10 ** 9),
+         'climate': generator.choice(['arid', 'temperate', 'frozen', 'murky']), 'diameter': generator.uniform(1000, 200000)}
+        for i in range(1, planets + 1)
+    ))
+    insert_batches(db, People.__table__, (
+        {'id': i, 'name': 'Person {}'.format(i), 'birth_year': generator.randint(0, 900),
+         'gender': generator.choice(['female', 'male', 'n/a']), 'height': generator.uniform(60, 260),
+         'eye_color': generator.choice(['blue', 'brown', 'yellow', 'red']), 'planet_id': generator.randint(1, planets)}
+        for i in range(1, people + 1)
+    ))
+    # favorites is the number of favorites of each type per user
+    insert_batches(db, FavoritesPlanets.__table__, (
+        {'user_id': user_id, 'planet_id': planet_id}
+        for user_id in range(1, users + 1)
+        for planet_id in generator.sample(range(1, planets + 1), min(favorites, planets))
+    ))
+    insert_batches(db, FavoritePeople.__table__, (
+        {'user_id': user_id, 'people_id': people_id}
+        for user_id in range(1, users + 1)
+        for people_id in generator.sample(range(1, people + 1), min(favorites, people))
+    ))
+    for name in LEADERBOARDS:
+        rebuild_favorites_counts(name)
+    db.session.commit()
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--planets', type=int, default=100)
+    parser.add_argument('--people', type=int, default=1000)
+    parser.add_argument('--favorites', type=int, default=10, help='favorites of each type per user')
+    args = parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    with app.app_context():
+        seed(args.users, args.planets, args.people, args.favorites)
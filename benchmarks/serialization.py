@@ -0,0 +1,68 @@
+"""
+Compares the rows/sec of the list endpoints serialization before (ORM objects + serialize() + stdlib json)
+and after (Core rows + the app JSON provider) for /people and /planets.
+
+    $ python benchmarks/serialization.py --rows 100000
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--rows', type=int, default=50000)
+parser.add_argument('--repeat', type=int, default=3)
+args = parser.parse_args()
+
+database_path = os.path.join(tempfile.mkdtemp(), 'serialization.db')
+os.environ['DATABASE_URL'] = 'sqlite:///' + database_path
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'src'))
+
+from app import create_app
+from models import db, Planets, People
+from serialization import select_serialized, serialized_rows
+
+app = create_app()
+
+def seed():
+    db.create_all()
+    db.session.execute(Planets.__table__.insert(), [
+        {'id': i, 'name': 'planet {}'.format(i), 'population': i * 1000, 'climate': 'arid', 'diameter': i * 1.5}
+        for i in range(1, args.rows + 1)
+    ])
+    db.session.execute(People.__table__.insert(), [
+        {'id': i, 'name': 'person {}'.format(i), 'birth_year': i % 100, 'gender': 'female', 'height': 170.5, 'eye_color': 'brown', 'planet_id': i}
+        for i in range(1, args.rows + 1)
+    ])
+    db.session.commit()
+
+def before(model):
+    items = model.query.all()
+    body = json.dumps({'msg': 'Ok', 'results': [item.serialize() for item in items]})
+    db.session.expunge_all()
+    return body
+
+def after(model):
+    return app.json.dumps({'msg': 'Ok', 'results': serialized_rows(select_serialized(model))})
+
+def rows_per_second(function, model):
+    best = None
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        function(model)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return args.rows / best
+
+with app.app_context():
+    seed()
+    results = {}
+    for endpoint, model in (('/people', People), ('/planets', Planets)):
+        old = rows_per_second(before, model)
+        new = rows_per_second(after, model)
+        results[endpoint] = {'before_rows_per_sec': round(old), 'after_rows_per_sec': round(new), 'speedup': round(new / old, 2)}
+    print(json.dumps({'rows': args.rows, 'encoder': type(app.json).__name__, 'results': results}, indent=2))
+
+os.remove(database_path)
@@ -0,0 +1,69 @@
+"""
+Measures the cost of starting a web worker: importing the app and running create_app() in a fresh interpreter,
+with everything loaded eagerly like before (admin UI, Flask-Migrate, flask_swagger) and with the lazy defaults.
+Prints the median wall time of each mode and the packages that take the longest to import (python -X importtime).
+
+    $ python benchmarks/startup.py --runs 10
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(BENCHMARKS_DIR, '..', 'src')
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--runs', type=int, default=7)
+parser.add_argument('--top', type=int, default=10, help='slowest top level packages to report')
+args = parser.parse_args()
+
+# Environment and code of each mode, "eager" is what every worker loaded before the app factory
+MODES = {
+    'eager': ({'ENABLE_ADMIN': 'true', 'ENABLE_MIGRATIONS': 'true'}, 'import flask_swagger\nfrom app import create_app\ncreate_app()'),
+    'lazy': ({'ENABLE_ADMIN': 'false', 'ENABLE_MIGRATIONS': 'auto'}, 'from app import create_app\ncreate_app()'),
+}
+
+TIMER = 'import time\nstart = time.perf_counter()\n{}\nprint(time.perf_counter() - start)'
+
+def run_once(environment, code):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', TIMER.format(code)],
+        cwd=SRC_DIR, env=environment, capture_output=True, text=True, check=True,
+    )
+    return float(result.stdout.strip().splitlines()[-1]), result.stderr
+
+# Cumulative import time of each top level package, from the "import time: self | cumulative | name" lines
+def slowest_packages(importtime_output, top):
+    packages = {}
+    for line in importtime_output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|')
+        # Nested imports are indented by two more spaces and already counted in the cumulative time of their parent
+        if len(name) - len(name.lstrip()) == 1:
+            package = name.strip().split('.')[0]
+            packages[package] = packages.get(package, 0) + int(cumulative_us)
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{'package': name, 'ms': round(microseconds / 1000, 1)} for name, microseconds in ranked]
+
+if __name__ == '__main__':
+    database_url = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'startup.db')
+    results = {}
+    for mode, (settings, code) in MODES.items():
+        environment = dict(os.environ, DATABASE_URL=database_url, **settings)
+        timings = []
+        importtime_output = ''
+        for _ in range(args.runs):
+            seconds, importtime_output = run_once(environment, code)
+            timings.append(seconds)
+        results[mode] = {
+            'median_ms': round(statistics.median(timings) * 1000, 1),
+            'min_ms': round(min(timings) * 1000, 1),
+            'slowest_imports': slowest_packages(importtime_output, args.top),
+        }
+    results['saved_ms'] = round(results['eager']['median_ms'] - results['lazy']['median_ms'], 1)
+    print(json.dumps(results, indent=2))
@@ -32,6 +32,14 @@ target_db = current_app.extensions['migrate'].db
 # ... etc.
 
 
+# The name search indexes are managed by hand in the migrations (FTS5 table and triggers on SQLite,
+# trigram indexes on Postgres), autogenerate must not try to drop them
+def include_object(object, name, type_, reflected, compare_to):
+    if name is not None and (name.startswith('search_index') or name.endswith('_name_trgm')):
+        return False
+    return True
+
+
 def get_metadata():
     if hasattr(target_db, 'metadatas'):
         return target_db.metadatas[None]
@@ -52,7 +60,8 @@ def run_migrations_offline():
     """
     url = config.get_main_option("sqlalchemy.url")
     context.configure(
-        url=url, target_metadata=get_metadata(), literal_binds=True
+        url=url, target_metadata=get_metadata(), literal_binds=True,
+        include_object=include_object
     )
 
     with context.begin_transaction():
@@ -84,6 +93,7 @@ def run_migrations_online():
             connection=connection,
             target_metadata=get_metadata(),
             process_revision_directives=process_revision_directives,
+            include_object=include_object,
             **current_app.extensions['migrate'].configure_args
         )
 
@@ -0,0 +1,35 @@
+"""add favorites indexes
+
+Revision ID: 3c1f9a7b2e40
+Revises: fdda0d6fa847
+Create Date: 2026-10-18 10:12:31.482113
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3c1f9a7b2e40'
+down_revision = 'fdda0d6fa847'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # The unique indexes can not be built while duplicated favorites exist, keep the oldest one of each pair
+    op.execute('DELETE FROM favorites_planets WHERE id NOT IN (SELECT MIN(id) FROM favorites_planets GROUP BY user_id, planet_id)')
+    op.execute('DELETE FROM favorite_people WHERE id NOT IN (SELECT MIN(id) FROM favorite_people GROUP BY user_id, people_id)')
+
+    # On Postgres CREATE INDEX CONCURRENTLY does not lock the tables for writes, but it can not run inside a transaction
+    with op.get_context().autocommit_block():
+        op.create_index('ix_favorites_planets_user_id_planet_id', 'favorites_planets', ['user_id', 'planet_id'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_favorite_people_user_id_people_id', 'favorite_people', ['user_id', 'people_id'], unique=True, postgresql_concurrently=True)
+        op.create_index('ix_people_planet_id', 'people', ['planet_id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index('ix_people_planet_id', table_name='people', postgresql_concurrently=True)
+        op.drop_index('ix_favorite_people_user_id_people_id', table_name='favorite_people', postgresql_concurrently=True)
+        op.drop_index('ix_favorites_planets_user_id_planet_id', table_name='favorites_planets', postgresql_concurrently=True)
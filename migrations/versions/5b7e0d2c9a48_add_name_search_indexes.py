@@ -0,0 +1,63 @@
+"""add name search indexes
+
+Revision ID: 5b7e0d2c9a48
+Revises: 8e2d4c6a1f93
+Create Date: 2026-10-18 17:02:51.603377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b7e0d2c9a48'
+down_revision = '8e2d4c6a1f93'
+branch_labels = None
+depends_on = None
+
+# Kept in sync by triggers, type and item_id say which row of people/planets each name belongs to
+SQLITE_TRIGGERS = """
+CREATE TRIGGER search_index_{table}_insert AFTER INSERT ON {table} BEGIN
+    INSERT INTO search_index (name, type, item_id) SELECT new.name, '{type}', new.id WHERE new.name IS NOT NULL;
+END;
+CREATE TRIGGER search_index_{table}_update AFTER UPDATE OF name ON {table} BEGIN
+    DELETE FROM search_index WHERE type = '{type}' AND item_id = old.id;
+    INSERT INTO search_index (name, type, item_id) SELECT new.name, '{type}', new.id WHERE new.name IS NOT NULL;
+END;
+CREATE TRIGGER search_index_{table}_delete AFTER DELETE ON {table} BEGIN
+    DELETE FROM search_index WHERE type = '{type}' AND item_id = old.id;
+END;
+"""
+
+SEARCH_TABLES = [('people', 'person'), ('planets', 'planet')]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+        with op.get_context().autocommit_block():
+            for table, type_name in SEARCH_TABLES:
+                op.create_index('ix_{}_name_trgm'.format(table), table, ['name'], postgresql_using='gin',
+                                postgresql_ops={'name': 'gin_trgm_ops'}, postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        op.execute("CREATE VIRTUAL TABLE search_index USING fts5(name, type UNINDEXED, item_id UNINDEXED, prefix='2 3')")
+        for table, type_name in SEARCH_TABLES:
+            for statement in SQLITE_TRIGGERS.format(table=table, type=type_name).split('END;'):
+                if statement.strip():
+                    op.execute(statement + 'END;')
+            op.execute("INSERT INTO search_index (name, type, item_id) SELECT name, '{}', id FROM {} WHERE name IS NOT NULL".format(type_name, table))
+    # Other databases use the in-memory index built by src/search.py
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'postgresql':
+        with op.get_context().autocommit_block():
+            for table, type_name in SEARCH_TABLES:
+                op.drop_index('ix_{}_name_trgm'.format(table), table_name=table, postgresql_concurrently=True)
+    elif dialect == 'sqlite':
+        for table, type_name in SEARCH_TABLES:
+            for action in ('insert', 'update', 'delete'):
+                op.execute('DROP TRIGGER IF EXISTS search_index_{}_{}'.format(table, action))
+        op.execute('DROP TABLE IF EXISTS search_index')
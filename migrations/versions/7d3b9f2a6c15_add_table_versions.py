@@ -0,0 +1,28 @@
+"""add table versions
+
+Revision ID: 7d3b9f2a6c15
+Revises: c4a8e1f05d27
+Create Date: 2026-10-18 21:40:12.305871
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d3b9f2a6c15'
+down_revision = 'c4a8e1f05d27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('table_versions',
+    sa.Column('table_name', sa.String(length=64), nullable=False),
+    sa.Column('version', sa.BigInteger(), server_default='0', nullable=False),
+    sa.PrimaryKeyConstraint('table_name')
+    )
+
+
+def downgrade():
+    op.drop_table('table_versions')
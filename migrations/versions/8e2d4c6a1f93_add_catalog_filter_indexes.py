@@ -0,0 +1,38 @@
+"""add catalog filter indexes
+
+Revision ID: 8e2d4c6a1f93
+Revises: 3c1f9a7b2e40
+Create Date: 2026-10-18 15:40:07.215934
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8e2d4c6a1f93'
+down_revision = '3c1f9a7b2e40'
+branch_labels = None
+depends_on = None
+
+# Columns the /people and /planets filters and sorts are allowed on (see src/filters.py)
+INDEXES = [
+    ('ix_people_birth_year', 'people', 'birth_year'),
+    ('ix_people_gender', 'people', 'gender'),
+    ('ix_people_height', 'people', 'height'),
+    ('ix_planets_climate', 'planets', 'climate'),
+    ('ix_planets_diameter', 'planets', 'diameter'),
+    ('ix_planets_population', 'planets', 'population'),
+]
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for index_name, table_name, column_name in INDEXES:
+            op.create_index(index_name, table_name, [column_name], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for index_name, table_name, column_name in reversed(INDEXES):
+            op.drop_index(index_name, table_name=table_name, postgresql_concurrently=True)
@@ -0,0 +1,44 @@
+"""add favorites counts
+
+Revision ID: c4a8e1f05d27
+Revises: 5b7e0d2c9a48
+Create Date: 2026-10-18 19:05:44.610382
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c4a8e1f05d27'
+down_revision = '5b7e0d2c9a48'
+branch_labels = None
+depends_on = None
+
+# Item table, its favorites table and the column of the favorites table pointing to it
+COUNTED_TABLES = [
+    ('planets', 'favorites_planets', 'planet_id'),
+    ('people', 'favorite_people', 'people_id'),
+]
+
+
+def upgrade():
+    # A constant server default does not rewrite the table on Postgres 11+
+    for table_name, favorites_table, item_column in COUNTED_TABLES:
+        op.add_column(table_name, sa.Column('favorites_count', sa.Integer(), server_default='0', nullable=False))
+        op.execute(
+            'UPDATE {table} SET favorites_count = (SELECT COUNT(*) FROM {favorites} WHERE {favorites}.{column} = {table}.id) '
+            'WHERE id IN (SELECT {column} FROM {favorites})'.format(table=table_name, favorites=favorites_table, column=item_column)
+        )
+
+    with op.get_context().autocommit_block():
+        for table_name, favorites_table, item_column in COUNTED_TABLES:
+            op.create_index('ix_{}_favorites_count_id'.format(table_name), table_name, ['favorites_count', 'id'], unique=False, postgresql_concurrently=True)
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for table_name, favorites_table, item_column in reversed(COUNTED_TABLES):
+            op.drop_index('ix_{}_favorites_count_id'.format(table_name), table_name=table_name, postgresql_concurrently=True)
+    for table_name, favorites_table, item_column in reversed(COUNTED_TABLES):
+        op.drop_column(table_name, 'favorites_count')
@@ -1,20 +1,177 @@
 import os
+import json
+from flask import g
+from flask import request
 from flask_admin import Admin
-from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
 from flask_admin.contrib.sqla import ModelView
+from sqlalchemy import select, func, text, tuple_, or_, false
+from database import env_flag
+from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
+from replicas import read_from_primary
+
+# Tables with more rows than this show the row count from the statistics of the database instead of a COUNT(*)
+ADMIN_EXACT_COUNT_THRESHOLD = int(os.getenv('ADMIN_EXACT_COUNT_THRESHOLD', 100000))
+# The lists and details of the admin read from the replicas (DATABASE_REPLICA_URLS) like the API, false keeps the admin on the primary
+ADMIN_READ_REPLICA = env_flag('ADMIN_READ_REPLICA', 'true')
+
+ESTIMATED_COUNTS = {
+    'postgresql': text('SELECT reltuples::bigint FROM pg_class WHERE oid = to_regclass(quote_ident(:table))'),
+    'mysql': text('SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = :table'),
+}
+
+# Rows of the table as the database estimates them, None when it does not know (-1 on Postgres before the first ANALYZE)
+def estimated_row_count(model):
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'sqlite':
+        # The highest id, read from the end of the primary key, deleted rows included
+        estimate = db.session.scalar(select(func.max(model.id)))
+    elif dialect in ESTIMATED_COUNTS:
+        estimate = db.session.execute(ESTIMATED_COUNTS[dialect], {'table': model.__tablename__}).scalar()
+    else:
+        return None
+    return int(estimate) if estimate is not None and estimate >= 0 else None
+
+# List views that stay fast on big tables:
+# - pages are found by the key of the last row (keyset) instead of an OFFSET that reads every row before them,
+#   so the pager only has "first page" and "next"
+# - the row count is estimated above ADMIN_EXACT_COUNT_THRESHOLD and skipped when searching
+# - only columns with an index can be sorted (column_sortable_list), searches are exact matches of indexed columns
+# - the relationships shown in the list are loaded with a join, not one query per row
+class ScalableModelView(ModelView):
+    list_template = 'admin/scalable_list.html'
+    simple_list_pager = True
+    column_display_pk = True
+    column_sortable_list = ('id',)
+    column_searchable_list = ()
+
+    # The list and the details may be read from a replica, the forms read what they are going to write from the primary
+    def _handle_view(self, name, **kwargs):
+        if not ADMIN_READ_REPLICA or name not in ('index_view', 'details_view'):
+            read_from_primary()
+        return ModelView._handle_view(self, name, **kwargs)
+
+    # Columns of the ORDER BY, the id breaks the ties of a column that is not unique
+    def sort_columns(self, sort_column, sort_desc):
+        primary_key = getattr(self.model, self._primary_key)
+        if sort_column not in self._sortable_columns:
+            return [primary_key], False
+        column = self._sortable_columns[sort_column]
+        if column.primary_key or column.unique:
+            return [column], bool(sort_desc)
+        return [column, primary_key], bool(sort_desc)
+
+    # Values of the sort columns of the last row of the previous page, from the "after" argument of the next link
+    def keyset_cursor(self, length):
+        try:
+            after = json.loads(request.args.get('after', ''))
+        except ValueError:
+            return None
+        return after if isinstance(after, list) and len(after) == length else None
+
+    def _get_list_extra_args(self):
+        view_args = ModelView._get_list_extra_args(self)
+        # Sorting, searching or going back to the first page starts again from the beginning
+        view_args.extra_args.pop('after', None)
+        return view_args
+
+    def _apply_sorting(self, query, joins, sort_column, sort_desc):
+        columns, desc = self.sort_columns(sort_column, sort_desc)
+        after = self.keyset_cursor(len(columns))
+        if after is not None:
+            key, value = (tuple_(*columns), tuple_(*after)) if len(columns) > 1 else (columns[0], after[0])
+            query = query.filter(key < value if desc else key > value)
+        return query.order_by(*[column.desc() if desc else column for column in columns]), joins
+
+    def _apply_pagination(self, query, page, page_size):
+        if 'after' in request.args:
+            page = None
+        return ModelView._apply_pagination(self, query, page, page_size)
+
+    # Every term has to be equal to one of the searchable columns, a LIKE '%term%' would read the whole table
+    def _apply_search(self, query, count_query, joins, count_joins, search):
+        for term in search.split():
+            conditions = []
+            for field, path in self._search_fields:
+                if field.type.python_type is not int:
+                    conditions.append(field == term)
+                elif term.isdigit():
+                    conditions.append(field == int(term))
+            condition = or_(*conditions) if conditions else false()
+            query = query.filter(condition)
+            if count_query is not None:
+                count_query = count_query.filter(condition)
+        return query, count_query, joins, count_joins
+
+    # simple_list_pager skips Flask-Admin's COUNT(*), the whole table is counted here when nothing is searched
+    def get_list(self, page, sort_column, sort_desc, search, filters, execute=True, page_size=None):
+        count, query = ModelView.get_list(self, page, sort_column, sort_desc, search, filters, execute, page_size)
+        g.admin_count_estimated = False
+        if not search and not filters:
+            count = estimated_row_count(self.model)
+            if count is not None and count >= ADMIN_EXACT_COUNT_THRESHOLD:
+                g.admin_count_estimated = True
+            else:
+                count = self.get_count_query().scalar()
+        return count, query
+
+    def render(self, template, **kwargs):
+        if template == self.list_template:
+            kwargs.update(self.keyset_pager(kwargs['data'], kwargs['page_size']))
+        return ModelView.render(self, template, **kwargs)
+
+    # Links of the pager, the next page starts after the last row of this one
+    def keyset_pager(self, data, page_size):
+        view_args = self._get_list_extra_args()
+        sort_column = self._get_column_by_idx(view_args.sort)
+        columns, desc = self.sort_columns(sort_column[0] if sort_column is not None else None, view_args.sort_desc)
+        next_url = None
+        if page_size and len(data) == page_size:
+            after = json.dumps([getattr(data[-1], column.key) for column in columns])
+            next_url = self._get_list_url(view_args.clone(page=0, extra_args=dict(view_args.extra_args, after=after)))
+        return {
+            'first_url': self._get_list_url(view_args.clone(page=0)),
+            'next_url': next_url,
+            'first_page': 'after' not in request.args and not view_args.page,
+            'count_estimated': g.get('admin_count_estimated', False),
+        }
+
+class UserView(ScalableModelView):
+    column_sortable_list = ('id', 'email')
+    column_searchable_list = ('email',)
+
+# favorites_count is sorted with the (favorites_count, id) index of the leaderboard
+class PlanetsView(ScalableModelView):
+    column_sortable_list = ('id', 'favorites_count')
+    column_searchable_list = ('name',)
+
+class PeopleView(PlanetsView):
+    column_select_related_list = (People.planet_relationship,)
+    # The forms look the homeworld up by name instead of listing every planet in a select
+    form_ajax_refs = {'planet_relationship': {'fields': ('name',)}}
+
+# user_id is the first column of the unique (user_id, item_id) index
+class FavoritesPlanetsView(ScalableModelView):
+    column_searchable_list = ('user_id',)
+    column_select_related_list = (FavoritesPlanets.user_relationship, FavoritesPlanets.planet_relationship)
+    form_ajax_refs = {'user_relationship': {'fields': ('email',)}, 'planet_relationship': {'fields': ('name',)}}
+
+class FavoritePeopleView(ScalableModelView):
+    column_searchable_list = ('user_id',)
+    column_select_related_list = (FavoritePeople.user_relationship, FavoritePeople.people_relationship)
+    form_ajax_refs = {'user_relationship': {'fields': ('email',)}, 'people_relationship': {'fields': ('name',)}}
 
 def setup_admin(app):
     app.secret_key = os.environ.get('FLASK_APP_KEY', 'sample key')
     app.config['FLASK_ADMIN_SWATCH'] = 'cerulean'
     admin = Admin(app, name='4Geeks Admin', template_mode='bootstrap3')
 
-    
+
     # Add your models here, for example this is how we add a the User model to the admin
-    admin.add_view(ModelView(User, db.session))
-    admin.add_view(ModelView(Planets, db.session))
-    admin.add_view(ModelView(People, db.session))
-    admin.add_view(ModelView(FavoritesPlanets, db.session))
-    admin.add_view(ModelView(FavoritePeople, db.session))
-
-    # You can duplicate that line to add mew models
-    # admin.add_view(ModelView(YourModelName, db.session))
\ No newline at end of file
+    admin.add_view(UserView(User, db.session))
+    admin.add_view(PlanetsView(Planets, db.session))
+    admin.add_view(PeopleView(People, db.session))
+    admin.add_view(FavoritesPlanetsView(FavoritesPlanets, db.session))
+    admin.add_view(FavoritePeopleView(FavoritePeople, db.session))
+
+    # You can duplicate that line to add mew models, ScalableModelView for the big tables
+    # admin.add_view(ModelView(YourModelName, db.session))
@@ -2,199 +2,366 @@
 This module takes care of starting the API Server, Loading the DB and Adding the endpoints
 """
 import os
-from flask import Flask, request, jsonify, url_for
-from flask_migrate import Migrate
-from flask_swagger import swagger
+import click
+from flask import Flask, Blueprint, request, jsonify, url_for, Response, current_app
 from flask_cors import CORS
+from werkzeug.middleware.proxy_fix import ProxyFix
 from utils import APIException, generate_sitemap
-from admin import setup_admin
+from pagination import list_results, get_page_args, get_fields_arg, parse_int_arg, DEFAULT_PAGE_SIZE
+from expansions import get_expand_arg, expand_homeworlds, get_residents
+from search import search_names
+from leaderboard import get_leaderboard, LEADERBOARDS, LEADERBOARD_MAX_LIMIT
+from cache import setup_cache, get_serialized
+from commands import setup_commands
+from etags import conditional
+from metrics import setup_metrics, render_metrics
+from compression import setup_compression
+from replicas import setup_replicas, replica_status
+from events import setup_events, event_stream, publish_favorite_changes, SSE_WSGI
+from group_commit import setup_group_commit, commit_favorite_change, ADD, REMOVE
+from ratelimit import setup_rate_limit, rate_limited
+from batch import get_batch_requests, run_batch
+from serialization import setup_json, select_serialized, serialized_rows
+from favorites import apply_bulk_favorites, get_user_favorites, get_favorite_pages, favorite_item_columns, ADDED, ALREADY_EXISTS, NOT_FOUND, MISSING_USER, MISSING_ITEM
+from database import env_flag, engine_options, pool_status, dispose_engines_after_fork
 from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
 #from models import Person
 
-app = Flask(__name__)
-app.url_map.strict_slashes = False
-
-db_url = os.getenv("DATABASE_URL")
-if db_url is not None:
-    app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
-else:
-    app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
-app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
-
-MIGRATE = Migrate(app, db)
-db.init_app(app)
-CORS(app)
-setup_admin(app)
+api = Blueprint('api', __name__)
+
+# ENABLE_MIGRATIONS=auto loads Flask-Migrate only for the flask command (flask db upgrade in the release phase),
+# the web workers never need it
+def migrations_enabled():
+    setting = os.getenv('ENABLE_MIGRATIONS', 'auto').lower()
+    if setting == 'auto':
+        return click.get_current_context(silent=True) is not None
+    return setting in ('1', 'true', 'yes', 'on')
+
+# Application factory, used by wsgi.py, asgi.py and the flask command (FLASK_APP=src/app.py finds it).
+# The admin UI (ENABLE_ADMIN) and the migration tooling are imported only when they are enabled.
+def create_app():
+    app = Flask(__name__)
+    app.url_map.strict_slashes = False
+    # Behind the router of Heroku/Render the client IP (used by the rate limits) comes in X-Forwarded-For
+    trusted_proxies = int(os.getenv('TRUSTED_PROXIES', 0))
+    if trusted_proxies:
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=trusted_proxies)
+
+    db_url = os.getenv("DATABASE_URL")
+    if db_url is not None:
+        app.config['SQLALCHEMY_DATABASE_URI'] = db_url.replace("postgres://", "postgresql://")
+    else:
+        app.config['SQLALCHEMY_DATABASE_URI'] = "sqlite:////tmp/test.db"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+    # GET requests read from DATABASE_REPLICA_URLS when it is set
+    setup_replicas(app)
+
+    db.init_app(app)
+    if migrations_enabled():
+        from flask_migrate import Migrate
+        Migrate(app, db)
+    CORS(app)
+    if env_flag('ENABLE_ADMIN', 'false'):
+        from admin import setup_admin
+        setup_admin(app)
+    setup_cache(app)
+    setup_commands(app)
+    setup_json(app)
+    setup_metrics(app)
+    setup_rate_limit(app)
+    setup_events(app)
+    setup_group_commit(app)
+    # After the metrics, so the response sizes they record are the compressed ones
+    setup_compression(app)
+    app.register_blueprint(api)
+    # gunicorn --preload imports the app before forking, the workers must not share its connections
+    dispose_engines_after_fork(app)
+    return app
 
 # Handle/serialize errors like a JSON object
-@app.errorhandler(APIException)
+@api.app_errorhandler(APIException)
 def handle_invalid_usage(error):
     return jsonify(error.to_dict()), error.status_code
 
 # generate sitemap with all your endpoints
-@app.route('/')
+@api.route('/')
 def sitemap():
-    return generate_sitemap(app)
+    return generate_sitemap(current_app)
+
+
+#Connection pool usage: checked out connections, overflow and time spent waiting for a connection.
+#With read replicas, also the pool and the health of each of them.
+@api.route('/db/pool', methods=['GET'])
+def get_pool_status():
+    results = pool_status(db.engine)
+    replicas = replica_status()
+    if replicas:
+        results = dict(results, replicas=replicas)
+    return jsonify({'msg': 'Ok', 'results': results}), 200
+
+
+#Prometheus metrics of this worker: latency, SQL statements and DB time per endpoint, response sizes and the pool.
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(render_metrics(db.engine), mimetype='text/plain; version=0.0.4')
 
 
 #Get a list of all the people in the database.
-@app.route('/people', methods=['GET'])
+#Supports ?after=<id>&limit=N (keyset pagination), ?stream=1 (chunked response) and ?expand=planet (embedded homeworld).
+#The ETags also depend on planets because of ?expand=planet.
+@api.route('/people', methods=['GET'])
+@conditional(People, Planets)
 def get_all_people():
-    people = People.query.all()
-    serialized_people = list(map(lambda item: item.serialize(), people))
-    return jsonify({'msg': 'Ok', 'results': serialized_people}), 200
+    return list_results(People)
 
 
-#Get one single person's information.
-@app.route('/people/<int:people_id>', methods=['GET'])
+#Get one single person's information, ?expand=planet embeds the homeworld.
+@api.route('/people/<int:people_id>', methods=['GET'])
+@conditional(People, Planets)
 def get_particular_people(people_id):
-    people = People.query.get(people_id)
-    serialized_people = people.serialize()
+    expand = get_expand_arg(('planet',))
+    serialized_people = get_serialized(People, people_id)
+    if serialized_people is None:
+        return ({'msg': 'The person with id {} does not exist'.format(people_id)}), 404
+    if 'planet' in expand:
+        # The cached dict is shared, the homeworld is added to a copy
+        planet_id = serialized_people['planet_id']
+        serialized_people = dict(serialized_people, planet=get_serialized(Planets, planet_id) if planet_id is not None else None)
     return jsonify({'msg': 'Ok', 'results': serialized_people}), 200
 
 
 #Get a list of all the planets in the database.
-@app.route('/planets', methods=['GET'])
+#Supports ?after=<id>&limit=N (keyset pagination) and ?stream=1 (chunked response).
+@api.route('/planets', methods=['GET'])
+@conditional(Planets)
 def get_all_planets():
-    planets = Planets.query.all()
-    serialized_planets = list(map(lambda item: item.serialize(), planets))
-    return jsonify({'msg': 'Ok', 'results': serialized_planets}), 200
+    return list_results(Planets)
 
 
 #Get one single planet's information.
-@app.route('/planets/<int:planet_id>', methods=['GET'])
+#?expand=residents embeds one page of the people living there, ?residents_after=<id>&residents_limit=N picks the page.
+@api.route('/planets/<int:planet_id>', methods=['GET'])
+@conditional(Planets, People)
 def get_particular_planet(planet_id):
-    planet = Planets.query.get(planet_id)
-    serialzed_planet = planet.serialize()
-    return jsonify({'msg': 'Ok', 'results': serialzed_planet}), 200
+    expand = get_expand_arg(('residents',))
+    residents_after, residents_limit = get_page_args('residents_')
+    serialzed_planet = get_serialized(Planets, planet_id)
+    if serialzed_planet is None:
+        return ({'msg': 'The planet with id {} does not exist'.format(planet_id)}), 404
+    if 'residents' not in expand:
+        return jsonify({'msg': 'Ok', 'results': serialzed_planet}), 200
+    residents, next_resident = get_residents(planet_id, residents_after, residents_limit or DEFAULT_PAGE_SIZE)
+    return jsonify({'msg': 'Ok', 'results': dict(serialzed_planet, residents=residents), 'next': {'residents': next_resident}}), 200
 
 
 #Get a list of all the blog post users.
-@app.route('/users', methods=['GET'])
+#Supports ?after=<id>&limit=N (keyset pagination) and ?stream=1 (chunked response).
+@api.route('/users', methods=['GET'])
 def get_all_users():
-    users = User.query.all()
-    serialized_users = list(map(lambda item: item.serialize(), users))
-    return jsonify({'msg' : 'Ok', 'results' : serialized_users}), 200
+    return list_results(User)
+
+
+SEARCH_MAX_LIMIT = int(os.getenv('SEARCH_MAX_LIMIT', 50))
+SEARCH_MAX_OFFSET = int(os.getenv('SEARCH_MAX_OFFSET', 1000))
+
+#Search people and planets by name, best matches first: ?q=sky&limit=10&offset=0
+@api.route('/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        raise APIException('The parameter q is required', status_code=400)
+    limit = min(parse_int_arg('limit', minimum=1) or 10, SEARCH_MAX_LIMIT)
+    offset = parse_int_arg('offset') or 0
+    if offset > SEARCH_MAX_OFFSET:
+        raise APIException('The parameter offset can not be greater than {}'.format(SEARCH_MAX_OFFSET), status_code=400)
+    hits = search_names(query, limit + 1, offset)
+    next_offset = offset + limit if len(hits) > limit else None
+    return jsonify({'msg': 'Ok', 'results': hits[:limit], 'next': next_offset}), 200
+
+
+#Most favorited planets or people with their number of favorites: /leaderboard/planets?limit=10
+@api.route('/leaderboard/<string:name>', methods=['GET'])
+def leaderboard(name):
+    if name not in LEADERBOARDS:
+        return ({'msg': 'There is no leaderboard {}'.format(name)}), 404
+    limit = min(parse_int_arg('limit', minimum=1) or 10, LEADERBOARD_MAX_LIMIT)
+    return jsonify({'msg': 'Ok', 'results': get_leaderboard(name, limit)}), 200
 
 
 #Get all the planets favorites that belong to the current user.
-@app.route('/favoritesPlanets/user/<int:user_id>', methods=['GET'])
+@api.route('/favoritesPlanets/user/<int:user_id>', methods=['GET'])
 def get_favorites_planets(user_id):
-    user = User.query.get(user_id)
+    user = get_serialized(User, user_id)
     if user is None:
         return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    favorites_planets = db.session.query(FavoritesPlanets, Planets).join(Planets).filter(FavoritesPlanets.user_id == user_id).all()
-    serialized_favorites_planets = []
-    for favorite_item, planet_item in favorites_planets:
-        serialized_favorites_planets.append({'planet': planet_item.serialize()})
-    return({'msg': 'ok', 'planets_favorites': serialized_favorites_planets, 'user': user.serialize()}), 200
+    favorites_planets = serialized_rows(select_serialized(Planets).join(FavoritesPlanets).where(FavoritesPlanets.user_id == user_id).order_by(FavoritesPlanets.id))
+    serialized_favorites_planets = [{'planet': planet_item} for planet_item in favorites_planets]
+    return({'msg': 'ok', 'planets_favorites': serialized_favorites_planets, 'user': user}), 200
 
 
-#Get all the people favorites that belong to the current user.
-@app.route('/favoritePeople/user/<int:user_id>', methods=['GET'])
+#Get all the people favorites that belong to the current user, ?expand=planet embeds their homeworlds.
+@api.route('/favoritePeople/user/<int:user_id>', methods=['GET'])
 def get_favorite_people(user_id):
-    user = User.query.get(user_id)
+    expand = get_expand_arg(('planet',))
+    user = get_serialized(User, user_id)
     if user is None:
         return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    favorite_people = db.session.query(FavoritePeople, People).join(People).filter(FavoritePeople.user_id == user_id).all()
-    serialized_favorite_people = []
-    for favorite_item, people_item in favorite_people:
-        serialized_favorite_people.append({'person': people_item.serialize()})
-    return({'msg': 'ok', 'people_favorite': serialized_favorite_people, 'user': user.serialize()}), 200
+    favorite_people = serialized_rows(select_serialized(People).join(FavoritePeople).where(FavoritePeople.user_id == user_id).order_by(FavoritePeople.id))
+    if 'planet' in expand:
+        expand_homeworlds(favorite_people)
+    serialized_favorite_people = [{'person': people_item} for people_item in favorite_people]
+    return({'msg': 'ok', 'people_favorite': serialized_favorite_people, 'user': user}), 200
 
 
-#Get all the favorites that belong to the current user.
-@app.route('/users/favorites/<int:user_id>', methods=['GET'])
+#Get all the favorites that belong to the current user, people and planets are read with one UNION ALL query.
+#Supports ?fields=id,name (projection), ?people_after=&people_limit= and ?planets_after=&planets_limit= (paging per type)
+#and ?expand=planet (homeworlds of the people).
+@api.route('/users/favorites/<int:user_id>', methods=['GET'])
 def get_all_favorites(user_id):
-    user = User.query.get(user_id)
+    fields = get_fields_arg(favorite_item_columns()) or list(favorite_item_columns())
+    pages = get_favorite_pages()
+    expand = get_expand_arg(('planet',))
+    user = get_serialized(User, user_id)
     if user is None:
         return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    favorite_people = db.session.query(FavoritePeople, People).join(People).filter(FavoritePeople.user_id == user_id).all()
-    print(favorite_people)
-    serialized_favorites = []
-    for favorite_item, people_item in favorite_people:
-        serialized_favorites.append({'person': people_item.serialize()})
-    favorites_planets = db.session.query(FavoritesPlanets, Planets).join(Planets).filter(FavoritesPlanets.user_id == user_id).all()
-    for favorite_item, planet_item in favorites_planets:
-        serialized_favorites.append({'planet': planet_item.serialize()})
-    return({'msg': 'Ok', 'results': serialized_favorites, 'user': user.serialize()}), 200
+    keep_planet_id = 'planet_id' in fields
+    if 'planet' in expand and not keep_planet_id:
+        fields = fields + ['planet_id']
+    serialized_favorites, next_cursors = get_user_favorites(user_id, fields, pages)
+    if 'planet' in expand:
+        expand_homeworlds([item['person'] for item in serialized_favorites if 'person' in item], keep_planet_id)
+    response = {'msg': 'Ok', 'results': serialized_favorites, 'user': user}
+    if pages[FavoritePeople][1] is not None or pages[FavoritesPlanets][1] is not None:
+        response['next'] = next_cursors
+    return response, 200
+
+
+#Change feed of the favorites of a user as Server-Sent Events, instead of polling /users/favorites/<user_id>.
+#Sends a "favorite" event {"action": "added"|"deleted", "type": "planet"|"person", "id": 1} for every change,
+#resumes after the Last-Event-ID header (or ?last_event_id=) and sends a heartbeat comment when idle.
+#Served by asgi.py on the event loop. Here every open stream would hold a thread of the WSGI server, so it answers
+#501 unless SSE_WSGI=true (gunicorn with --threads or an async worker class).
+@api.route('/users/<int:user_id>/favorites/stream', methods=['GET'])
+def stream_favorites(user_id):
+    if not SSE_WSGI:
+        return ({'msg': 'The change feed needs the async server (gunicorn asgi:application -k uvicorn.workers.UvicornWorker)'}), 501
+    if get_serialized(User, user_id) is None:
+        return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
+    last_event_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    response = Response(event_stream(user_id, last_event_id), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    # nginx and other proxies would buffer the events
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
+
+# Turns the result of a favorite mutation into the response for the client
+def favorite_response(result, item_name, item_id, user_id):
+    if result == MISSING_USER:
+        return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
+    if result == MISSING_ITEM:
+        return ({'msg': 'The {} with id {} does not exist'.format(item_name, item_id)}), 404
+    if result == ALREADY_EXISTS:
+        return ({'msg': 'The {} with id {} is already a favorite for the user with id {}'.format(item_name, item_id, user_id)}), 409
+    if result == NOT_FOUND:
+        return ({'msg': 'The {} with id {} is not a favorite for the user with id {}'.format(item_name, item_id, user_id)}), 404
+    if result == ADDED:
+        return ({'msg': 'The {} with id {} has been correctly added to the favorites of the user with id {}'.format(item_name, item_id, user_id)}), 201
+    return ({'msg': 'The {} with id {} has been correctly deleted from the favorites of the user with id {}'.format(item_name, item_id, user_id)}), 200
 
 
 # Add a new favorite planet to the current user with the planet id = planet_id
-@app.route('/favorite/planet/<int:planet_id>/user/<int:user_id>', methods=['POST'])
+@api.route('/favorite/planet/<int:planet_id>/user/<int:user_id>', methods=['POST'])
+@rate_limited('favorites')
 def add_favorite_planet(planet_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    planet = Planets.query.get(planet_id)
-    if planet is None:
-        return({'msg': 'The planet with id {} does not exist'.format(planet_id)}), 404
-    existing_favorite = db.session.query(FavoritesPlanets).filter((FavoritesPlanets.planet_id == planet_id) & (FavoritesPlanets.user_id == user_id)).all()
-    if existing_favorite:
-        return({'msg': 'The planet with id {} is already a favorite for the user with id {}'.format(planet_id, user_id)})
-    favorite_planet = FavoritesPlanets(user_id=user_id, planet_id=planet_id)
-    db.session.add(favorite_planet)
-    db.session.commit()
-    return({'msg': 'The planet with id {} has been correctly added to the favorites of the user with id {}'.format(planet_id, user_id)})
+    result = commit_favorite_change(FavoritesPlanets, ADD, user_id, planet_id)
+    publish_favorite_changes(user_id, FavoritesPlanets, [(planet_id, result)])
+    return favorite_response(result, 'planet', planet_id, user_id)
 
 
 #Add new favorite people to the current user with the people id = people_id
-@app.route('/favorite/people/<int:people_id>/user/<int:user_id>', methods=['POST'])
+@api.route('/favorite/people/<int:people_id>/user/<int:user_id>', methods=['POST'])
+@rate_limited('favorites')
 def add_favorite_person(people_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    person = People.query.get(people_id)
-    if person is None:
-        return({'msg': 'The person with id {} does not exist'.format(people_id)}), 404
-    existing_favorite = db.session.query(FavoritePeople).filter((FavoritePeople.people_id == people_id) & (FavoritePeople.user_id == user_id)).all()
-    if existing_favorite:
-        return({'msg': 'The person with id {} is already a favorite for the user with id {}'.format(people_id, user_id)})
-    favorite_person = FavoritePeople(user_id=user_id, people_id=people_id)
-    db.session.add(favorite_person)
-    db.session.commit()
-    return({'msg': 'The person with id {} has been correctly added to the favorites of the user with id {}'.format(people_id, user_id)})
+    result = commit_favorite_change(FavoritePeople, ADD, user_id, people_id)
+    publish_favorite_changes(user_id, FavoritePeople, [(people_id, result)])
+    return favorite_response(result, 'person', people_id, user_id)
 
 
 # Delete a favorite planet with the id = planet_id
-@app.route('/favorite/planet/<int:planet_id>/user/<int:user_id>', methods=['DELETE'])
+@api.route('/favorite/planet/<int:planet_id>/user/<int:user_id>', methods=['DELETE'])
+@rate_limited('favorites')
 def delete_favorite_planet(planet_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
-        return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    planet = Planets.query.get(planet_id)
-    if planet is None:
-        return({'msg': 'The planet with id {} does not exist'.format(planet_id)}), 404
-    favorite_planet_to_delete = db.session.query(FavoritesPlanets).filter((FavoritesPlanets.planet_id == planet_id) & (FavoritesPlanets.user_id == user_id)).first()
-    if favorite_planet_to_delete is None:
-        return({'msg': 'The planet with id {} is not a favorite for the user with id {}'.format(planet_id, user_id)})
-    
-    db.session.delete(favorite_planet_to_delete)
-    db.session.commit()
+    result = commit_favorite_change(FavoritesPlanets, REMOVE, user_id, planet_id)
+    publish_favorite_changes(user_id, FavoritesPlanets, [(planet_id, result)])
+    return favorite_response(result, 'planet', planet_id, user_id)
 
-    return ({'msg': 'The planet with id {} has been correctly deleted from the favorites of the user with id {}'.format(planet_id, user_id)})
 
-
-# Delete a favorite person with the id = planet_id
-@app.route('/favorite/people/<int:people_id>/user/<int:user_id>', methods=['DELETE'])
+# Delete a favorite person with the id = people_id
+@api.route('/favorite/people/<int:people_id>/user/<int:user_id>', methods=['DELETE'])
+@rate_limited('favorites')
 def delete_favorite_person(people_id, user_id):
-    user = User.query.get(user_id)
-    if user is None:
+    result = commit_favorite_change(FavoritePeople, REMOVE, user_id, people_id)
+    publish_favorite_changes(user_id, FavoritePeople, [(people_id, result)])
+    return favorite_response(result, 'person', people_id, user_id)
+
+
+BULK_FAVORITES_MAX = int(os.getenv('BULK_FAVORITES_MAX', 1000))
+
+# Reads {"add": [ids], "remove": [ids]} for one type of favorite from the bulk request body
+def get_bulk_ids(body, key):
+    changes = body.get(key) or {}
+    if not isinstance(changes, dict):
+        raise APIException('{} must be an object with "add" and "remove" lists'.format(key), status_code=400)
+    ids = {}
+    for action in ('add', 'remove'):
+        values = changes.get(action) or []
+        if not isinstance(values, list) or any(type(value) is not int for value in values):
+            raise APIException('{}.{} must be a list of ids'.format(key, action), status_code=400)
+        # Repeated ids are applied once
+        ids[action] = list(dict.fromkeys(values))
+    if set(ids['add']) & set(ids['remove']):
+        raise APIException('The same id can not be added and removed in {}'.format(key), status_code=400)
+    return ids['add'], ids['remove']
+
+
+#Add and remove many favorites of a user in one transaction.
+#Limited per user and per client IP like the single favorite endpoints (RATE_LIMIT_BULK_FAVORITES).
+#Body: {"planets": {"add": [1, 2], "remove": [3]}, "people": {"add": [4], "remove": [5]}}
+@api.route('/favorites/user/<int:user_id>', methods=['POST'])
+@rate_limited('bulk_favorites')
+def bulk_update_favorites(user_id):
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise APIException('The body must be a JSON object', status_code=400)
+    changes = {FavoritesPlanets: get_bulk_ids(body, 'planets'), FavoritePeople: get_bulk_ids(body, 'people')}
+    if sum(len(add_ids) + len(remove_ids) for add_ids, remove_ids in changes.values()) > BULK_FAVORITES_MAX:
+        raise APIException('A bulk request can change at most {} favorites'.format(BULK_FAVORITES_MAX), status_code=400)
+    if get_serialized(User, user_id) is None:
         return ({'msg': 'The user with id {} does not exist'.format(user_id)}), 404
-    person = People.query.get(people_id)
-    if person is None:
-        return({'msg': 'The person with id {} does not exist'.format(people_id)}), 404
-    favorite_person_to_delete = db.session.query(FavoritePeople).filter((FavoritePeople.people_id == people_id) & (FavoritePeople.user_id == user_id)).first()
-    if favorite_person_to_delete is None:
-        return({'msg': 'The person with id {} is not a favorite for the user with id {}'.format(people_id, user_id)})
-    
-    db.session.delete(favorite_person_to_delete)
+    results = {}
+    item_results = {}
+    for favorite_model, key in ((FavoritesPlanets, 'planets'), (FavoritePeople, 'people')):
+        add_ids, remove_ids = changes[favorite_model]
+        item_results[favorite_model] = apply_bulk_favorites(favorite_model, user_id, add_ids, remove_ids)
+        results[key] = [{'id': item_id, 'status': result} for item_id, result in item_results[favorite_model]]
     db.session.commit()
+    for favorite_model, changed in item_results.items():
+        publish_favorite_changes(user_id, favorite_model, changed)
+    return ({'msg': 'Ok', 'results': results}), 200
+
 
-    return ({'msg': 'The person with id {} has been correctly deleted from the favorites of the user with id {}'.format(people_id, user_id)})
+#Several API calls in one HTTP request, run in order through the URL map with one database session.
+#Identical GET sub-requests run once. Each result has the status code and body the call would have got on its own.
+#Body: {"requests": [{"method": "GET", "path": "/people/1"}, {"method": "POST", "path": "/favorite/planet/1/user/1"}]}
+@api.route('/batch', methods=['POST'])
+def batch():
+    sub_requests = get_batch_requests(request.get_json(silent=True))
+    return ({'msg': 'Ok', 'results': run_batch(sub_requests)}), 200
 
 
 # this only runs if `$ python src/app.py` is executed
 if __name__ == '__main__':
     PORT = int(os.environ.get('PORT', 3000))
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    create_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,311 @@
+"""
+Async serving mode: the read endpoints run on SQLAlchemy's asyncio engine, so a single worker can keep
+hundreds of requests in flight while waiting for the database. Every other route (writes, admin, sitemap...)
+is forwarded to the regular Flask app.
+
+    $ pipenv install uvicorn asgiref asyncpg aiosqlite
+    $ gunicorn asgi:application -k uvicorn.workers.UvicornWorker --chdir ./src/
+"""
+import os
+import re
+import asyncio
+from urllib.parse import parse_qsl
+from asgiref.wsgi import WsgiToAsgi
+from werkzeug.datastructures import ImmutableMultiDict
+from sqlalchemy.ext.asyncio import create_async_engine
+from app import create_app
+from utils import APIException
+from database import engine_options
+from models import User, Planets, People, FavoritesPlanets, FavoritePeople
+from pagination import ListQuery, get_page_args, get_fields_arg, stream_prefix, STREAM_CHUNK_SIZE, DEFAULT_PAGE_SIZE
+from serialization import select_serialized, wants_compact, compact_envelope
+from expansions import get_expand_arg, homeworlds_statements, attach_homeworlds, residents_statement, residents_page
+import cache
+from cache import get_cached, set_cached
+from etags import compute_etag, CATALOG_CACHE_CONTROL
+from favorites import user_favorites_statement, group_user_favorites, get_favorite_pages, favorite_item_columns
+from compression import choose_encoding, compress_body, StreamCompressor, COMPRESS_MIN_SIZE
+from events import Feed, SSE_HEARTBEAT, HEARTBEAT
+
+# The async drivers of each database, ASYNC_DATABASE_URL can be used to pick another one
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+    'mysql': 'mysql+aiomysql',
+}
+
+def async_database_url(url):
+    scheme, rest = url.split('://', 1)
+    return ASYNC_DRIVERS.get(scheme.split('+')[0], scheme) + '://' + rest
+
+app = create_app()
+async_url = os.getenv('ASYNC_DATABASE_URL') or async_database_url(app.config['SQLALCHEMY_DATABASE_URI'])
+engine = create_async_engine(async_url, **engine_options(async_url))
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=lambda: engine.sync_engine.dispose(close=False))
+flask_application = WsgiToAsgi(app)
+
+# encoding is the one negotiated with Accept-Encoding, successful bodies of COMPRESS_MIN_SIZE bytes or more use it
+async def send_response(send, status, body=b'', headers=(), head=False, encoding=None):
+    headers = list(headers)
+    if status == 200 and headers and dict(headers).get('content-type') == 'application/json':
+        headers.append(('vary', 'Accept-Encoding'))
+        if encoding is not None and len(body) >= COMPRESS_MIN_SIZE:
+            etag = dict(headers).get('etag')
+            body = compress_body(body, encoding, cached=etag is not None)
+            # Same weak ETag as the Flask app sends for compressed bodies
+            headers = [(name, 'W/' + value if name == 'etag' else value) for name, value in headers]
+            headers.append(('content-encoding', encoding))
+    response_headers = [(b'access-control-allow-origin', b'*')]
+    response_headers += [(name.encode(), value.encode()) for name, value in headers]
+    if status != 304:
+        response_headers.append((b'content-length', str(len(body)).encode()))
+    await send({'type': 'http.response.start', 'status': status, 'headers': response_headers})
+    await send({'type': 'http.response.body', 'body': b'' if head else body})
+
+async def send_json(send, status, payload, headers=(), head=False, encoding=None):
+    body = app.json.dumps(payload).encode()
+    await send_response(send, status, body, [('content-type', 'application/json')] + list(headers), head, encoding)
+
+# send() for the streamed lists, compresses every chunk as it goes out
+def compressing_send(send, encoding):
+    compressor = StreamCompressor(encoding)
+
+    async def wrapper(message):
+        if message['type'] == 'http.response.start':
+            message['headers'] = message['headers'] + [(b'content-encoding', encoding.encode()), (b'vary', b'Accept-Encoding')]
+        elif message['type'] == 'http.response.body' and message['body']:
+            body = compressor.compress(message['body'])
+            if not message.get('more_body', False):
+                body += compressor.finish()
+            message = dict(message, body=body)
+        await send(message)
+
+    return wrapper
+
+# Parsed like request.args in Flask: blank values are kept and .get() gives the first value of a repeated key
+def query_args(scope):
+    return ImmutableMultiDict(parse_qsl(scope['query_string'].decode(), keep_blank_values=True, errors='werkzeug.url_quote'))
+
+async def fetch_all(statement):
+    async with engine.connect() as connection:
+        result = await connection.execute(statement)
+        return [dict(row) for row in result.mappings()]
+
+async def expand_homeworlds(people, keep_planet_id=True):
+    planets = []
+    for statement in homeworlds_statements(people):
+        planets += await fetch_all(statement)
+    return attach_homeworlds(people, planets, keep_planet_id)
+
+async def stream_list(send, list_query, head):
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [
+        (b'content-type', b'application/json'), (b'access-control-allow-origin', b'*')
+    ]})
+    if head:
+        await send({'type': 'http.response.body', 'body': b''})
+        return
+    await send({'type': 'http.response.body', 'body': stream_prefix(list_query).encode(), 'more_body': True})
+    separator = b''
+    async with engine.connect() as connection:
+        result = await connection.stream(list_query.statement())
+        async for partition in result.mappings().partitions(STREAM_CHUNK_SIZE):
+            rows = [dict(row) for row in partition]
+            if 'planet' in list_query.expand:
+                await expand_homeworlds(rows)
+            chunk = app.json.dumps(list_query.project(rows))[1:-1].encode()
+            await send({'type': 'http.response.body', 'body': separator + chunk, 'more_body': True})
+            separator = b','
+    await send({'type': 'http.response.body', 'body': b']}'})
+
+async def list_endpoint(send, args, head, model):
+    list_query = ListQuery(model, args)
+    if list_query.stream:
+        return await stream_list(send, list_query, head)
+    rows = await fetch_all(list_query.statement())
+    if 'planet' in list_query.expand:
+        await expand_homeworlds(rows)
+    return list_query.payload(rows)
+
+async def get_serialized(model, id):
+    version = (await table_versions([model]))[0]
+    value = get_cached(model, id, version)
+    if value is None:
+        rows = await fetch_all(select_serialized(model).where(model.id == id))
+        if not rows:
+            return None
+        value = rows[0]
+        set_cached(model, id, value, version)
+    return value
+
+async def single_endpoint(send, args, head, model, id, item_name):
+    item = await get_serialized(model, int(id))
+    if item is None:
+        return 404, {'msg': 'The {} with id {} does not exist'.format(item_name, id)}
+    return {'msg': 'Ok', 'results': item}
+
+async def person_endpoint(send, args, head, id):
+    expand = get_expand_arg(('planet',), args)
+    response = await single_endpoint(send, args, head, People, id, 'person')
+    if 'planet' in expand and isinstance(response, dict):
+        person = response['results']
+        planet = await get_serialized(Planets, person['planet_id']) if person['planet_id'] is not None else None
+        response['results'] = dict(person, planet=planet)
+    return response
+
+async def planet_endpoint(send, args, head, id):
+    expand = get_expand_arg(('residents',), args)
+    after, limit = get_page_args('residents_', args=args)
+    response = await single_endpoint(send, args, head, Planets, id, 'planet')
+    if 'residents' in expand and isinstance(response, dict):
+        limit = limit or DEFAULT_PAGE_SIZE
+        residents, next_resident = residents_page(await fetch_all(residents_statement(int(id), after, limit)), limit)
+        response['results'] = dict(response['results'], residents=residents)
+        response['next'] = {'residents': next_resident}
+    return response
+
+async def favorites_endpoint(send, args, head, user_id):
+    fields = get_fields_arg(favorite_item_columns(), args=args) or list(favorite_item_columns())
+    pages = get_favorite_pages(args)
+    expand = get_expand_arg(('planet',), args)
+    user = await get_serialized(User, int(user_id))
+    if user is None:
+        return 404, {'msg': 'The user with id {} does not exist'.format(user_id)}
+    keep_planet_id = 'planet_id' in fields
+    if 'planet' in expand and not keep_planet_id:
+        fields = fields + ['planet_id']
+    rows = await fetch_all(user_favorites_statement(int(user_id), fields, pages))
+    serialized_favorites, next_cursors = group_user_favorites(rows, fields, pages)
+    if 'planet' in expand:
+        await expand_homeworlds([item['person'] for item in serialized_favorites if 'person' in item], keep_planet_id)
+    response = {'msg': 'Ok', 'results': serialized_favorites, 'user': user}
+    if pages[FavoritePeople][1] is not None or pages[FavoritesPlanets][1] is not None:
+        response['next'] = next_cursors
+    return response
+
+async def favorite_planets_endpoint(send, args, head, user_id):
+    user = await get_serialized(User, int(user_id))
+    if user is None:
+        return 404, {'msg': 'The user with id {} does not exist'.format(user_id)}
+    planets = await fetch_all(select_serialized(Planets).join(FavoritesPlanets).where(FavoritesPlanets.user_id == int(user_id)).order_by(FavoritesPlanets.id))
+    return {'msg': 'ok', 'planets_favorites': [{'planet': planet} for planet in planets], 'user': user}
+
+async def favorite_people_endpoint(send, args, head, user_id):
+    expand = get_expand_arg(('planet',), args)
+    user = await get_serialized(User, int(user_id))
+    if user is None:
+        return 404, {'msg': 'The user with id {} does not exist'.format(user_id)}
+    people = await fetch_all(select_serialized(People).join(FavoritePeople).where(FavoritePeople.user_id == int(user_id)).order_by(FavoritePeople.id))
+    if 'planet' in expand:
+        await expand_homeworlds(people)
+    return {'msg': 'ok', 'people_favorite': [{'person': person} for person in people], 'user': user}
+
+async def wait_for_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
+
+# Change feed of the favorites of a user (see the Flask route). An idle client is a coroutine waiting on an
+# asyncio.Event, so a worker can keep thousands of them open.
+async def favorites_stream(scope, receive, send, user_id):
+    user_id = int(user_id)
+    if await get_serialized(User, user_id) is None:
+        return await send_json(send, 404, {'msg': 'The user with id {} does not exist'.format(user_id)})
+    args = query_args(scope)
+    last_event_id = dict(scope['headers']).get(b'last-event-id', b'').decode('latin-1') or args.get('last_event_id')
+    loop = asyncio.get_running_loop()
+    wakeup = asyncio.Event()
+
+    # Events are published by the Flask handlers in other threads
+    def notify():
+        try:
+            loop.call_soon_threadsafe(wakeup.set)
+        except RuntimeError:
+            pass
+
+    feed = Feed(user_id, last_event_id, notify)
+    disconnected = asyncio.ensure_future(wait_for_disconnect(receive))
+    try:
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'text/event-stream; charset=utf-8'), (b'cache-control', b'no-cache'),
+            (b'x-accel-buffering', b'no'), (b'access-control-allow-origin', b'*'),
+        ]})
+        await send({'type': 'http.response.body', 'body': feed.opening().encode(), 'more_body': True})
+        while not disconnected.done():
+            woken = asyncio.ensure_future(wakeup.wait())
+            await asyncio.wait((woken, disconnected), timeout=SSE_HEARTBEAT, return_when=asyncio.FIRST_COMPLETED)
+            woken.cancel()
+            if disconnected.done():
+                break
+            wakeup.clear()
+            await send({'type': 'http.response.body', 'body': (feed.pending() or HEARTBEAT).encode(), 'more_body': True})
+    finally:
+        feed.close()
+        disconnected.cancel()
+
+FAVORITES_STREAM = re.compile(r'^/users/(?P<user_id>\d+)/favorites/stream/?$')
+
+# Same paths as the Flask routes (trailing slash optional), with the tables the catalog ETags depend on
+ROUTES = [
+    (re.compile(r'^/people/?$'), (People, Planets), lambda send, args, head: list_endpoint(send, args, head, People)),
+    (re.compile(r'^/people/(?P<id>\d+)/?$'), (People, Planets), person_endpoint),
+    (re.compile(r'^/planets/?$'), (Planets,), lambda send, args, head: list_endpoint(send, args, head, Planets)),
+    (re.compile(r'^/planets/(?P<id>\d+)/?$'), (Planets, People), planet_endpoint),
+    (re.compile(r'^/users/?$'), (), lambda send, args, head: list_endpoint(send, args, head, User)),
+    (re.compile(r'^/users/favorites/(?P<user_id>\d+)/?$'), (), favorites_endpoint),
+    (re.compile(r'^/favoritesPlanets/user/(?P<user_id>\d+)/?$'), (), favorite_planets_endpoint),
+    (re.compile(r'^/favoritePeople/user/(?P<user_id>\d+)/?$'), (), favorite_people_endpoint),
+]
+
+# Versions of the tables of the ETag, the copy of the versions is refreshed on the async engine when it is stale
+async def table_versions(models):
+    versions = cache.versions
+    if versions.stale():
+        versions.store([(row['table_name'], row['version']) for row in await fetch_all(versions.statement())])
+    return versions.lookup([model.__tablename__ for model in models])
+
+async def handle_read(scope, send, etag_models, view, params):
+    head = scope['method'] == 'HEAD'
+    query_string = scope['query_string'].decode('latin-1')
+    args = query_args(scope)
+    encoding = choose_encoding(dict(scope['headers']).get(b'accept-encoding', b'').decode('latin-1'))
+    headers = []
+    if etag_models:
+        etag = '"{}"'.format(compute_etag(etag_models, scope['path'] + '?' + query_string, await table_versions(etag_models)))
+        headers = [('etag', etag), ('cache-control', CATALOG_CACHE_CONTROL)]
+        if_none_match = dict(scope['headers']).get(b'if-none-match', b'').decode('latin-1')
+        if etag in [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')] or if_none_match.strip() == '*':
+            return await send_response(send, 304, headers=headers)
+    view_send = compressing_send(send, encoding) if encoding is not None and not head else send
+    try:
+        result = await view(view_send, args, head, **params)
+    except APIException as error:
+        return await send_json(send, error.status_code, error.to_dict(), head=head)
+    if result is None:
+        return
+    status = 200
+    if isinstance(result, tuple):
+        status, result = result
+    if wants_compact(args):
+        result = compact_envelope(result)
+    await send_json(send, status, result, headers if status == 200 else (), head, encoding)
+
+async def application(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                await engine.dispose()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] == 'http' and scope['method'] == 'GET':
+        match = FAVORITES_STREAM.match(scope['path'])
+        if match is not None:
+            return await favorites_stream(scope, receive, send, **match.groupdict())
+    if scope['type'] == 'http' and scope['method'] in ('GET', 'HEAD'):
+        for pattern, etag_models, view in ROUTES:
+            match = pattern.match(scope['path'])
+            if match is not None:
+                return await handle_read(scope, send, etag_models, view, match.groupdict())
+    await flask_application(scope, receive, send)
@@ -0,0 +1,98 @@
+import os
+import json
+import logging
+from flask import current_app, request
+from werkzeug.test import EnvironBuilder
+from werkzeug.exceptions import HTTPException
+from utils import APIException
+from models import db
+
+BATCH_MAX_REQUESTS = int(os.getenv('BATCH_MAX_REQUESTS', 50))
+
+# Identical sub-requests with these methods run once and share their response, the others run every time
+# (adding the same favorite twice must answer 201 and then 409)
+DEDUPLICATED_METHODS = ('GET', 'HEAD')
+# Headers of the batch request every sub-request gets unless it sets them, the last write of the client
+# (see replicas.py) keeps its reads after its writes on the primary
+INHERITED_HEADERS = ('Cookie', 'X-Last-Write')
+# Headers of the sub-responses returned with their status and body
+RESPONSE_HEADERS = ('ETag', 'Cache-Control', 'Retry-After')
+
+batch_logger = logging.getLogger('batch')
+
+# Reads {"requests": [{"method": "GET", "path": "/people/1?expand=planet", "headers": {...}, "body": {...}}]},
+# method defaults to GET
+def get_batch_requests(body):
+    if not isinstance(body, dict) or not isinstance(body.get('requests'), list):
+        raise APIException('The body must be a JSON object with a "requests" list', status_code=400)
+    if len(body['requests']) > BATCH_MAX_REQUESTS:
+        raise APIException('A batch can have at most {} requests'.format(BATCH_MAX_REQUESTS), status_code=400)
+    sub_requests = []
+    for index, item in enumerate(body['requests']):
+        if not isinstance(item, dict) or not isinstance(item.get('path'), str) or not item['path'].startswith('/'):
+            raise APIException('requests[{}] must be an object with a "path" starting with /'.format(index), status_code=400)
+        method = item.get('method', 'GET')
+        headers = item.get('headers') or {}
+        if not isinstance(method, str):
+            raise APIException('requests[{}].method must be a string'.format(index), status_code=400)
+        if not isinstance(headers, dict) or any(not isinstance(value, str) for value in headers.values()):
+            raise APIException('requests[{}].headers must be an object of strings'.format(index), status_code=400)
+        sub_requests.append({'method': method.upper(), 'path': item['path'], 'headers': headers, 'body': item.get('body')})
+    return sub_requests
+
+# Runs one sub-request through the URL map in a request context of its own. The app context (and with it the
+# database session, its connection and the replica it reads from) is the one of the batch request.
+# The before/after_request hooks do not run: the metrics and the compression are the ones of the batch.
+def dispatch(sub_request):
+    headers = {name: request.headers[name] for name in INHERITED_HEADERS if name in request.headers}
+    headers.update(sub_request['headers'])
+    builder = EnvironBuilder(
+        path=sub_request['path'], method=sub_request['method'], headers=headers, json=sub_request['body'],
+        base_url=request.host_url, environ_base={'REMOTE_ADDR': request.remote_addr},
+    )
+    try:
+        environ = builder.get_environ()
+    finally:
+        builder.close()
+    with current_app.request_context(environ):
+        if request.endpoint == 'api.batch':
+            return {'status': 400, 'body': {'msg': 'A batch can not contain another batch'}}
+        try:
+            response = current_app.make_response(current_app.dispatch_request())
+        except HTTPException as error:
+            response = current_app.make_response(({'msg': error.description}, error.code))
+        except APIException as error:
+            response = current_app.make_response((error.to_dict(), error.status_code))
+        except Exception:
+            batch_logger.exception('%s %s failed in a batch', sub_request['method'], sub_request['path'])
+            # The next sub-requests use the same session
+            db.session.rollback()
+            response = current_app.make_response(({'msg': 'Internal server error'}, 500))
+        return sub_response(response)
+
+def sub_response(response):
+    # A chunked list (?stream=1) or the change feed would never end or be read twice
+    if response.is_streamed:
+        response.close()
+        return {'status': 400, 'body': {'msg': 'Streamed responses can not be part of a batch'}}
+    result = {'status': response.status_code, 'body': response.get_json(silent=True) if response.is_json else response.get_data(as_text=True) or None}
+    headers = {name: response.headers[name] for name in RESPONSE_HEADERS if name in response.headers}
+    if headers:
+        result['headers'] = headers
+    return result
+
+# Results in the order of the sub-requests, which run one after the other so a read after a write sees it.
+# A write also forgets the responses kept for the duplicates, the reads after it run again.
+def run_batch(sub_requests):
+    results = []
+    responses = {}
+    for sub_request in sub_requests:
+        if sub_request['method'] not in DEDUPLICATED_METHODS:
+            responses.clear()
+            results.append(dispatch(sub_request))
+            continue
+        key = json.dumps(sub_request, sort_keys=True)
+        if key not in responses:
+            responses[key] = dispatch(sub_request)
+        results.append(responses[key])
+    return results
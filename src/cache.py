@@ -0,0 +1,252 @@
+import os
+import json
+import time
+import logging
+import threading
+from collections import OrderedDict
+from sqlalchemy import event, select, update
+from sqlalchemy.exc import IntegrityError
+from models import db, TableVersion
+from serialization import select_serialized
+
+# Seconds a worker uses its copy of the table versions before reading them again
+VERSIONS_REFRESH = float(os.getenv('VERSIONS_REFRESH', 1))
+# Tries of a version bump after a commit, the delay grows by VERSIONS_BUMP_RETRY_DELAY seconds after each one
+VERSIONS_BUMP_ATTEMPTS = int(os.getenv('VERSIONS_BUMP_ATTEMPTS', 3))
+VERSIONS_BUMP_RETRY_DELAY = float(os.getenv('VERSIONS_BUMP_RETRY_DELAY', 0.05))
+
+cache_logger = logging.getLogger('cache')
+
+# Any backend only needs get/set/delete/clear, so a shared cache (Redis, memcached...) can replace the in-process one.
+class LRUCache:
+    def __init__(self, max_size=10000, ttl=300):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.items.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = (value, time.monotonic() + self.ttl)
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+# Same interface on top of a redis-py compatible client, values are stored as JSON with an expiration.
+class RedisCache:
+    def __init__(self, client, ttl=300, prefix='swapi:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return json.loads(value) if value is not None else None
+
+    def set(self, key, value):
+        self.client.setex(self.prefix + key, self.ttl, json.dumps(value))
+
+    def delete(self, key):
+        self.client.delete(self.prefix + key)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+cache = LRUCache()
+
+def cache_key(model, id):
+    return '{}:{}'.format(model.__tablename__, id)
+
+# Read-through lookup: returns the serialized row (or None if it does not exist), hitting the database only on a miss.
+# Every entry keeps the version of its table it was read at (see DatabaseVersions), an entry older than the current
+# version is a miss: a worker that did not make the write never serves the old row under the new ETag.
+def get_serialized(model, id):
+    version = table_version(model)
+    value = get_cached(model, id, version)
+    if value is None:
+        # From the primary like the versions: a replica behind it would put an old row in the cache under the
+        # current version, where every worker would find it until the next write
+        row = db.session.execute(select_serialized(model).where(model.id == id), bind_arguments={'bind': db.engine}).mappings().first()
+        if row is None:
+            return None
+        value = dict(row)
+        set_cached(model, id, value, version)
+    return value
+
+def table_version(model):
+    return get_table_versions([model.__tablename__])[0]
+
+def get_cached(model, id, version):
+    entry = cache.get(cache_key(model, id))
+    if entry is None or entry['version'] < version:
+        return None
+    return entry['value']
+
+# version has to be read before the row, so the row is at least as new as the version it is stored with
+def set_cached(model, id, value, version):
+    cache.set(cache_key(model, id), {'version': version, 'value': value})
+
+# Version of every table: a counter of its committed writes shared by all the workers (see the ETags in etags.py).
+# It lives in the table_versions table, never in the cache, so it can not expire or be evicted.
+# Each worker keeps a copy of the whole table for VERSIONS_REFRESH seconds, so the cache hits and the 304s do not
+# query the database. A write of another worker is seen within that time, the writes of this one at once.
+class DatabaseVersions:
+    def __init__(self, refresh=VERSIONS_REFRESH):
+        self.refresh = refresh
+        self.values = {}
+        self.read_at = None
+
+    # Read from the primary, a replica behind it would give versions older than the rows cached under them
+    def statement(self):
+        return select(TableVersion.table_name, TableVersion.version)
+
+    def stale(self):
+        return self.read_at is None or time.monotonic() - self.read_at >= self.refresh
+
+    # Versions never go down, a slower refresh finishing after a newer one does not undo it
+    def store(self, rows):
+        values = dict(self.values)
+        for table_name, version in rows:
+            values[table_name] = max(version, values.get(table_name, 0))
+        self.values = values
+        self.read_at = time.monotonic()
+
+    # Tables never written have no row yet, they are at version 0
+    def lookup(self, table_names):
+        values = self.values
+        return [values.get(table_name, 0) for table_name in table_names]
+
+    def get(self, table_names):
+        if self.stale():
+            with db.engine.connect() as connection:
+                self.store(connection.execute(self.statement()).all())
+        return self.lookup(table_names)
+
+    # Runs after the commit on a connection of its own, the session can not be used anymore
+    def bump(self, table_names):
+        table_names = sorted(table_names)
+        with db.engine.begin() as connection:
+            for table_name in table_names:
+                bumped = connection.execute(
+                    update(TableVersion).where(TableVersion.table_name == table_name).values(version=TableVersion.version + 1)
+                ).rowcount
+                if not bumped:
+                    try:
+                        with connection.begin_nested():
+                            connection.execute(TableVersion.__table__.insert().values(table_name=table_name, version=1))
+                    except IntegrityError:
+                        # Another worker created it in between
+                        connection.execute(update(TableVersion).where(TableVersion.table_name == table_name).values(version=TableVersion.version + 1))
+        # The next lookup reads them again, with this write
+        self.read_at = None
+
+# Same interface on a Redis hash without expiration, next to the Redis cache (outside of its prefix, so clear() keeps it)
+class RedisVersions:
+    def __init__(self, client, key='swapi_versions'):
+        self.client = client
+        self.key = key
+
+    # Every lookup reads the hash, it is as cheap as a cache hit and always current
+    def stale(self):
+        return False
+
+    def lookup(self, table_names):
+        return [int(version or 0) for version in self.client.hmget(self.key, table_names)]
+
+    def get(self, table_names):
+        return self.lookup(table_names)
+
+    def bump(self, table_names):
+        pipeline = self.client.pipeline()
+        for table_name in table_names:
+            pipeline.hincrby(self.key, table_name, 1)
+        pipeline.execute()
+
+versions = DatabaseVersions()
+
+def get_table_versions(table_names):
+    return versions.get(list(table_names))
+
+def bump_table_versions(table_names):
+    table_names = list(table_names)
+    if not table_names:
+        return
+    # The write is committed already, it can not be undone: the bump is retried (a lock timeout, a lost connection),
+    # and if it still fails the cached rows are dropped, so at least this worker does not serve them anymore.
+    # The ETags of the tables stay the same until their next write.
+    for attempt in range(1, VERSIONS_BUMP_ATTEMPTS + 1):
+        try:
+            versions.bump(table_names)
+            return
+        except Exception:
+            if attempt == VERSIONS_BUMP_ATTEMPTS:
+                cache_logger.exception('Could not bump the versions of %s, clearing the cache', ', '.join(table_names))
+                cache.clear()
+                return
+            cache_logger.warning('Could not bump the versions of %s, retrying', ', '.join(table_names), exc_info=True)
+            time.sleep(VERSIONS_BUMP_RETRY_DELAY * attempt)
+
+def _collect_dirty_keys(session, flush_context):
+    keys = session.info.setdefault('cache_keys', set())
+    tables = session.info.setdefault('cache_tables', set())
+    for item in list(session.new) + list(session.dirty) + list(session.deleted):
+        tables.add(item.__table__.name)
+        if hasattr(item, 'serialize') and getattr(item, 'id', None) is not None:
+            keys.add(cache_key(type(item), item.id))
+
+def _invalidate_after_commit(session):
+    for key in session.info.pop('cache_keys', ()):
+        cache.delete(key)
+    bump_table_versions(session.info.pop('cache_tables', ()))
+
+def _discard_after_rollback(session):
+    session.info.pop('cache_keys', None)
+    session.info.pop('cache_tables', None)
+
+def _clear_after_bulk_statement(update_context):
+    cache.clear()
+    update_context.session.info.setdefault('cache_tables', set()).add(update_context.mapper.local_table.name)
+
+def setup_cache(app):
+    global cache, versions
+    ttl = int(os.getenv('CACHE_TTL', 300))
+    redis_url = os.getenv('CACHE_REDIS_URL')
+    if redis_url is not None:
+        import redis
+        client = redis.Redis.from_url(redis_url)
+        cache = RedisCache(client, ttl=ttl)
+        versions = RedisVersions(client)
+    else:
+        cache = LRUCache(max_size=int(os.getenv('CACHE_MAX_SIZE', 10000)), ttl=ttl)
+        versions = DatabaseVersions()
+
+    # Every write goes through db.session (the API handlers and the Flask-Admin ModelViews),
+    # so the keys touched by a flush are dropped once the transaction is committed.
+    if not event.contains(db.session, 'after_flush', _collect_dirty_keys):
+        event.listen(db.session, 'after_flush', _collect_dirty_keys)
+        event.listen(db.session, 'after_commit', _invalidate_after_commit)
+        event.listen(db.session, 'after_rollback', _discard_after_rollback)
+        event.listen(db.session, 'after_bulk_update', _clear_after_bulk_statement)
+        event.listen(db.session, 'after_bulk_delete', _clear_after_bulk_statement)
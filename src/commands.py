@@ -0,0 +1,53 @@
+import sys
+import click
+from contextlib import nullcontext
+from sqlalchemy.exc import IntegrityError
+from models import db
+from leaderboard import LEADERBOARDS, rebuild_favorites_counts
+from transfer import TRANSFER_TABLES, TRANSFER_BATCH_SIZE, FORMATS, TransferError, file_format, import_rows, export_rows
+
+def setup_commands(app):
+
+    # $ flask rebuild-favorites-counts, recomputes the favorites_count of planets and people from the favorites tables
+    @app.cli.command('rebuild-favorites-counts')
+    def rebuild_counts():
+        for name in LEADERBOARDS:
+            fixed = rebuild_favorites_counts(name)
+            db.session.commit()
+            click.echo('{}: {} counts fixed'.format(name, fixed))
+
+    # $ flask import-data planets planets.jsonl, upserts the rows of a JSON Lines or CSV file ('-' reads stdin)
+    @app.cli.command('import-data', help=(
+        'Upserts the rows of a JSON Lines or CSV file into TABLE. The ETags and the search of every worker see them '
+        'at once, the entity caches of the running workers only after CACHE_TTL unless CACHE_REDIS_URL is set.'
+    ))
+    @click.argument('table', type=click.Choice(list(TRANSFER_TABLES)))
+    @click.argument('path')
+    @click.option('--format', type=click.Choice(FORMATS), help='Defaults to the extension of the file')
+    @click.option('--batch-size', type=click.IntRange(min=1), default=TRANSFER_BATCH_SIZE, show_default=True)
+    def import_data(table, path, format, batch_size):
+        try:
+            format = file_format(path, format)
+            with (open(path, newline='', encoding='utf-8') if path != '-' else nullcontext(sys.stdin)) as stream:
+                count = import_rows(table, stream, format, batch_size)
+        except TransferError as error:
+            raise click.ClickException(str(error))
+        except IntegrityError as error:
+            raise click.ClickException('A batch of {} was rejected by the database: {}'.format(table, error.orig))
+        click.echo('{}: {} rows imported'.format(table, count), err=True)
+
+    # $ flask export-data people people.csv, writes a whole table as JSON Lines or CSV ('-' writes to stdout)
+    @app.cli.command('export-data')
+    @click.argument('table', type=click.Choice(list(TRANSFER_TABLES)))
+    @click.argument('path')
+    @click.option('--format', type=click.Choice(FORMATS), help='Defaults to the extension of the file')
+    @click.option('--batch-size', type=click.IntRange(min=1), default=TRANSFER_BATCH_SIZE, show_default=True)
+    @click.option('--include-passwords', is_flag=True, help='Also write the password column of the users')
+    def export_data(table, path, format, batch_size, include_passwords):
+        try:
+            format = file_format(path, format)
+        except TransferError as error:
+            raise click.ClickException(str(error))
+        with (open(path, 'w', newline='', encoding='utf-8') if path != '-' else nullcontext(sys.stdout)) as stream:
+            count = export_rows(table, stream, format, batch_size, include_secrets=include_passwords)
+        click.echo('{}: {} rows exported'.format(table, count), err=True)
@@ -0,0 +1,120 @@
+import os
+import gzip
+import zlib
+import hashlib
+from flask import request
+from cache import LRUCache
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.getenv('COMPRESS_MIN_SIZE', 1024))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', 6))
+BROTLI_QUALITY = int(os.getenv('BROTLI_QUALITY', 5))
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/plain', 'text/html')
+
+# Compressed bodies of the responses with an ETag (the catalog), keyed by a digest of the uncompressed body and
+# the encoding. Another body gets another key, so an entry never has to be invalidated and never serves another URL.
+# Bytes can not go to Redis as JSON, these always stay in the memory of the worker.
+compressed_bodies = LRUCache(max_size=int(os.getenv('COMPRESS_CACHE_SIZE', 256)), ttl=int(os.getenv('COMPRESS_CACHE_TTL', 3600)))
+
+# Brotli (when installed) over gzip, only for clients that accept them
+def choose_encoding(accept_encoding):
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        quality = 1.0
+        if params.strip().startswith('q='):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ('br', 'gzip'):
+        if encoding == 'br' and brotli is None:
+            continue
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return None
+
+# Bodies compressed once and cached are worth a slower, better level
+def compress(body, encoding, cached=False):
+    if encoding == 'br':
+        return brotli.compress(body, quality=9 if cached else BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=9 if cached else COMPRESS_LEVEL, mtime=0)
+
+# Compresses a streamed body chunk by chunk, every chunk is flushed so the client gets the rows as they come
+class StreamCompressor:
+    def __init__(self, encoding):
+        self.encoding = encoding
+        if encoding == 'br':
+            self.compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        else:
+            self.compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+    def compress(self, chunk):
+        if isinstance(chunk, str):
+            chunk = chunk.encode()
+        if self.encoding == 'br':
+            return self.compressor.process(chunk) + self.compressor.flush()
+        return self.compressor.compress(chunk) + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self.compressor.finish()
+        return self.compressor.flush()
+
+def compress_stream(chunks, encoding):
+    compressor = StreamCompressor(encoding)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.finish()
+
+# Compressed body of a complete response, cached for the responses with an ETag (the catalog endpoints)
+def compress_body(body, encoding, cached=False):
+    if not cached:
+        return compress(body, encoding)
+    key = '{}:{}'.format(hashlib.blake2b(body, digest_size=16).hexdigest(), encoding)
+    compressed = compressed_bodies.get(key)
+    if compressed is None:
+        compressed = compress(body, encoding, cached=True)
+        compressed_bodies.set(key, compressed)
+    return compressed
+
+def compressible(response):
+    return (
+        response.status_code == 200
+        and response.mimetype in COMPRESSIBLE_MIMETYPES
+        and 'Content-Encoding' not in response.headers
+        and request.method != 'HEAD'
+    )
+
+def setup_compression(app):
+
+    # gzip/brotli negotiated with Accept-Encoding for JSON bodies of at least COMPRESS_MIN_SIZE bytes and for streams
+    @app.after_request
+    def compress_response(response):
+        if not compressible(response):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.headers.get('Accept-Encoding', ''))
+        if encoding is None:
+            return response
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.direct_passthrough = False
+        else:
+            body = response.get_data()
+            if len(body) < COMPRESS_MIN_SIZE:
+                return response
+            etag, weak = response.get_etag()
+            response.set_data(compress_body(body, encoding, cached=etag is not None))
+            if etag is not None:
+                # The compressed body is another representation, a weak ETag still matches If-None-Match
+                response.set_etag(etag, weak=True)
+        response.headers['Content-Encoding'] = encoding
+        return response
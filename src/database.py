@@ -0,0 +1,147 @@
+import os
+import time
+import sqlite3
+import threading
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+from flask_sqlalchemy.session import Session
+
+def env_flag(name, default):
+    return os.getenv(name, default).lower() in ('1', 'true', 'yes', 'on')
+
+# SQLite connection settings, WAL lets readers work while a writer holds the lock
+SQLITE_JOURNAL_MODE = os.getenv('SQLITE_JOURNAL_MODE', 'WAL')
+SQLITE_SYNCHRONOUS = os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL')
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv('SQLITE_BUSY_TIMEOUT_MS', 5000))
+
+# QueuePool that also measures how long requests wait for a free connection
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        QueuePool.__init__(self, *args, **kwargs)
+        self.stats_lock = threading.Lock()
+        self.waits = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.timeouts = 0
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return QueuePool._do_get(self)
+        except TimeoutError:
+            with self.stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self.stats_lock:
+                self.waits += 1
+                self.wait_seconds += waited
+                self.max_wait_seconds = max(self.max_wait_seconds, waited)
+
+ASYNC_DRIVERS = ('asyncpg', 'aiosqlite', 'aiomysql', 'asyncmy', 'psycopg_async')
+
+def is_memory_sqlite(url):
+    return url.startswith('sqlite') and (url.rstrip('/') in ('sqlite:', 'sqlite+pysqlite:') or ':memory:' in url or 'mode=memory' in url)
+
+# SQLALCHEMY_ENGINE_OPTIONS built from the environment:
+#   DB_POOL_SIZE, DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE, DB_POOL_PRE_PING,
+#   DB_STATEMENT_TIMEOUT_MS and DB_PGBOUNCER (PgBouncer in transaction pooling mode).
+# Works for the sync URL of Flask-SQLAlchemy and the async URL of asgi.py.
+def engine_options(url):
+    options = {
+        'pool_pre_ping': env_flag('DB_POOL_PRE_PING', 'true'),
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', 1800)),
+    }
+    if is_memory_sqlite(url):
+        return options
+    options['pool_size'] = int(os.getenv('DB_POOL_SIZE', 5))
+    options['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', 10))
+    options['pool_timeout'] = float(os.getenv('DB_POOL_TIMEOUT', 30))
+    # Async engines need their own asyncio aware pool
+    if url.split('://')[0].split('+')[-1] not in ASYNC_DRIVERS:
+        options['poolclass'] = TimedQueuePool
+
+    connect_args = {}
+    statement_timeout = os.getenv('DB_STATEMENT_TIMEOUT_MS')
+    pgbouncer = env_flag('DB_PGBOUNCER', 'false')
+    if url.startswith('postgresql'):
+        asyncpg = '+asyncpg' in url
+        # PgBouncer hands each transaction to any server connection, so server-side prepared statements can not be reused.
+        # psycopg2 never prepares them, asyncpg and psycopg 3 do unless told otherwise.
+        if pgbouncer and asyncpg:
+            connect_args['statement_cache_size'] = 0
+            connect_args['prepared_statement_cache_size'] = 0
+        elif pgbouncer and url.startswith('postgresql+psycopg:'):
+            connect_args['prepare_threshold'] = None
+        # PgBouncer rejects startup parameters, behind it the timeout has to be set on the database role
+        if statement_timeout is not None and not pgbouncer:
+            if asyncpg:
+                connect_args['server_settings'] = {'statement_timeout': statement_timeout}
+            else:
+                connect_args['options'] = '-c statement_timeout={}'.format(statement_timeout)
+    elif url.startswith('mysql') and statement_timeout is not None:
+        connect_args['init_command'] = 'SET SESSION max_execution_time={}'.format(int(statement_timeout))
+    if connect_args:
+        options['connect_args'] = connect_args
+    return options
+
+# SQLite ignores foreign keys unless asked for (the favorites endpoints rely on them to detect missing users/items),
+# the other pragmas come from SQLITE_JOURNAL_MODE, SQLITE_SYNCHRONOUS and SQLITE_BUSY_TIMEOUT_MS.
+@event.listens_for(Engine, 'connect')
+def configure_sqlite_connection(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        cursor = dbapi_connection.cursor()
+        cursor.execute('PRAGMA foreign_keys=ON')
+        cursor.execute('PRAGMA journal_mode={}'.format(SQLITE_JOURNAL_MODE))
+        cursor.execute('PRAGMA synchronous={}'.format(SQLITE_SYNCHRONOUS))
+        cursor.execute('PRAGMA busy_timeout={}'.format(SQLITE_BUSY_TIMEOUT_MS))
+        cursor.close()
+
+# Connections opened before a fork (gunicorn --preload imports the app in the master) must not be used by two processes.
+# dispose(close=False) gives each child a new pool and leaves the sockets of the parent alone.
+def dispose_engines_after_fork(app):
+    if not hasattr(os, 'register_at_fork'):
+        return
+
+    def dispose():
+        with app.app_context():
+            for engine in app.extensions['sqlalchemy'].engines.values():
+                engine.dispose(close=False)
+
+    os.register_at_fork(after_in_child=dispose)
+
+# Session of db, a router (the read replicas, see replicas.py) can send a statement to another engine.
+# Without a router or when it declines, the engine is chosen like in Flask-SQLAlchemy (the primary database).
+class RoutingSession(Session):
+    router = None
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.router is not None:
+            engine = self.router.read_engine(self, clause)
+            if engine is not None:
+                return engine
+        return Session.get_bind(self, mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+def pool_status(engine):
+    pool = engine.pool
+    status = {'pool': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        status.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+        })
+    if isinstance(pool, TimedQueuePool):
+        with pool.stats_lock:
+            status.update({
+                'checkouts': pool.waits,
+                'checkout_timeouts': pool.timeouts,
+                'wait_seconds_total': round(pool.wait_seconds, 6),
+                'wait_seconds_max': round(pool.max_wait_seconds, 6),
+            })
+    return status
@@ -0,0 +1,36 @@
+import os
+import hashlib
+from functools import wraps
+from flask import request, make_response
+from cache import get_table_versions
+
+CATALOG_CACHE_CONTROL = os.getenv('CATALOG_CACHE_CONTROL', 'public, no-cache')
+
+# Strong ETag made of the version of every table the response is built from plus a digest of the
+# path and query string, so each page, projection, etc. gets its own tag. No hashing of the body needed.
+# versions are read from the shared counters unless the caller (asgi.py) already has them.
+def compute_etag(models, full_path=None, versions=None):
+    if full_path is None:
+        full_path = request.full_path
+    if versions is None:
+        versions = get_table_versions(model.__tablename__ for model in models)
+    return '{}-{}'.format('-'.join(str(version) for version in versions), hashlib.blake2b(full_path.encode(), digest_size=16).hexdigest())
+
+# Conditional GET for the catalog endpoints: an If-None-Match with the current ETag gets a 304
+# before the view runs. The versions come from the copy of the worker (or the Redis hash), so it does not query the database.
+def conditional(*models):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            etag = compute_etag(models)
+            if request.if_none_match.contains_weak(etag):
+                response = make_response('', 304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.headers['Cache-Control'] = CATALOG_CACHE_CONTROL
+            return response
+        return wrapper
+    return decorator
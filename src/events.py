@@ -0,0 +1,254 @@
+import os
+import json
+import time
+import threading
+from collections import deque, OrderedDict
+from database import env_flag
+from favorites import FAVORITE_TYPES, ADDED, DELETED
+
+SSE_HEARTBEAT = float(os.getenv('SSE_HEARTBEAT', 15))
+SSE_RETRY_MS = int(os.getenv('SSE_RETRY_MS', 3000))
+# The change feed is served by asgi.py. Under WSGI every open stream holds a worker for as long as the client stays,
+# so the Flask route answers 501 unless the workers can spare it: gunicorn --threads, gevent or eventlet
+SSE_WSGI = env_flag('SSE_WSGI', 'false')
+# Events kept for every user so a reconnecting client gets what it missed, and how many users keep them
+EVENTS_HISTORY_SIZE = int(os.getenv('EVENTS_HISTORY_SIZE', 100))
+EVENTS_HISTORY_USERS = int(os.getenv('EVENTS_HISTORY_USERS', 10000))
+
+HEARTBEAT = ': heartbeat\n\n'
+
+# Event ids are "<milliseconds>-<sequence>" like the ids of Redis streams, both backends compare them the same way.
+# None when the client sent something else.
+def parse_event_id(event_id):
+    milliseconds, _, sequence = (event_id or '').partition('-')
+    try:
+        return int(milliseconds), int(sequence or 0)
+    except ValueError:
+        return None
+
+def format_event(event_id, event, data):
+    return 'id: {}\nevent: {}\ndata: {}\n\n'.format(event_id, event, json.dumps(data))
+
+# Events waiting to be sent to one connected client. notify() wakes up whatever waits for them,
+# a threading.Event for the WSGI stream or the event loop of asgi.py.
+class Subscription:
+    def __init__(self, user_id, notify):
+        self.user_id = user_id
+        self.notify = notify
+        self.events = deque()
+
+    def push(self, event_id, data):
+        self.events.append((event_id, data))
+        self.notify()
+
+    def drain(self):
+        events = []
+        while self.events:
+            events.append(self.events.popleft())
+        return events
+
+# Publish/subscribe of the favorite changes of every user in the memory of the worker, with the last
+# EVENTS_HISTORY_SIZE events of each user. Only the clients connected to the same worker get the events,
+# with several workers RedisEventBroker shares them.
+class EventBroker:
+    def __init__(self, history_size=EVENTS_HISTORY_SIZE, max_users=EVENTS_HISTORY_USERS):
+        self.history_size = history_size
+        self.max_users = max_users
+        self.lock = threading.Lock()
+        self.subscribers = {}
+        self.histories = OrderedDict()
+        self.last_milliseconds = 0
+        self.sequence = 0
+        # Every event up to this id may have been dropped: the ones before the worker started and the ones
+        # of the users whose history was evicted
+        self.forgotten_until = self.next_id()
+
+    def next_id(self):
+        with self.lock:
+            milliseconds = int(time.time() * 1000)
+            if milliseconds > self.last_milliseconds:
+                self.last_milliseconds, self.sequence = milliseconds, 0
+            else:
+                self.sequence += 1
+            return '{}-{}'.format(self.last_milliseconds, self.sequence)
+
+    def publish(self, user_id, data):
+        self.deliver(user_id, self.next_id(), data)
+
+    def deliver(self, user_id, event_id, data):
+        with self.lock:
+            history = self.history(user_id)
+            if len(history['events']) == self.history_size:
+                history['complete_after'] = history['events'][0][0]
+            history['events'].append((event_id, data))
+            subscribers = list(self.subscribers.get(user_id, ()))
+        for subscription in subscribers:
+            subscription.push(event_id, data)
+
+    # Called with the lock held. The least recently changed users lose their history first.
+    def history(self, user_id):
+        history = self.histories.get(user_id)
+        if history is None:
+            history = self.histories[user_id] = {'events': deque(maxlen=self.history_size), 'complete_after': self.forgotten_until}
+            while len(self.histories) > self.max_users:
+                evicted_user, evicted = self.histories.popitem(last=False)
+                if evicted['events']:
+                    self.forgotten_until = max(self.forgotten_until, evicted['events'][-1][0], key=parse_event_id)
+        self.histories.move_to_end(user_id)
+        return history
+
+    # Events of the user after last_event_id, None when some of them are not kept anymore
+    def events_after(self, user_id, last_event_id):
+        after = parse_event_id(last_event_id)
+        if after is None:
+            return None
+        with self.lock:
+            history = self.histories.get(user_id)
+            complete_after = history['complete_after'] if history is not None else self.forgotten_until
+            if after < parse_event_id(complete_after):
+                return None
+            return [event for event in history['events'] if parse_event_id(event[0]) > after] if history is not None else []
+
+    def last_event_id(self, user_id):
+        with self.lock:
+            history = self.histories.get(user_id)
+            if history is not None and history['events']:
+                return history['events'][-1][0]
+            return history['complete_after'] if history is not None else self.forgotten_until
+
+    def subscribe(self, user_id, notify):
+        subscription = Subscription(user_id, notify)
+        with self.lock:
+            self.subscribers.setdefault(user_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            subscribers = self.subscribers.get(subscription.user_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self.subscribers[subscription.user_id]
+
+    def subscriber_count(self):
+        with self.lock:
+            return sum(len(subscribers) for subscribers in self.subscribers.values())
+
+# Same interface on top of a redis-py compatible client (decode_responses=True): every user has a capped
+# stream with the history, and one pub/sub channel carries all the events to the workers. Each worker
+# listens to the channel with a single thread and hands the events to its local subscribers.
+class RedisEventBroker(EventBroker):
+    def __init__(self, client, prefix='swapi:events:', **kwargs):
+        EventBroker.__init__(self, **kwargs)
+        self.client = client
+        self.prefix = prefix
+        self.channel = prefix + 'favorites'
+        self.listener = None
+
+    def stream_key(self, user_id):
+        return '{}favorites:{}'.format(self.prefix, user_id)
+
+    def publish(self, user_id, data):
+        payload = json.dumps(data)
+        event_id = self.client.xadd(self.stream_key(user_id), {'data': payload}, maxlen=self.history_size, approximate=True)
+        self.client.publish(self.channel, json.dumps({'user_id': user_id, 'id': event_id, 'data': data}))
+
+    def events_after(self, user_id, last_event_id):
+        after = parse_event_id(last_event_id)
+        if after is None:
+            return None
+        key = self.stream_key(user_id)
+        if not self.client.exists(key):
+            return []
+        # Redis 7 tells the highest id the trimming removed, older servers can only resume
+        trimmed_until = self.client.xinfo_stream(key).get('max-deleted-entry-id', '0-0')
+        if after < parse_event_id(trimmed_until):
+            return None
+        return [(event_id, json.loads(fields['data'])) for event_id, fields in self.client.xrange(key, min='(' + '{}-{}'.format(*after), max='+')]
+
+    def last_event_id(self, user_id):
+        entries = self.client.xrevrange(self.stream_key(user_id), count=1)
+        return entries[0][0] if entries else '0-0'
+
+    # The listener starts with the first client of the worker, after gunicorn forked it
+    def subscribe(self, user_id, notify):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(self.channel)
+                self.listener = threading.Thread(target=self.listen, args=(pubsub,), daemon=True)
+                self.listener.start()
+        return EventBroker.subscribe(self, user_id, notify)
+
+    def listen(self, pubsub):
+        for message in pubsub.listen():
+            event = json.loads(message['data'])
+            EventBroker.deliver(self, event['user_id'], event['id'], event['data'])
+
+broker = EventBroker()
+
+# Events of the favorite mutations that changed something, once they are committed.
+# changes are (item id, result) like apply_bulk_favorites returns them.
+def publish_favorite_changes(user_id, favorite_model, changes):
+    for item_id, result in changes:
+        if result in (ADDED, DELETED):
+            broker.publish(user_id, {'action': result, 'type': FAVORITE_TYPES[favorite_model], 'id': item_id})
+
+# One client of the change feed. The subscription is made before the missed events are read,
+# so nothing published in between is lost, and events already sent are never sent twice.
+class Feed:
+    def __init__(self, user_id, last_event_id, notify):
+        self.user_id = user_id
+        self.last_event_id = last_event_id
+        self.subscription = broker.subscribe(user_id, notify)
+        self.position = None
+
+    # First chunk: the reconnection delay, then the missed events, a "reset" when they are not all known
+    # anymore (the client has to reload its favorites) or a "ready" with the id to resume from
+    def opening(self):
+        chunks = ['retry: {}\n\n'.format(SSE_RETRY_MS)]
+        missed = broker.events_after(self.user_id, self.last_event_id) if self.last_event_id else None
+        if missed is None:
+            event_id = broker.last_event_id(self.user_id)
+            chunks.append(format_event(event_id, 'reset' if self.last_event_id else 'ready', {'user_id': self.user_id}))
+            self.position = parse_event_id(event_id)
+        else:
+            chunks += [format_event(event_id, 'favorite', data) for event_id, data in missed]
+            self.position = parse_event_id(missed[-1][0] if missed else self.last_event_id)
+        return ''.join(chunks)
+
+    # Events published since the last call, formatted
+    def pending(self):
+        chunks = []
+        for event_id, data in self.subscription.drain():
+            position = parse_event_id(event_id)
+            if position > self.position:
+                chunks.append(format_event(event_id, 'favorite', data))
+                self.position = position
+        return ''.join(chunks)
+
+    def close(self):
+        broker.unsubscribe(self.subscription)
+
+# Body of the WSGI response, a heartbeat comment every SSE_HEARTBEAT seconds keeps proxies from closing it.
+# The generator is closed when the client goes away.
+def event_stream(user_id, last_event_id):
+    wakeup = threading.Event()
+    feed = Feed(user_id, last_event_id, wakeup.set)
+    try:
+        yield feed.opening()
+        while True:
+            wakeup.wait(SSE_HEARTBEAT)
+            wakeup.clear()
+            yield feed.pending() or HEARTBEAT
+    finally:
+        feed.close()
+
+def setup_events(app):
+    global broker
+    redis_url = os.getenv('EVENTS_REDIS_URL')
+    if redis_url is not None:
+        import redis
+        broker = RedisEventBroker(redis.Redis.from_url(redis_url, decode_responses=True))
+    else:
+        broker = EventBroker()
@@ -0,0 +1,59 @@
+import os
+from flask import request
+from utils import APIException
+from models import Planets, People
+from serialization import select_serialized, serialized_rows
+
+# Related data the list endpoints can embed with ?expand=, e.g. /people?expand=planet
+LIST_EXPANSIONS = {
+    People: ('planet',),
+}
+
+# Homeworlds are read with one IN (...) query per batch of ids, whatever the number of people
+EXPAND_BATCH_SIZE = int(os.getenv('EXPAND_BATCH_SIZE', 500))
+
+# Reads ?expand=planet and checks every name is allowed, returns an empty tuple when nothing is expanded
+def get_expand_arg(allowed, args=None):
+    value = (request.args if args is None else args).get('expand')
+    if not value:
+        return ()
+    expand = tuple(dict.fromkeys(name.strip() for name in value.split(',') if name.strip()))
+    unknown = [name for name in expand if name not in allowed]
+    if unknown:
+        raise APIException('Unknown expand: {}'.format(', '.join(unknown)), status_code=400)
+    return expand
+
+# The statements reading the homeworlds of some people, the async mode runs them on its own engine
+def homeworlds_statements(people):
+    ids = sorted({person['planet_id'] for person in people if person['planet_id'] is not None})
+    return [select_serialized(Planets).where(Planets.id.in_(ids[start:start + EXPAND_BATCH_SIZE])) for start in range(0, len(ids), EXPAND_BATCH_SIZE)]
+
+# Adds 'planet' to every person (None when it has no homeworld). planet_id is removed when the client did not select it.
+def attach_homeworlds(people, planets, keep_planet_id=True):
+    planets_by_id = {planet['id']: planet for planet in planets}
+    for person in people:
+        planet_id = person['planet_id'] if keep_planet_id else person.pop('planet_id')
+        person['planet'] = planets_by_id.get(planet_id)
+    return people
+
+def expand_homeworlds(people, keep_planet_id=True):
+    planets = []
+    for statement in homeworlds_statements(people):
+        planets += serialized_rows(statement)
+    return attach_homeworlds(people, planets, keep_planet_id)
+
+# One page of the people living on a planet: WHERE planet_id = ? AND id > after ORDER BY id LIMIT limit + 1
+def residents_statement(planet_id, after, limit):
+    statement = select_serialized(People).where(People.planet_id == planet_id)
+    if after:
+        statement = statement.where(People.id > after)
+    return statement.order_by(People.id).limit(limit + 1)
+
+# Returns the residents of the page and the next cursor (None when there are no more)
+def residents_page(rows, limit):
+    if len(rows) > limit:
+        return rows[:limit], rows[limit - 1]['id']
+    return rows, None
+
+def get_residents(planet_id, after, limit):
+    return residents_page(serialized_rows(residents_statement(planet_id, after, limit)), limit)
@@ -0,0 +1,223 @@
+from sqlalchemy import select, exists, delete, update, literal, null, cast, union_all, tuple_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
+from serialization import SERIALIZED_COLUMNS
+from pagination import get_page_args
+
+# For every favorites table: the column that points to the favorite item and the model of that item
+FAVORITE_TARGETS = {
+    FavoritesPlanets: (FavoritesPlanets.planet_id, Planets),
+    FavoritePeople: (FavoritePeople.people_id, People),
+}
+
+# Results of a favorite mutation, the handlers turn them into messages and status codes
+ADDED = 'added'
+DELETED = 'deleted'
+ALREADY_EXISTS = 'already_exists'
+NOT_FOUND = 'not_found'
+MISSING_USER = 'missing_user'
+MISSING_ITEM = 'missing_item'
+
+# Only called when the single write statement did not succeed, so the happy path never pays for these reads
+def find_missing_reference(favorite_model, user_id, item_id):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    if db.session.get(User, user_id) is None:
+        return MISSING_USER
+    if db.session.get(item_model, item_id) is None:
+        return MISSING_ITEM
+    return None
+
+# WHERE clause of one favorite, served by the unique (user_id, item) index
+def favorite_filter(favorite_model, user_id, item_id):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = favorite_model.__table__
+    return (table.c.user_id == user_id) & (table.c[item_column.key] == item_id)
+
+# INSERT ... ON CONFLICT (user_id, item) DO NOTHING where the dialect has it (Postgres, SQLite),
+# elsewhere INSERT ... SELECT ... WHERE NOT EXISTS and the unique index catches concurrent duplicates.
+def insert_favorite_statement(favorite_model, user_id, item_id):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = favorite_model.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        return insert(table).values({'user_id': user_id, item_column.key: item_id}).on_conflict_do_nothing(index_elements=['user_id', item_column.key])
+    return table.insert().from_select(
+        ['user_id', item_column.key],
+        select(literal(user_id), literal(item_id)).where(~exists().where(favorite_filter(favorite_model, user_id, item_id)))
+    )
+
+# Multi-row INSERT that skips favorites that already exist, used by the bulk endpoint with a list of parameters
+def insert_ignore_statement(favorite_model):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = favorite_model.__table__
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        return insert(table).on_conflict_do_nothing(index_elements=['user_id', item_column.key])
+    if dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert()
+
+# Keeps the favorites_count of the items in step with the favorites, in the same transaction as the change.
+# A Core UPDATE of the table: the count is not part of the cached or ETagged representations.
+def change_favorites_count(favorite_model, item_ids, delta):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = item_model.__table__
+    db.session.execute(update(table).where(table.c.id.in_(item_ids)).values(favorites_count=table.c.favorites_count + delta))
+
+# One round-trip: a missing user or item is reported by the foreign keys, a duplicate by an inserted row count of 0
+def add_favorite(favorite_model, user_id, item_id):
+    try:
+        result = db.session.execute(insert_favorite_statement(favorite_model, user_id, item_id))
+    except IntegrityError:
+        db.session.rollback()
+        # Both references exist, so it was the unique index: another request added the same favorite first
+        return find_missing_reference(favorite_model, user_id, item_id) or ALREADY_EXISTS
+    if not result.rowcount:
+        return ALREADY_EXISTS
+    change_favorites_count(favorite_model, [item_id], 1)
+    return ADDED
+
+# One round-trip: DELETE ... WHERE user_id = :user_id AND item = :item_id, the row count tells if it was a favorite
+def remove_favorite(favorite_model, user_id, item_id):
+    result = db.session.execute(delete(favorite_model.__table__).where(favorite_filter(favorite_model, user_id, item_id)))
+    if result.rowcount:
+        change_favorites_count(favorite_model, [item_id], -1)
+        return DELETED
+    return find_missing_reference(favorite_model, user_id, item_id) or NOT_FOUND
+
+# (user_id, item_id) of the favorites a multi-row INSERT ... ON CONFLICT DO NOTHING actually inserted, read from
+# its RETURNING. Databases without RETURNING run one INSERT per favorite and read its row count instead.
+def insert_favorites(favorite_model, pairs):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = favorite_model.__table__
+    rows = [{'user_id': user_id, item_column.key: item_id} for user_id, item_id in pairs]
+    if db.session.get_bind().dialect.insert_returning:
+        statement = insert_ignore_statement(favorite_model).values(rows).returning(table.c.user_id, table.c[item_column.key])
+        return {tuple(row) for row in db.session.execute(statement)}
+    return {pair for pair, row in zip(pairs, rows) if db.session.execute(insert_ignore_statement(favorite_model), [row]).rowcount}
+
+# (user_id, item_id) of the favorites a DELETE ... IN actually deleted, same as insert_favorites()
+def delete_favorites(favorite_model, pairs):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = favorite_model.__table__
+    if db.session.get_bind().dialect.delete_returning:
+        statement = delete(table).where(tuple_(table.c.user_id, table.c[item_column.key]).in_(pairs)).returning(table.c.user_id, table.c[item_column.key])
+        return {tuple(row) for row in db.session.execute(statement)}
+    return {pair for pair in pairs if db.session.execute(delete(table).where(favorite_filter(favorite_model, *pair))).rowcount}
+
+# Adds and removes many favorites of one user in the current transaction with a fixed number of statements:
+# one read of the existing items, one multi-row INSERT and one DELETE ... IN, plus one UPDATE of the counts for each.
+# The results and the counts come from the rows the INSERT and the DELETE returned, so a favorite another request
+# adds or removes at the same time is reported and counted once. The user must exist.
+# Returns [(item_id, result)] in the order the ids were given.
+def apply_bulk_favorites(favorite_model, user_id, add_ids, remove_ids):
+    item_model = FAVORITE_TARGETS[favorite_model][1]
+    requested_ids = set(add_ids) | set(remove_ids)
+    if not requested_ids:
+        return []
+    existing_items = set(db.session.scalars(select(item_model.id).where(item_model.id.in_(requested_ids))))
+
+    to_insert = [(user_id, item_id) for item_id in add_ids if item_id in existing_items]
+    inserted = {item_id for user_id, item_id in insert_favorites(favorite_model, to_insert)} if to_insert else set()
+    if inserted:
+        change_favorites_count(favorite_model, sorted(inserted), 1)
+    to_delete = [(user_id, item_id) for item_id in remove_ids if item_id in existing_items]
+    deleted = {item_id for user_id, item_id in delete_favorites(favorite_model, to_delete)} if to_delete else set()
+    if deleted:
+        change_favorites_count(favorite_model, sorted(deleted), -1)
+
+    results = []
+    for item_id in add_ids:
+        if item_id not in existing_items:
+            results.append((item_id, MISSING_ITEM))
+        else:
+            results.append((item_id, ADDED if item_id in inserted else ALREADY_EXISTS))
+    for item_id in remove_ids:
+        if item_id not in existing_items:
+            results.append((item_id, MISSING_ITEM))
+        else:
+            results.append((item_id, DELETED if item_id in deleted else NOT_FOUND))
+    return results
+
+# Name used for each favorites table in the combined favorites response
+FAVORITE_TYPES = {
+    FavoritePeople: 'person',
+    FavoritesPlanets: 'planet',
+}
+# Name of the pages of each favorites table: ?people_after=&people_limit= and the "people" next cursor
+FAVORITE_PAGES = {
+    FavoritePeople: 'people',
+    FavoritesPlanets: 'planets',
+}
+
+# (after, limit) of each favorites table from the query string
+def get_favorite_pages(args=None):
+    return {favorite_model: get_page_args(name + '_', args=args) for favorite_model, name in FAVORITE_PAGES.items()}
+
+# Every column a favorite item can have, with its type so the UNION branches can pad the missing ones with typed NULLs.
+# Only the serialized columns, internal ones like favorites_count are not part of the response.
+def favorite_item_columns():
+    columns = {}
+    for favorite_model, (item_column, item_model) in FAVORITE_TARGETS.items():
+        for column in SERIALIZED_COLUMNS[item_model]:
+            columns.setdefault(column.key, column.type)
+    return columns
+
+# SELECT of one favorites table for the UNION ALL, paged on the favorite id
+def user_favorites_branch(favorite_model, user_id, fields, after, limit):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    favorite_table = favorite_model.__table__
+    item_table = item_model.__table__
+    selected = [literal(FAVORITE_TYPES[favorite_model]).label('type'), favorite_table.c.id.label('favorite_id')]
+    for name, column_type in favorite_item_columns().items():
+        if name not in fields:
+            continue
+        if name in item_table.c:
+            selected.append(item_table.c[name].label(name))
+        else:
+            selected.append(cast(null(), column_type).label(name))
+    query = select(*selected).select_from(favorite_table.join(item_table, favorite_table.c[item_column.key] == item_table.c.id))
+    query = query.where(favorite_table.c.user_id == user_id)
+    if after:
+        query = query.where(favorite_table.c.id > after)
+    if limit is not None:
+        query = query.order_by(favorite_table.c.id).limit(limit + 1)
+    return select(query.subquery())
+
+# People and planets favorites of a user in a single statement, pages maps each favorites model to its (after, limit)
+def user_favorites_statement(user_id, fields, pages):
+    branches = [user_favorites_branch(favorite_model, user_id, fields, *pages[favorite_model]) for favorite_model in FAVORITE_TYPES]
+    combined = union_all(*branches).subquery()
+    return select(combined).order_by(combined.c.type, combined.c.favorite_id)
+
+# Returns the [{'person': {...}}, {'planet': {...}}] list and the next cursor of each type (None when there are no more)
+def get_user_favorites(user_id, fields, pages):
+    rows = db.session.execute(user_favorites_statement(user_id, fields, pages)).mappings().all()
+    return group_user_favorites(rows, fields, pages)
+
+def group_user_favorites(rows, fields, pages):
+    item_fields = {}
+    limits = {}
+    for favorite_model, type_name in FAVORITE_TYPES.items():
+        item_column, item_model = FAVORITE_TARGETS[favorite_model]
+        item_fields[type_name] = [name for name in fields if name in item_model.__table__.c]
+        limits[type_name] = pages[favorite_model][1]
+
+    results = []
+    next_cursors = dict.fromkeys(FAVORITE_PAGES.values())
+    page_names = {FAVORITE_TYPES[favorite_model]: name for favorite_model, name in FAVORITE_PAGES.items()}
+    counts = dict.fromkeys(limits, 0)
+    last_favorite_ids = {}
+    for row in rows:
+        type_name = row['type']
+        # Each branch reads limit + 1 rows, the extra one only says there is a next page
+        if counts[type_name] == limits[type_name]:
+            next_cursors[page_names[type_name]] = last_favorite_ids[type_name]
+            continue
+        results.append({type_name: {name: row[name] for name in item_fields[type_name]}})
+        last_favorite_ids[type_name] = row['favorite_id']
+        counts[type_name] += 1
+    return results, next_cursors
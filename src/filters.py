@@ -0,0 +1,100 @@
+import operator
+from sqlalchemy import and_, true, tuple_
+from utils import APIException
+from models import Planets, People
+
+# Columns the catalog lists can be filtered and sorted by. Every one of them is indexed,
+# anything else is rejected with a 400 instead of turning into a full table scan.
+FILTER_COLUMNS = {
+    People: {
+        'name': People.name,
+        'gender': People.gender,
+        'planet_id': People.planet_id,
+        'height': People.height,
+        'birth_year': People.birth_year,
+    },
+    Planets: {
+        'name': Planets.name,
+        'climate': Planets.climate,
+        'population': Planets.population,
+        'diameter': Planets.diameter,
+    },
+}
+
+# Columns that also accept ranges, e.g. ?population__gte=1000&population__lt=50000
+RANGE_COLUMNS = ('population', 'diameter', 'height', 'birth_year')
+RANGE_OPERATORS = {
+    'gt': operator.gt,
+    'gte': operator.ge,
+    'lt': operator.lt,
+    'lte': operator.le,
+}
+
+# Query string parameters of the list endpoints that are not filters
+RESERVED_ARGS = ('after', 'limit', 'stream', 'fields', 'sort', 'expand', 'compact')
+
+def parse_value(name, column, value):
+    try:
+        return column.type.python_type(value)
+    except ValueError:
+        raise APIException('The filter {} must be a {}'.format(name, column.type.python_type.__name__), status_code=400)
+
+# Turns ?gender=female&height__gte=150 into SQL conditions
+def parse_filters(model, args):
+    columns = FILTER_COLUMNS[model]
+    conditions = []
+    for key, value in args.items():
+        if key in RESERVED_ARGS:
+            continue
+        name, _, operator_name = key.partition('__')
+        if name not in columns:
+            raise APIException('Unsupported filter {}, the supported filters are: {}'.format(key, ', '.join(columns)), status_code=400)
+        column = columns[name]
+        if not operator_name:
+            conditions.append(column == parse_value(key, column, value))
+        elif operator_name in RANGE_OPERATORS and name in RANGE_COLUMNS:
+            conditions.append(RANGE_OPERATORS[operator_name](column, parse_value(key, column, value)))
+        else:
+            raise APIException('Unsupported filter {}, ranges (__gt, __gte, __lt, __lte) are supported on: {}'.format(key, ', '.join(name for name in RANGE_COLUMNS if name in columns)), status_code=400)
+    return conditions
+
+# ?sort=height or ?sort=-height, returns (name, column, descending) or None to keep the primary key order
+def parse_sort(model, args):
+    value = args.get('sort')
+    if not value:
+        return None
+    descending = value.startswith('-')
+    name = value.lstrip('-')
+    if name == 'id':
+        return None if not descending else (name, model.id, True)
+    if name not in FILTER_COLUMNS[model]:
+        raise APIException('Unsupported sort {}, the supported sorts are: id, {}'.format(name, ', '.join(FILTER_COLUMNS[model])), status_code=400)
+    return name, FILTER_COLUMNS[model][name], descending
+
+# ORDER BY of a sorted list: the sort column, then the primary key to break ties in the same direction, so the
+# index of the column (which ends with the id) is read forwards or backwards instead of sorted.
+# columns are the ones of a subquery to order by instead of the table's.
+def sort_order(model, sort, columns=None):
+    name, column, descending = sort
+    if columns is not None:
+        column, id = columns[name], columns.id
+    else:
+        id = model.id
+    if column is id:
+        return [id.desc()]
+    return [column.desc(), id.desc()] if descending else [column.asc(), id.asc()]
+
+# Conditions of the ranges a sorted list is read from, continuing after the row (value, id) of the cursor.
+# The rows with a value come first and the NULLs last, each range has its own condition so both are read
+# from the index, an "OR column IS NULL" would read all of it.
+def sort_ranges(model, sort, after=None):
+    name, column, descending = sort
+    if column is model.id:
+        return [model.id < after[1] if after else true()]
+    if not after:
+        return [column.is_not(None), column.is_(None)]
+    value, id = after
+    if value is None:
+        return [and_(column.is_(None), model.id < id if descending else model.id > id)]
+    key = tuple_(column, model.id)
+    return [key < tuple_(value, id) if descending else key > tuple_(value, id), column.is_(None)]
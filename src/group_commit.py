@@ -0,0 +1,187 @@
+import os
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+from sqlalchemy import select
+from database import env_flag
+from models import db, User
+from favorites import (
+    FAVORITE_TARGETS, add_favorite, remove_favorite, insert_favorites, delete_favorites, change_favorites_count,
+    ADDED, DELETED, ALREADY_EXISTS, NOT_FOUND, MISSING_USER, MISSING_ITEM,
+)
+
+# GROUP_COMMIT=true queues the single favorite mutations of concurrent requests and a background thread writes
+# them in one transaction, at most GROUP_COMMIT_MAX_OPS of them or what arrived within GROUP_COMMIT_MAX_DELAY_MS
+# of the first one. One commit (one fsync) for the whole batch instead of one per request.
+# It needs concurrent requests in the same process: gunicorn --threads, or asgi.py.
+GROUP_COMMIT = env_flag('GROUP_COMMIT', 'false')
+GROUP_COMMIT_MAX_OPS = int(os.getenv('GROUP_COMMIT_MAX_OPS', 100))
+GROUP_COMMIT_MAX_DELAY_MS = float(os.getenv('GROUP_COMMIT_MAX_DELAY_MS', 5))
+GROUP_COMMIT_TIMEOUT = float(os.getenv('GROUP_COMMIT_TIMEOUT', 30))
+
+ADD = 'add'
+REMOVE = 'remove'
+
+group_commit_logger = logging.getLogger('group_commit')
+
+class Operation:
+    def __init__(self, favorite_model, action, user_id, item_id):
+        self.favorite_model = favorite_model
+        self.action = action
+        self.user_id = user_id
+        self.item_id = item_id
+        self.future = Future()
+
+# Results of the operations of one favorites table as if they ran one after the other in arrival order.
+# After its last operation a favorite exists if that operation was an add and not if it was a remove, so only that
+# net change of every (user, item) is written: one INSERT ... ON CONFLICT DO NOTHING and one DELETE, both with RETURNING.
+# Whether the favorite existed before the batch follows from the rows they returned, and with it the result of every
+# operation and the change of the counts, without reading the favorites first.
+def apply_batch(favorite_model, operations):
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    user_ids = {operation.user_id for operation in operations}
+    item_ids = {operation.item_id for operation in operations}
+    existing_users = set(db.session.scalars(select(User.id).where(User.id.in_(user_ids))))
+    existing_items = set(db.session.scalars(select(item_model.id).where(item_model.id.in_(item_ids))))
+
+    last_actions = {}
+    for operation in operations:
+        if operation.user_id in existing_users and operation.item_id in existing_items:
+            last_actions[(operation.user_id, operation.item_id)] = operation.action
+    to_insert = [pair for pair, action in last_actions.items() if action == ADD]
+    to_delete = [pair for pair, action in last_actions.items() if action == REMOVE]
+    inserted = insert_favorites(favorite_model, to_insert) if to_insert else set()
+    deleted = delete_favorites(favorite_model, to_delete) if to_delete else set()
+
+    # An add that inserted nothing and a remove that deleted something found the favorite there
+    state = {pair: pair in deleted if action == REMOVE else pair not in inserted for pair, action in last_actions.items()}
+    results = []
+    for operation in operations:
+        pair = (operation.user_id, operation.item_id)
+        if pair not in state:
+            results.append(MISSING_USER if operation.user_id not in existing_users else MISSING_ITEM)
+        elif operation.action == ADD:
+            results.append(ALREADY_EXISTS if state[pair] else ADDED)
+            state[pair] = True
+        else:
+            results.append(DELETED if state[pair] else NOT_FOUND)
+            state[pair] = False
+
+    # One UPDATE per distinct change of the counts, usually +1 and -1
+    deltas = {}
+    for user_id, item_id in inserted:
+        deltas[item_id] = deltas.get(item_id, 0) + 1
+    for user_id, item_id in deleted:
+        deltas[item_id] = deltas.get(item_id, 0) - 1
+    items_by_delta = {}
+    for item_id, delta in deltas.items():
+        if delta:
+            items_by_delta.setdefault(delta, []).append(item_id)
+    for delta, ids in items_by_delta.items():
+        change_favorites_count(favorite_model, ids, delta)
+    return results
+
+class GroupCommitter:
+    def __init__(self, app, max_ops=GROUP_COMMIT_MAX_OPS, max_delay_ms=GROUP_COMMIT_MAX_DELAY_MS):
+        self.app = app
+        self.max_ops = max_ops
+        self.max_delay = max_delay_ms / 1000
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = None
+        self.batches = 0
+        self.operations = 0
+
+    # Queues the operation and waits until the batch it is part of is committed, returns its result.
+    # The thread starts with the first operation, so every worker forked by gunicorn gets its own, and again with the
+    # next one if it stopped. Queued under the lock, so a stopping thread either fails the operation or is replaced.
+    def submit(self, favorite_model, action, user_id, item_id):
+        operation = Operation(favorite_model, action, user_id, item_id)
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, daemon=True)
+                self.thread.start()
+            self.queue.put(operation)
+        return operation.future.result(timeout=GROUP_COMMIT_TIMEOUT)
+
+    def next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_delay
+        while len(batch) < self.max_ops:
+            remaining = deadline - time.monotonic()
+            try:
+                batch.append(self.queue.get(timeout=remaining) if remaining > 0 else self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        batch = []
+        try:
+            while True:
+                batch = self.next_batch()
+                with self.app.app_context():
+                    self.write(batch)
+                self.batches += 1
+                self.operations += len(batch)
+        except Exception as error:
+            # Not a failed write (write() handles those) but a bug or a broken session: the operations waiting for
+            # this thread get the error instead of waiting for GROUP_COMMIT_TIMEOUT, the next submit starts a new one
+            group_commit_logger.exception('Group commit thread stopped')
+            with self.lock:
+                self.thread = None
+                pending = list(batch)
+                while True:
+                    try:
+                        pending.append(self.queue.get_nowait())
+                    except queue.Empty:
+                        break
+            for operation in pending:
+                if not operation.future.done():
+                    operation.future.set_exception(error)
+
+    def write(self, batch):
+        results = {}
+        try:
+            for favorite_model in FAVORITE_TARGETS:
+                operations = [operation for operation in batch if operation.favorite_model is favorite_model]
+                if operations:
+                    results.update(zip(operations, apply_batch(favorite_model, operations)))
+            db.session.commit()
+        except Exception:
+            # A user or an item deleted between the reads and the writes fails the foreign keys of the whole batch
+            # (or the database failed): every operation is retried on its own so one failure does not fail the others
+            group_commit_logger.warning('Batch of %s favorite changes failed, writing them one by one', len(batch), exc_info=True)
+            db.session.rollback()
+            return self.write_one_by_one(batch)
+        for operation in batch:
+            operation.future.set_result(results[operation])
+
+    def write_one_by_one(self, batch):
+        for operation in batch:
+            try:
+                mutation = add_favorite if operation.action == ADD else remove_favorite
+                result = mutation(operation.favorite_model, operation.user_id, operation.item_id)
+                db.session.commit()
+            except Exception as error:
+                db.session.rollback()
+                operation.future.set_exception(error)
+            else:
+                operation.future.set_result(result)
+
+committer = None
+
+def setup_group_commit(app):
+    global committer
+    committer = GroupCommitter(app) if GROUP_COMMIT else None
+
+# add_favorite or remove_favorite committed, through the group commit when it is enabled
+def commit_favorite_change(favorite_model, action, user_id, item_id):
+    if committer is not None:
+        return committer.submit(favorite_model, action, user_id, item_id)
+    mutation = add_favorite if action == ADD else remove_favorite
+    result = mutation(favorite_model, user_id, item_id)
+    db.session.commit()
+    return result
@@ -0,0 +1,53 @@
+import os
+import time
+from sqlalchemy import select, update, func
+from models import db, Planets, People, FavoritesPlanets, FavoritePeople
+from serialization import SERIALIZED_COLUMNS
+from favorites import FAVORITE_TARGETS
+import cache
+
+LEADERBOARD_MAX_LIMIT = int(os.getenv('LEADERBOARD_MAX_LIMIT', 100))
+LEADERBOARD_TTL = float(os.getenv('LEADERBOARD_TTL', 10))
+
+# Item model of each leaderboard with its favorites table
+LEADERBOARDS = {
+    'planets': (Planets, FavoritesPlanets),
+    'people': (People, FavoritePeople),
+}
+
+# Top LEADERBOARD_MAX_LIMIT items, served by the (favorites_count, id) index read backwards
+def leaderboard_statement(model):
+    return (
+        select(*SERIALIZED_COLUMNS[model], model.favorites_count)
+        .where(model.favorites_count > 0)
+        .order_by(model.favorites_count.desc(), model.id.desc())
+        .limit(LEADERBOARD_MAX_LIMIT)
+    )
+
+# The full top list is cached for LEADERBOARD_TTL seconds and every request takes the first `limit` items of it.
+# Favorites writes do not invalidate it, a leaderboard a few seconds behind is fine.
+def get_leaderboard(name, limit):
+    model, favorite_model = LEADERBOARDS[name]
+    key = 'leaderboard:' + name
+    entry = cache.cache.get(key)
+    if entry is None or entry['expires_at'] < time.time():
+        items = [dict(row) for row in db.session.execute(leaderboard_statement(model)).mappings()]
+        entry = {'items': items, 'expires_at': time.time() + LEADERBOARD_TTL}
+        cache.cache.set(key, entry)
+    return entry['items'][:limit]
+
+# Recomputes every favorites_count from the favorites table with a GROUP BY, only the rows that drifted are written.
+# Counts drift when favorites are changed outside the API (Flask-Admin, SQL) or by racing bulk requests.
+def rebuild_favorites_counts(name):
+    model, favorite_model = LEADERBOARDS[name]
+    item_column, item_model = FAVORITE_TARGETS[favorite_model]
+    table = model.__table__
+    favorite_column = favorite_model.__table__.c[item_column.key]
+    counts = select(favorite_column.label('item_id'), func.count().label('total')).group_by(favorite_column).subquery()
+    reset = db.session.execute(
+        update(table).where(table.c.favorites_count != 0, table.c.id.not_in(select(favorite_column))).values(favorites_count=0)
+    )
+    updated = db.session.execute(
+        update(table).where(table.c.id == counts.c.item_id, table.c.favorites_count != counts.c.total).values(favorites_count=counts.c.total)
+    )
+    return reset.rowcount + updated.rowcount
@@ -0,0 +1,129 @@
+import os
+import time
+import logging
+import threading
+from flask import request, g, has_request_context
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from database import pool_status
+import events
+import group_commit
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'false').lower() in ('1', 'true', 'yes', 'on')
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+STATEMENT_BUCKETS = (0, 1, 2, 3, 5, 10, 25, 50, 100)
+SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+slow_query_logger = logging.getLogger('slow_queries')
+
+POOL_COUNTERS = ('checkouts', 'checkout_timeouts', 'wait_seconds_total')
+
+# Prometheus-style histogram, one series per set of labels
+class Histogram:
+    def __init__(self, name, description, buckets):
+        self.name = name
+        self.description = description
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, labels, value):
+        series = self.series.get(labels)
+        if series is None:
+            series = self.series[labels] = {'buckets': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                series['buckets'][index] += 1
+        series['sum'] += value
+        series['count'] += 1
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.description), '# TYPE {} histogram'.format(self.name)]
+        for labels, series in sorted(self.series.items()):
+            label_text = format_labels(labels)
+            for bound, count in zip(self.buckets, series['buckets']):
+                lines.append('{}_bucket{{{},le="{}"}} {}'.format(self.name, label_text, bound, count))
+            lines.append('{}_bucket{{{},le="+Inf"}} {}'.format(self.name, label_text, series['count']))
+            lines.append('{}_sum{{{}}} {}'.format(self.name, label_text, round(series['sum'], 6)))
+            lines.append('{}_count{{{}}} {}'.format(self.name, label_text, series['count']))
+        return lines
+
+def format_labels(labels):
+    names = ('endpoint', 'method', 'status')
+    values = [str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for value in labels]
+    return ','.join('{}="{}"'.format(name, value) for name, value in zip(names, values))
+
+# Metrics live in the memory of each worker process, every gunicorn worker reports its own requests
+lock = threading.Lock()
+request_duration = Histogram('http_request_duration_seconds', 'Time spent handling the request.', LATENCY_BUCKETS)
+request_statements = Histogram('http_request_sql_statements', 'SQL statements executed per request.', STATEMENT_BUCKETS)
+request_db_duration = Histogram('http_request_db_seconds', 'Time spent in the database per request.', LATENCY_BUCKETS)
+response_size = Histogram('http_response_size_bytes', 'Size of the response body.', SIZE_BUCKETS)
+slow_queries = [0]
+# Decisions of the rate limiter by limit name and result (allowed or limited)
+rate_limit_decisions = {}
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+    if has_request_context():
+        g.sql_statements = g.get('sql_statements', 0) + 1
+        g.db_seconds = g.get('db_seconds', 0.0) + elapsed
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        with lock:
+            slow_queries[0] += 1
+        slow_query_logger.warning('Slow query (%.1f ms) on %s: %s', elapsed * 1000, request.path if has_request_context() else '-', statement)
+
+def count_rate_limit(name, result):
+    with lock:
+        rate_limit_decisions[(name, result)] = rate_limit_decisions.get((name, result), 0) + 1
+
+# Prometheus text format, including the connection pool of the engine
+def render_metrics(engine):
+    lines = []
+    with lock:
+        for histogram in (request_duration, request_statements, request_db_duration, response_size):
+            lines += histogram.render()
+        lines += ['# HELP sql_slow_queries_total Queries slower than SLOW_QUERY_MS.', '# TYPE sql_slow_queries_total counter', 'sql_slow_queries_total {}'.format(slow_queries[0])]
+        lines += ['# HELP rate_limit_requests_total Requests checked by the rate limiter.', '# TYPE rate_limit_requests_total counter']
+        for (name, result), count in sorted(rate_limit_decisions.items()):
+            lines.append('rate_limit_requests_total{{limit="{}",result="{}"}} {}'.format(name, result, count))
+    lines += ['# HELP favorites_stream_clients Clients connected to the favorites change feed.', '# TYPE favorites_stream_clients gauge', 'favorites_stream_clients {}'.format(events.broker.subscriber_count())]
+    if group_commit.committer is not None:
+        lines += ['# TYPE group_commit_batches_total counter', 'group_commit_batches_total {}'.format(group_commit.committer.batches)]
+        lines += ['# TYPE group_commit_operations_total counter', 'group_commit_operations_total {}'.format(group_commit.committer.operations)]
+    for name, value in pool_status(engine).items():
+        if isinstance(value, (int, float)):
+            metric_type = 'counter' if name in POOL_COUNTERS else 'gauge'
+            lines += ['# TYPE db_pool_{} {}'.format(name, metric_type), 'db_pool_{} {}'.format(name, value)]
+    return '\n'.join(lines) + '\n'
+
+def setup_metrics(app):
+
+    @app.before_request
+    def start_timer():
+        g.request_start_time = time.perf_counter()
+        g.sql_statements = 0
+        g.db_seconds = 0.0
+
+    @app.after_request
+    def record_request(response):
+        if 'request_start_time' not in g:
+            return response
+        elapsed = time.perf_counter() - g.request_start_time
+        labels = (request.url_rule.endpoint if request.url_rule is not None else 'unmatched', request.method, response.status_code)
+        with lock:
+            request_duration.observe(labels, elapsed)
+            request_statements.observe(labels, g.sql_statements)
+            request_db_duration.observe(labels, g.db_seconds)
+            # Streamed responses have no length yet, they are not counted
+            if response.content_length is not None:
+                response_size.observe(labels, response.content_length)
+        if SERVER_TIMING:
+            response.headers['Server-Timing'] = 'db;dur={:.2f};desc="{} queries", app;dur={:.2f}'.format(g.db_seconds * 1000, g.sql_statements, elapsed * 1000)
+        return response
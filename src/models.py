@@ -1,6 +1,7 @@
 from flask_sqlalchemy import SQLAlchemy
+from database import RoutingSession  # also registers the SQLite connection settings
 
-db = SQLAlchemy()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 class User(db.Model):
     #Table structure
@@ -25,11 +26,15 @@ class User(db.Model):
 
 class Planets(db.Model):
     __tablename__ = "planets"
+    #The leaderboard reads it backwards: ORDER BY favorites_count DESC, id DESC LIMIT K
+    __table_args__ = (db.Index('ix_planets_favorites_count_id', 'favorites_count', 'id'),)
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(50), unique = True)
-    population = db.Column(db.Integer)
-    climate = db.Column(db.String(30))
-    diameter = db.Column(db.Float)
+    population = db.Column(db.Integer, index = True)
+    climate = db.Column(db.String(30), index = True)
+    diameter = db.Column(db.Float, index = True)
+    #Number of users with this planet as favorite, kept up to date by the favorites endpoints (flask rebuild-favorites-counts recomputes it)
+    favorites_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
 
     def __repr__(self):
         return 'Planet with id {} and name {}'.format(self.id, self.name)
@@ -45,14 +50,16 @@ class Planets(db.Model):
 
 class People(db.Model):
     __tablename__ = 'people'
+    __table_args__ = (db.Index('ix_people_favorites_count_id', 'favorites_count', 'id'),)
     id = db.Column(db.Integer, primary_key = True)
     name = db.Column(db.String(50), unique = True)
-    birth_year = db.Column(db.Integer)
-    gender = db.Column(db.String(20))
-    height = db.Column(db.Float)
+    birth_year = db.Column(db.Integer, index = True)
+    gender = db.Column(db.String(20), index = True)
+    height = db.Column(db.Float, index = True)
     eye_color = db.Column(db.String(15))
-    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'))
+    planet_id = db.Column(db.Integer, db.ForeignKey('planets.id'), index = True)
     planet_relationship = db.relationship(Planets)
+    favorites_count = db.Column(db.Integer, nullable = False, default = 0, server_default = '0')
 
     def __repr__(self):
         return 'Character with id {} and name {}'.format(self.id, self.name)
@@ -70,6 +77,8 @@ class People(db.Model):
 
 class FavoritesPlanets(db.Model):
     __tablename__ = "favorites_planets"
+    #One favorite per user and planet, it is also the index used by every favorites query of a user
+    __table_args__ = (db.Index('ix_favorites_planets_user_id_planet_id', 'user_id', 'planet_id', unique = True),)
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable = False)
     user_relationship = db.relationship(User)
@@ -88,6 +97,7 @@ class FavoritesPlanets(db.Model):
 
 class FavoritePeople(db.Model):
     __tablename__ = "favorite_people"
+    __table_args__ = (db.Index('ix_favorite_people_user_id_people_id', 'user_id', 'people_id', unique = True),)
     id = db.Column(db.Integer, primary_key = True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable = False)
     user_relationship = db.relationship(User)
@@ -102,4 +112,11 @@ class FavoritePeople(db.Model):
             "id": self.id,
             "user_id": self.user_id,
             "person_id": self.people_id
-        }
\ No newline at end of file
+        }
+
+class TableVersion(db.Model):
+    __tablename__ = "table_versions"
+    #Counter of committed writes of every table, the ETags are made of them (see cache.py). Never cached or evicted,
+    #so every worker sees the same versions.
+    table_name = db.Column(db.String(64), primary_key = True)
+    version = db.Column(db.BigInteger, nullable = False, default = 0, server_default = '0')
@@ -0,0 +1,180 @@
+import os
+import json
+import base64
+from flask import request, jsonify, current_app, Response, stream_with_context
+from utils import APIException
+from models import db
+from sqlalchemy import select, union_all
+from serialization import SERIALIZED_COLUMNS, serialized_rows, wants_compact
+from filters import FILTER_COLUMNS, parse_filters, parse_sort, sort_order, sort_ranges
+from expansions import LIST_EXPANSIONS, get_expand_arg, expand_homeworlds
+
+DEFAULT_PAGE_SIZE = int(os.getenv('PAGE_SIZE', 100))
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', 1000))
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', 500))
+
+# args defaults to the query string of the current Flask request, the async mode passes its own dict
+def parse_int_arg(name, minimum=0, args=None):
+    value = (request.args if args is None else args).get(name)
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise APIException('The parameter {} must be an integer'.format(name), status_code=400)
+    if number < minimum:
+        raise APIException('The parameter {} must be greater or equal than {}'.format(name, minimum), status_code=400)
+    return number
+
+# Reads ?after=<id>&limit=N from the query string, returns (None, None) when the client did not ask for a page
+# The prefix allows several pages in the same request, e.g. ?people_limit=10&planets_limit=5
+def get_page_args(prefix='', args=None):
+    after = parse_int_arg(prefix + 'after', args=args)
+    limit = parse_int_arg(prefix + 'limit', minimum=1, args=args)
+    if after is None and limit is None:
+        return None, None
+    return after or 0, min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+
+# Reads ?fields=id,name and checks every field is allowed, returns None when the client wants every field
+def get_fields_arg(allowed, args=None):
+    value = (request.args if args is None else args).get('fields')
+    if not value:
+        return None
+    fields = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIException('Unknown fields: {}'.format(', '.join(unknown)), status_code=400)
+    return fields
+
+def wants_stream(args=None):
+    return (request.args if args is None else args).get('stream', '').lower() in ('1', 'true', 'yes')
+
+# Sorted lists use an opaque cursor holding the sort value and the id of the last row
+def encode_cursor(value, id):
+    return base64.urlsafe_b64encode(json.dumps([value, id]).encode()).decode().rstrip('=')
+
+def decode_cursor(token):
+    try:
+        value, id = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        return value, int(id)
+    except (ValueError, TypeError):
+        raise APIException('The parameter after is not a valid cursor', status_code=400)
+
+# Everything a list endpoint reads from the query string: filters, sort, fields, expand, page and streaming,
+# compiled into one SELECT. It is shared by the Flask views and the async mode (which passes its own args).
+class ListQuery:
+    def __init__(self, model, args=None):
+        args = request.args if args is None else args
+        self.model = model
+        self.stream = wants_stream(args)
+        self.compact = wants_compact(args)
+        filterable = model in FILTER_COLUMNS
+        self.conditions = parse_filters(model, args) if filterable else []
+        self.sort = parse_sort(model, args) if filterable else None
+        self.fields = get_fields_arg([column.key for column in SERIALIZED_COLUMNS[model]], args)
+        self.expand = get_expand_arg(LIST_EXPANSIONS.get(model, ()), args)
+        self.after = None
+        self.limit = None
+        if not self.stream:
+            if self.sort is not None and args.get('after'):
+                self.after = decode_cursor(args['after'])
+                self.limit = min(parse_int_arg('limit', minimum=1, args=args) or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+            else:
+                self.after, self.limit = get_page_args(args=args)
+
+    # The id and the sort column are always read, for the cursors, and removed later if not requested.
+    # So is planet_id when the homeworlds are expanded.
+    def columns(self):
+        needed = set(self.fields or ()) | {'id'}
+        if self.sort is not None:
+            needed.add(self.sort[0])
+        if 'planet' in self.expand:
+            needed.add('planet_id')
+        return [column for column in SERIALIZED_COLUMNS[self.model] if self.fields is None or column.key in needed]
+
+    # Keyset pagination: WHERE (sort, id) > after ORDER BY sort, id LIMIT limit + 1
+    # The extra row only tells us if there is a next page, so no COUNT(*) and no OFFSET scans.
+    def statement(self):
+        model = self.model
+        if self.sort is not None:
+            return self.sorted_statement()
+        statement = select(*self.columns()).where(*self.conditions)
+        if self.limit is not None or self.stream:
+            statement = statement.order_by(model.id)
+            if self.after:
+                statement = statement.where(model.id > self.after)
+        if self.limit is not None:
+            statement = statement.limit(self.limit + 1)
+        return self.streamed(statement)
+
+    # Each range of sort_ranges() is read in index order (up to a page of it), a page that goes past the last
+    # value takes the rest from the NULLs: ORDER BY sort IS NULL, sort, id over at most two pages of rows
+    def sorted_statement(self):
+        model = self.model
+        after = self.after if self.limit is not None and self.after else None
+        ranges = []
+        for condition in sort_ranges(model, self.sort, after):
+            statement = select(*self.columns()).where(*self.conditions, condition).order_by(*sort_order(model, self.sort))
+            ranges.append(statement.limit(self.limit + 1) if self.limit is not None else statement)
+        if len(ranges) == 1:
+            return self.streamed(ranges[0])
+        rows = union_all(*[select(statement.subquery()) for statement in ranges]).subquery()
+        statement = select(*rows.c).order_by(rows.c[self.sort[0]].is_(None), *sort_order(model, self.sort, rows.c))
+        if self.limit is not None:
+            statement = statement.limit(self.limit + 1)
+        return self.streamed(statement)
+
+    def streamed(self, statement):
+        if self.stream:
+            statement = statement.execution_options(yield_per=STREAM_CHUNK_SIZE)
+        return statement
+
+    def project(self, rows):
+        if self.fields is None:
+            return rows
+        names = self.fields + list(self.expand)
+        return [{name: row[name] for name in names} for row in rows]
+
+    # Builds the response body from the rows read with statement()
+    def payload(self, rows):
+        if self.limit is None:
+            return {'msg': 'Ok', 'results': self.project(rows)}
+        next_cursor = None
+        if len(rows) > self.limit:
+            last = rows[self.limit - 1]
+            next_cursor = last['id'] if self.sort is None else encode_cursor(last[self.sort[0]], last['id'])
+        return {'msg': 'Ok', 'results': self.project(rows[:self.limit]), 'next': next_cursor}
+
+# Opening of a streamed list, ?compact=1 drops the message like it does for the other responses
+def stream_prefix(list_query):
+    return '{"results":[' if list_query.compact else '{"msg": "Ok", "results": ['
+
+# Yields the same {'msg': 'Ok', 'results': [...]} envelope in chunks, fetching rows with a server-side cursor
+def stream_results(list_query):
+    statement = list_query.statement()
+    dumps = current_app.json.dumps
+
+    def generate():
+        yield stream_prefix(list_query)
+        first = True
+        for partition in db.session.execute(statement).mappings().partitions():
+            rows = [dict(row) for row in partition]
+            if 'planet' in list_query.expand:
+                expand_homeworlds(rows)
+            # Each chunk is encoded as one list, without its brackets, and joined with the previous one
+            yield ('' if first else ',') + dumps(list_query.project(rows))[1:-1]
+            first = False
+        yield ']}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+# Shared body of the list endpoints: streamed, paginated or (by default) the whole table like before
+def list_results(model):
+    list_query = ListQuery(model)
+    if list_query.stream:
+        return stream_results(list_query)
+    rows = serialized_rows(list_query.statement())
+    # Homeworlds are read for the whole page at once, not once per person
+    if 'planet' in list_query.expand:
+        expand_homeworlds(rows)
+    return jsonify(list_query.payload(rows)), 200
@@ -0,0 +1,172 @@
+import os
+import math
+import time
+import threading
+from functools import wraps
+from flask import request, jsonify
+from database import env_flag
+import metrics
+
+RATE_LIMIT_ENABLED = env_flag('RATE_LIMIT_ENABLED', 'true')
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 100000))
+
+PERIODS = {'second': 1, 'minute': 60, 'hour': 3600}
+
+# Limits by name, "<requests>/<second|minute|hour>" overridable with RATE_LIMIT_<NAME>.
+# A bucket holds <requests> tokens and refills at <requests> per period, so a client can burst up to
+# the whole allowance at once and then continues at the average rate.
+DEFAULT_LIMITS = {
+    'favorites': '60/minute',
+    'bulk_favorites': '10/minute',
+}
+
+def parse_limit(text):
+    requests, _, period = text.partition('/')
+    if period not in PERIODS or not requests.strip().isdigit() or int(requests) < 1:
+        raise ValueError('Invalid rate limit {!r}, use <requests>/<second|minute|hour>'.format(text))
+    capacity = int(requests)
+    return capacity, capacity / PERIODS[period]
+
+# Token bucket of every key in the memory of the worker. Buckets are spread over a fixed set of locks,
+# so requests of different clients almost never wait for each other. A full bucket is the same as a
+# missing one, full buckets are dropped when there are more than max_keys.
+class TokenBucketStore:
+    def __init__(self, max_keys=RATE_LIMIT_MAX_KEYS, stripes=64):
+        self.max_keys = max_keys
+        self.buckets = {}
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    # Takes cost tokens from the bucket of every key, or from none of them when one is short.
+    # Returns (allowed, seconds until allowed).
+    def take(self, keys, capacity, rate, cost=1):
+        now = time.monotonic()
+        # Always in the same order, two requests sharing two stripes can not wait for each other
+        locks = [self.locks[index] for index in sorted({hash(key) % len(self.locks) for key in keys})]
+        for lock in locks:
+            lock.acquire()
+        try:
+            levels = []
+            for key in keys:
+                tokens, updated_at, full_at = self.buckets.get(key, (capacity, now, now))
+                levels.append(min(capacity, tokens + (now - updated_at) * rate))
+            lowest = min(levels)
+            allowed = lowest >= cost
+            for key, tokens in zip(keys, levels):
+                if allowed:
+                    tokens -= cost
+                self.buckets[key] = (tokens, now, now + (capacity - tokens) / rate)
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        if len(self.buckets) > self.max_keys:
+            self.prune(now)
+        return allowed, 0 if allowed else (cost - lowest) / rate
+
+    def prune(self, now):
+        for key, (tokens, updated_at, full_at) in list(self.buckets.items()):
+            if full_at <= now:
+                self.buckets.pop(key, None)
+        # Still too many clients inside their window, the oldest keys lose their state first
+        excess = len(self.buckets) - self.max_keys * 3 // 4
+        for key in list(self.buckets)[:max(0, excess)]:
+            self.buckets.pop(key, None)
+
+    def clear(self):
+        self.buckets.clear()
+
+# Atomic refill and take in Redis, every worker and instance shares the same buckets.
+# Every bucket of KEYS is refilled first, the tokens are taken from all of them only if none is short.
+# A bucket expires once it would be full again.
+TAKE_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local time = redis.call('TIME')
+local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+local levels = {}
+local lowest = capacity
+for index, key in ipairs(KEYS) do
+    local bucket = redis.call('HMGET', key, 'tokens', 'updated_at')
+    local tokens = tonumber(bucket[1]) or capacity
+    local updated_at = tonumber(bucket[2]) or now
+    levels[index] = math.min(capacity, tokens + math.max(0, now - updated_at) * rate)
+    lowest = math.min(lowest, levels[index])
+end
+local allowed = 0
+if lowest >= cost then
+    allowed = 1
+end
+for index, key in ipairs(KEYS) do
+    local tokens = levels[index]
+    if allowed == 1 then
+        tokens = tokens - cost
+    end
+    redis.call('HSET', key, 'tokens', tostring(tokens), 'updated_at', tostring(now))
+    redis.call('EXPIRE', key, math.ceil(capacity / rate) + 1)
+end
+return {allowed, tostring(lowest)}
+"""
+
+# Same interface on top of a redis-py compatible client, for several workers or instances
+class RedisTokenBucketStore:
+    def __init__(self, client, prefix='swapi:ratelimit:'):
+        self.client = client
+        self.prefix = prefix
+        self.script = client.register_script(TAKE_SCRIPT)
+
+    def take(self, keys, capacity, rate, cost=1):
+        allowed, lowest = self.script(keys=[self.prefix + key for key in keys], args=[capacity, rate, cost])
+        return bool(allowed), 0 if allowed else (cost - float(lowest)) / rate
+
+    def clear(self):
+        keys = list(self.client.scan_iter(self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+store = TokenBucketStore()
+
+def get_limit(name):
+    return parse_limit(os.getenv('RATE_LIMIT_' + name.upper(), DEFAULT_LIMITS[name]))
+
+# Buckets of a request: one per user (from the URL) and one per client IP, both have to allow it.
+# A client cycling through user ids is stopped by its IP, a user spread over many IPs by its id.
+def request_keys(name, user_id):
+    keys = ['{}:ip:{}'.format(name, request.remote_addr)]
+    if user_id is not None:
+        keys.append('{}:user:{}'.format(name, user_id))
+    return keys
+
+def too_many_requests(retry_after):
+    response = jsonify({'msg': 'Too many requests, retry in {} seconds'.format(retry_after)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
+# Applies the limit called name to a view, keyed by its user_id argument and the client IP.
+# Rejected requests get a 429 with Retry-After and never reach the database.
+def rate_limited(name):
+    capacity, rate = get_limit(name)
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if not RATE_LIMIT_ENABLED:
+                return view(*args, **kwargs)
+            # A request rejected by one bucket takes nothing from the other
+            allowed, wait = store.take(request_keys(name, kwargs.get('user_id')), capacity, rate)
+            if not allowed:
+                metrics.count_rate_limit(name, 'limited')
+                return too_many_requests(max(1, math.ceil(wait)))
+            metrics.count_rate_limit(name, 'allowed')
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def setup_rate_limit(app):
+    global store
+    redis_url = os.getenv('RATE_LIMIT_REDIS_URL')
+    if redis_url is not None:
+        import redis
+        store = RedisTokenBucketStore(redis.Redis.from_url(redis_url))
+    else:
+        store = TokenBucketStore()
@@ -0,0 +1,172 @@
+import os
+import math
+import time
+import logging
+import itertools
+import threading
+from flask import g, request, has_request_context
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError, OperationalError
+from database import RoutingSession, engine_options, pool_status
+from models import db
+
+# Comma separated URLs of read replicas of DATABASE_URL, e.g. postgresql://replica-1/db,postgresql://replica-2/db
+REPLICA_URLS = [url.strip().replace('postgres://', 'postgresql://') for url in os.getenv('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+# Seconds a replica may be behind. The reads of a client stay on the primary that long after its own writes, and a Postgres
+# replica further behind is taken out of the rotation until it catches up.
+REPLICA_MAX_LAG = float(os.getenv('REPLICA_MAX_LAG', 2))
+REPLICA_HEALTH_INTERVAL = float(os.getenv('REPLICA_HEALTH_INTERVAL', 5))
+
+READ_METHODS = ('GET', 'HEAD')
+# Time of the last write of a client, set on the responses of its writes and sent back by browsers (the cookie)
+# or by API clients that copy it (the header)
+LAST_WRITE_COOKIE = 'last_write'
+LAST_WRITE_HEADER = 'X-Last-Write'
+
+replica_logger = logging.getLogger('replicas')
+
+# Replay lag of a streaming replica in seconds, 0 when it has replayed everything it received
+POSTGRES_LAG = text(
+    'SELECT CASE WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 '
+    'ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END'
+)
+
+# Flask-SQLAlchemy bind of each replica, with the same pool settings as the primary
+def replica_binds(urls):
+    return {'replica_{}'.format(index): dict(engine_options(url), url=url) for index, url in enumerate(urls)}
+
+class Replica:
+    def __init__(self, bind_key):
+        self.bind_key = bind_key
+        self.healthy = True
+        self.checked_at = None
+        self.lock = threading.Lock()
+
+# Sends the SELECTs of GET/HEAD requests to the replicas, round-robin over the healthy ones.
+# A request keeps the replica it started with, and goes to the primary for the rest of it once it writes.
+class ReplicaRouter:
+    def __init__(self, bind_keys):
+        self.replicas = [Replica(bind_key) for bind_key in bind_keys]
+        self.counter = itertools.count()
+
+    def read_engine(self, session, clause):
+        if not has_request_context() or request.method not in READ_METHODS:
+            return None
+        # Only SELECTs can go to a replica, text(), DML and flushes stay on the primary
+        if clause is None or not getattr(clause, 'is_select', False) or session.info.get('primary'):
+            return None
+        engines = db.engines
+        bind_key = session.info.get('replica')
+        if bind_key is None:
+            # Right after a write of this client the replicas may not have it yet, other clients still use them
+            bind_key = session.info['replica'] = '' if written_recently() else self.next_healthy(engines)
+        return engines[bind_key] if bind_key else None
+
+    def next_healthy(self, engines):
+        for _ in self.replicas:
+            replica = self.replicas[next(self.counter) % len(self.replicas)]
+            if self.is_healthy(replica, engines[replica.bind_key]):
+                return replica.bind_key
+        return ''
+
+    # Checked at most every REPLICA_HEALTH_INTERVAL seconds by one thread, the others use the last result
+    def is_healthy(self, replica, engine):
+        due = replica.checked_at is None or time.monotonic() - replica.checked_at >= REPLICA_HEALTH_INTERVAL
+        if due and replica.lock.acquire(blocking=False):
+            try:
+                replica.healthy = check_replica(engine)
+                replica.checked_at = time.monotonic()
+            finally:
+                replica.lock.release()
+        return replica.healthy
+
+    def mark_unhealthy(self, engine):
+        for replica in self.replicas:
+            if db.engines.get(replica.bind_key) is engine:
+                replica.healthy = False
+                replica.checked_at = time.monotonic()
+
+    def status(self):
+        engines = db.engines
+        return [
+            dict(pool_status(engines[replica.bind_key]), bind=replica.bind_key, healthy=self.is_healthy(replica, engines[replica.bind_key]))
+            for replica in self.replicas
+        ]
+
+def check_replica(engine):
+    try:
+        with engine.connect() as connection:
+            if engine.dialect.name == 'postgresql':
+                lag = connection.execute(POSTGRES_LAG).scalar()
+                if lag > REPLICA_MAX_LAG:
+                    replica_logger.warning('Replica %s is %.1f seconds behind, reading from the primary', engine.url.host, lag)
+                    return False
+            else:
+                connection.execute(text('SELECT 1'))
+        return True
+    except SQLAlchemyError as error:
+        replica_logger.warning('Replica %s is unavailable: %s', engine.url.host or engine.url.database, error)
+        return False
+
+# Whether the client of the request wrote less than REPLICA_MAX_LAG seconds ago
+def written_recently():
+    last_write = request.headers.get(LAST_WRITE_HEADER) or request.cookies.get(LAST_WRITE_COOKIE)
+    try:
+        return last_write is not None and time.time() - float(last_write) < REPLICA_MAX_LAG
+    except ValueError:
+        return False
+
+# The rest of the request reads from the primary even if it does not write, for pages that must not be behind it
+def read_from_primary():
+    db.session.info['primary'] = True
+
+def replica_status():
+    return RoutingSession.router.status() if RoutingSession.router is not None else []
+
+def _pin_after_flush(session, flush_context):
+    session.info['primary'] = True
+    session.info['wrote'] = True
+
+def _pin_on_write(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        orm_execute_state.session.info['primary'] = True
+        orm_execute_state.session.info['wrote'] = True
+
+def _record_write_after_commit(session):
+    if session.info.pop('wrote', False) and has_request_context():
+        g.replica_wrote = True
+
+def _forget_write_after_rollback(session):
+    session.info.pop('wrote', None)
+
+# A replica failing in the middle of a request is taken out until its next health check
+@event.listens_for(Engine, 'handle_error')
+def replica_error(context):
+    if RoutingSession.router is not None and (context.is_disconnect or isinstance(context.sqlalchemy_exception, OperationalError)):
+        RoutingSession.router.mark_unhealthy(context.engine)
+
+# Tells the client when it wrote: a successful request that is not a read (its write may have been committed by the
+# group commit thread) or one whose session committed a write
+def remember_write(response):
+    if response.status_code < 400 and (request.method not in READ_METHODS or g.get('replica_wrote')):
+        last_write = '{:.3f}'.format(time.time())
+        response.set_cookie(LAST_WRITE_COOKIE, last_write, max_age=math.ceil(REPLICA_MAX_LAG), httponly=True, samesite='Lax')
+        response.headers[LAST_WRITE_HEADER] = last_write
+    return response
+
+# Has to run before db.init_app, the replicas are Flask-SQLAlchemy binds so they get the pool metrics,
+# pre-ping and the engine disposal after fork like the primary.
+def setup_replicas(app):
+    if not REPLICA_URLS:
+        RoutingSession.router = None
+        return
+    binds = replica_binds(REPLICA_URLS)
+    app.config['SQLALCHEMY_BINDS'] = dict(app.config.get('SQLALCHEMY_BINDS') or {}, **binds)
+    RoutingSession.router = ReplicaRouter(list(binds))
+    app.after_request(remember_write)
+    if not event.contains(db.session, 'after_flush', _pin_after_flush):
+        event.listen(db.session, 'after_flush', _pin_after_flush)
+        event.listen(db.session, 'do_orm_execute', _pin_on_write)
+        event.listen(db.session, 'after_commit', _record_write_after_commit)
+        event.listen(db.session, 'after_rollback', _forget_write_after_rollback)
@@ -0,0 +1,180 @@
+import re
+import heapq
+import threading
+import itertools
+from sqlalchemy import select, literal, func, case, or_, text, union_all
+from models import db, Planets, People
+from cache import get_table_versions
+
+# Entity types returned by /search
+SEARCH_MODELS = {
+    'person': People,
+    'planet': Planets,
+}
+
+# Words of a name with the position of the first one, every suffix of the name is a key of the trie
+def name_suffixes(name):
+    words = name.lower().split()
+    for position in range(len(words)):
+        yield position, ' '.join(words[position:])
+
+class TrieNode:
+    __slots__ = ('children', 'hits', 'best')
+
+    def __init__(self):
+        self.children = {}
+        # Rank keys (position, length, name, type, id) of the names with a suffix ending here
+        self.hits = []
+        # Smallest rank key of the subtree, the search visits the subtrees in this order
+        self.best = None
+
+    def update_best(self):
+        keys = self.hits + [child.best for child in self.children.values()]
+        self.best = min(keys) if keys else None
+
+# In-memory index used when the database has no search index (no pg_trgm, no FTS5 table, or MySQL).
+# Every word of a name is a key, so "sky" finds "Luke Skywalker", and hits that start the name rank first,
+# then shorter names. Names can be added and removed one by one, it is never rebuilt.
+class NameTrie:
+    def __init__(self):
+        self.root = TrieNode()
+        self.names = {type_name: {} for type_name in SEARCH_MODELS}
+
+    def add(self, type_name, id, name):
+        self.names[type_name][id] = name
+        for position, suffix in name_suffixes(name):
+            key = (position, len(name), name, type_name, id)
+            node = self.root
+            path = [node]
+            for character in suffix:
+                node = node.children.setdefault(character, TrieNode())
+                path.append(node)
+            node.hits.append(key)
+            for node in path:
+                if node.best is None or key < node.best:
+                    node.best = key
+
+    def remove(self, type_name, id):
+        name = self.names[type_name].pop(id, None)
+        if name is None:
+            return
+        for position, suffix in name_suffixes(name):
+            path = [self.root]
+            for character in suffix:
+                path.append(path[-1].children[character])
+            path[-1].hits.remove((position, len(name), name, type_name, id))
+            # Bottom-up, the nodes left empty are dropped and the others get the best key of what remains
+            for depth in range(len(path) - 1, -1, -1):
+                node = path[depth]
+                if depth and not node.hits and not node.children:
+                    del path[depth - 1].children[suffix[depth - 1]]
+                else:
+                    node.update_best()
+
+    # Makes the names of one type the ones of rows (id, name): only the added, renamed and deleted ones change
+    def update(self, type_name, rows):
+        current = {id: name for id, name in rows}
+        known = self.names[type_name]
+        for id in [id for id, name in known.items() if current.get(id) != name]:
+            self.remove(type_name, id)
+        for id, name in current.items():
+            if id not in known:
+                self.add(type_name, id, name)
+
+    # The first `count` hits in rank order. The subtrees are visited best key first, so the walk stops once
+    # it has them instead of collecting and sorting every match.
+    def search(self, query, count):
+        node = self.root
+        for character in ' '.join(query.lower().split()):
+            node = node.children.get(character)
+            if node is None:
+                return []
+        hits = []
+        seen = set()
+        order = itertools.count()
+        pending = [(node.best, next(order), node)] if node.best is not None else []
+        while pending and len(hits) < count:
+            key, _, node = heapq.heappop(pending)
+            if node is not None:
+                for hit in node.hits:
+                    heapq.heappush(pending, (hit, next(order), None))
+                for child in node.children.values():
+                    heapq.heappush(pending, (child.best, next(order), child))
+                continue
+            # A name matching at several words is found first at its best position
+            position, length, name, type_name, id = key
+            if (type_name, id) not in seen:
+                seen.add((type_name, id))
+                hits.append({'type': type_name, 'id': id, 'name': name, 'score': round(1.0 / (1 + position), 3)})
+        return hits
+
+trie_lock = threading.Lock()
+trie_state = {'trie': None, 'versions': {}}
+backends = {}
+
+# The trie is built once per process. A write to people or planets in any worker bumps the version of its table
+# (the one of the ETags), the names of that table are then read again and only the ones that changed are updated.
+def get_trie():
+    versions = dict(zip(SEARCH_MODELS, get_table_versions(model.__tablename__ for model in SEARCH_MODELS.values())))
+    with trie_lock:
+        if trie_state['trie'] is None:
+            trie_state['trie'] = NameTrie()
+        for type_name, model in SEARCH_MODELS.items():
+            if trie_state['versions'].get(type_name) != versions[type_name]:
+                # From the primary, names read from a replica behind it would be kept until the next write
+                names = db.session.execute(select(model.id, model.name).where(model.name.isnot(None)), bind_arguments={'bind': db.engine})
+                trie_state['trie'].update(type_name, names)
+                trie_state['versions'][type_name] = versions[type_name]
+        return trie_state['trie']
+
+# pg_trgm on Postgres, the FTS5 table on SQLite (both created by the migrations), the trie otherwise
+def get_backend():
+    bind = db.session.get_bind()
+    key = str(bind.url)
+    if key not in backends:
+        backend = 'trie'
+        if bind.dialect.name == 'postgresql':
+            if db.session.execute(text("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")).first() is not None:
+                backend = 'trigram'
+        elif bind.dialect.name == 'sqlite':
+            if db.session.execute(text("SELECT 1 FROM sqlite_master WHERE name = 'search_index'")).first() is not None:
+                backend = 'fts5'
+        backends[key] = backend
+    return backends[key]
+
+def like_escape(value):
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+# Names containing the query or similar to it (the % operator), served by the GIN trigram indexes.
+# Names starting with the query rank first, then by trigram similarity.
+def search_trigram(query, limit, offset):
+    branches = []
+    for type_name, model in SEARCH_MODELS.items():
+        starts_with = model.name.ilike(like_escape(query) + '%', escape='\\')
+        score = func.similarity(model.name, query) + case((starts_with, 1), else_=0)
+        branches.append(
+            select(literal(type_name).label('type'), model.id, model.name, score.label('score'))
+            .where(or_(model.name.ilike('%' + like_escape(query) + '%', escape='\\'), model.name.op('%')(query)))
+        )
+    hits = union_all(*branches).subquery()
+    statement = select(hits).order_by(hits.c.score.desc(), hits.c.name).limit(limit).offset(offset)
+    return [dict(row, score=round(row['score'], 3)) for row in db.session.execute(statement).mappings()]
+
+# Every word of the query is matched as a prefix, quoted so the query can not use the FTS5 syntax
+def search_fts5(query, limit, offset):
+    match = ' '.join('"{}"*'.format(word) for word in re.findall(r'\w+', query))
+    if not match:
+        return []
+    rows = db.session.execute(text(
+        'SELECT type, item_id AS id, name, -bm25(search_index) AS score FROM search_index '
+        'WHERE search_index MATCH :match ORDER BY bm25(search_index), name LIMIT :limit OFFSET :offset'
+    ), {'match': match, 'limit': limit, 'offset': offset}).mappings()
+    return [dict(row, score=round(row['score'], 3)) for row in rows]
+
+def search_names(query, limit, offset):
+    backend = get_backend()
+    if backend == 'trigram':
+        return search_trigram(query, limit, offset)
+    if backend == 'fts5':
+        return search_fts5(query, limit, offset)
+    return get_trie().search(query, offset + limit)[offset:]
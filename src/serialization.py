@@ -0,0 +1,80 @@
+import os
+from flask import request, has_request_context
+from flask.json.provider import DefaultJSONProvider
+from sqlalchemy import select
+from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Columns read by the list endpoints, labelled like the keys of each model's serialize() (keep both in sync).
+# Selecting them as Core rows skips building ORM objects, the identity map and one serialize() call per row.
+SERIALIZED_COLUMNS = {
+    User: [User.id, User.email, User.is_active],
+    Planets: [Planets.id, Planets.name, Planets.population, Planets.climate, Planets.diameter],
+    People: [People.id, People.name, People.birth_year, People.gender, People.height, People.eye_color, People.planet_id],
+    FavoritesPlanets: [FavoritesPlanets.id, FavoritesPlanets.user_id, FavoritesPlanets.planet_id],
+    FavoritePeople: [FavoritePeople.id, FavoritePeople.user_id, FavoritePeople.people_id.label('person_id')],
+}
+
+def select_serialized(model):
+    return select(*SERIALIZED_COLUMNS[model])
+
+# Runs a select_serialized() statement and returns plain dicts ready to be encoded
+def serialized_rows(statement):
+    return [dict(row) for row in db.session.execute(statement).mappings()]
+
+# ?compact=1 asks for the smallest body: no whitespace and no "msg": "Ok" in the envelope.
+# Error messages are kept, only the constant success message is dropped.
+def wants_compact(args=None):
+    if args is None:
+        if not has_request_context():
+            return False
+        args = request.args
+    return args.get('compact', '').lower() in ('1', 'true', 'yes')
+
+def compact_envelope(obj):
+    if isinstance(obj, dict) and str(obj.get('msg', '')).lower() == 'ok':
+        return {key: value for key, value in obj.items() if key != 'msg'}
+    return obj
+
+# JSON provider that encodes with orjson, falling back to the standard library when it is not installed (or not wanted).
+# Types orjson can not encode (and dates, to keep Flask's format) go through the default() of Flask's provider.
+class FastJSONProvider(DefaultJSONProvider):
+    sort_keys = False
+    use_orjson = orjson is not None
+
+    def dumps(self, obj, **kwargs):
+        if not self.use_orjson or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.orjson_options()).decode()
+
+    def loads(self, s, **kwargs):
+        if not self.use_orjson or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        compact = wants_compact()
+        if not compact and (not self.use_orjson or self.compact is False or self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        if compact:
+            obj = compact_envelope(obj)
+        if not self.use_orjson:
+            return self._app.response_class(super().dumps(obj, separators=(',', ':')) + '\n', mimetype=self.mimetype)
+        return self._app.response_class(orjson.dumps(obj, default=self.default, option=self.orjson_options()), mimetype=self.mimetype)
+
+    def orjson_options(self):
+        options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+# JSON_ENCODER=stdlib keeps Flask's own encoder, by default orjson is used when it is installed
+def setup_json(app):
+    app.json = FastJSONProvider(app)
+    if os.getenv('JSON_ENCODER', 'auto') == 'stdlib':
+        app.json.use_orjson = False
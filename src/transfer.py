@@ -0,0 +1,218 @@
+import os
+import csv
+import json
+from sqlalchemy import select, update, func, tuple_, bindparam
+from sqlalchemy.dialects import postgresql, sqlite, mysql
+from models import db, User, Planets, People, FavoritesPlanets, FavoritePeople
+from leaderboard import LEADERBOARDS, rebuild_favorites_counts
+import cache
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+TRANSFER_BATCH_SIZE = int(os.getenv('TRANSFER_BATCH_SIZE', 5000))
+
+# Tables that can be imported and exported, with the unique columns an imported row is matched on.
+# Catalog rows with a known name are updated, favorites that already exist are skipped.
+TRANSFER_TABLES = {
+    'user': (User, ['email']),
+    'planets': (Planets, ['name']),
+    'people': (People, ['name']),
+    'favorites_planets': (FavoritesPlanets, ['user_id', 'planet_id']),
+    'favorite_people': (FavoritePeople, ['user_id', 'people_id']),
+}
+
+# Derived columns, recomputed after an import instead of being read from the file
+COMPUTED_COLUMNS = ('favorites_count',)
+# Left out of the exports unless asked for, so a dump of the users does not spread their passwords
+SECRET_COLUMNS = ('password',)
+
+FORMATS = ('jsonl', 'csv')
+
+class TransferError(Exception):
+    pass
+
+def file_format(path, format=None):
+    format = format or os.path.splitext(path)[1].lstrip('.').lower()
+    if format == 'json':
+        format = 'jsonl'
+    if format not in FORMATS:
+        raise TransferError('Unknown format {}, use one of {}'.format(format or '(none)', ', '.join(FORMATS)))
+    return format
+
+# Converts a value to the type of its column. CSV only has strings, there an empty value means NULL.
+def parse_value(column, value, empty_is_null):
+    if value is None or empty_is_null and value == '':
+        return None
+    python_type = column.type.python_type
+    if python_type is bool and isinstance(value, str):
+        return value.lower() in ('1', 'true', 'yes', 't')
+    if isinstance(value, python_type):
+        return value
+    return python_type(value)
+
+def loads(line):
+    return orjson.loads(line) if orjson is not None else json.loads(line)
+
+def dumps(row):
+    return orjson.dumps(row).decode() if orjson is not None else json.dumps(row)
+
+# Yields (line number, record) as read from the file, the line of a CSV record is the one it ends on
+def read_records(stream, format):
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+        return
+    for line_number, line in enumerate(stream, start=1):
+        if line.strip():
+            try:
+                yield line_number, loads(line)
+            except ValueError as error:
+                raise TransferError('Line {}: invalid JSON, {}'.format(line_number, error))
+
+# Yields (line number, row) one at a time, so files of any size are read with constant memory
+def read_rows(table, stream, format):
+    columns = {column.key: column for column in table.columns if column.key not in COMPUTED_COLUMNS}
+    for line_number, record in read_records(stream, format):
+        if not isinstance(record, dict):
+            raise TransferError('Line {}: every row must be an object'.format(line_number))
+        # csv.DictReader puts the values past the last column of the header under None
+        if None in record:
+            raise TransferError('Line {}: {} values for the {} columns of the header'.format(line_number, len(record) - 1 + len(record[None]), len(record) - 1))
+        unknown = [name for name in record if name not in columns and name not in COMPUTED_COLUMNS]
+        if unknown:
+            raise TransferError('Line {}: unknown columns {}'.format(line_number, ', '.join(unknown)))
+        try:
+            record = {name: parse_value(columns[name], value, format == 'csv') for name, value in record.items() if name in columns}
+        except (ValueError, TypeError) as error:
+            raise TransferError('Line {}: {}'.format(line_number, error))
+        yield line_number, record
+
+# INSERT ... ON CONFLICT (keys) DO UPDATE / DO NOTHING where the dialect has it, ON DUPLICATE KEY UPDATE on MySQL.
+# Executed with a list of rows, SQLAlchemy sends them as multi-row INSERTs.
+def upsert_statement(table, keys, names):
+    dialect = db.session.get_bind().dialect.name
+    updated = [name for name in names if name not in keys and name != 'id']
+    if dialect in ('postgresql', 'sqlite'):
+        insert = (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+        if not updated:
+            return insert.on_conflict_do_nothing(index_elements=keys)
+        return insert.on_conflict_do_update(index_elements=keys, set_={name: insert.excluded[name] for name in updated})
+    if dialect == 'mysql':
+        insert = mysql.insert(table)
+        if not updated:
+            return insert.prefix_with('IGNORE')
+        return insert.on_duplicate_key_update({name: insert.inserted[name] for name in updated})
+    return table.insert()
+
+# NOT NULL columns without a default, an INSERT without them fails even when the ON CONFLICT would update instead
+def missing_required(table, names):
+    return [
+        column.key for column in table.columns
+        if column.key not in names and not column.nullable and not column.primary_key and column.default is None and column.server_default is None
+    ]
+
+# Rows without a required column (the users of an export without passwords) can only update the rows they match
+def update_existing(table, keys, names, rows, missing):
+    key_columns = [table.c[key] for key in keys]
+    wanted = {tuple(row.get(key) for key in keys) for row in rows}
+    found = {tuple(row) for row in db.session.execute(select(*key_columns).where(tuple_(*key_columns).in_(wanted)))}
+    if len(found) < len(wanted):
+        raise TransferError('{} rows match no existing row of {} and have no {}'.format(len(wanted - found), table.name, ', '.join(missing)))
+    updated = [name for name in names if name not in keys and name != 'id']
+    if updated:
+        statement = update(table).where(*[column == bindparam('key_' + column.key) for column in key_columns])
+        statement = statement.values({name: bindparam('new_' + name) for name in updated})
+        db.session.execute(statement, [
+            dict({'key_' + key: row[key] for key in keys}, **{'new_' + name: row[name] for name in updated}) for row in rows
+        ])
+
+def write_batch(table, keys, batch):
+    # Rows of a batch can have different columns, each set of columns gets its own statement
+    groups = {}
+    for row in batch:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+    for names, rows in groups.items():
+        missing = missing_required(table, names)
+        if missing:
+            update_existing(table, keys, names, rows, missing)
+        else:
+            db.session.execute(upsert_statement(table, keys, names), rows)
+
+# Imported rows can carry their ids, Postgres sequences have to be moved past them
+def reset_sequence(table):
+    dialect = db.session.get_bind().dialect
+    if dialect.name == 'postgresql':
+        next_id = select(func.coalesce(func.max(table.c.id), 0) + 1).scalar_subquery()
+        sequence = func.pg_get_serial_sequence(dialect.identifier_preparer.format_table(table), 'id')
+        db.session.execute(select(func.setval(sequence, next_id, False)))
+
+# Imported rows can carry their ids and favorites are written without the handlers, so the sequence and the counts
+# are brought in line once at the end. The rows were written with Core statements, nothing told the caches about them:
+# the shared version of the table changes the ETags and the search of every worker, the entity cache cleared is the
+# one of this process (with CACHE_REDIS_URL the one of every worker, otherwise theirs expire after CACHE_TTL).
+def finish_import(model):
+    table = model.__table__
+    try:
+        reset_sequence(table)
+        for name, (item_model, favorite_model) in LEADERBOARDS.items():
+            if favorite_model is model:
+                rebuild_favorites_counts(name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        cache.cache.clear()
+        cache.bump_table_versions([table.name])
+
+# Imports a JSON Lines or CSV stream in batches of batch_size rows, each batch in its own transaction.
+# Returns the number of rows read.
+def import_rows(table_name, stream, format, batch_size=TRANSFER_BATCH_SIZE):
+    model, keys = TRANSFER_TABLES[table_name]
+    table = model.__table__
+    count = 0
+    batch = []
+    try:
+        for line_number, row in read_rows(table, stream, format):
+            batch.append(row)
+            count += 1
+            if len(batch) == batch_size:
+                write_batch(table, keys, batch)
+                db.session.commit()
+                batch = []
+        if batch:
+            write_batch(table, keys, batch)
+            db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        # Also when a batch failed, the ones committed before it are in the table
+        finish_import(model)
+    return count
+
+# Streams a whole table ordered by id with a server-side cursor, writing batch_size rows at a time.
+# The SECRET_COLUMNS are only written with include_secrets. Returns the number of rows written.
+def export_rows(table_name, stream, format, batch_size=TRANSFER_BATCH_SIZE, include_secrets=False):
+    model, keys = TRANSFER_TABLES[table_name]
+    table = model.__table__
+    columns = [column for column in table.columns if include_secrets or column.key not in SECRET_COLUMNS]
+    statement = select(*columns).order_by(table.c.id).execution_options(yield_per=batch_size)
+    names = [column.key for column in columns]
+    writer = csv.writer(stream) if format == 'csv' else None
+    if writer is not None:
+        writer.writerow(names)
+    count = 0
+    # Plain tuples, the rows are written as they come without building a mapping per row for CSV
+    for partition in db.session.execute(statement).partitions():
+        if writer is not None:
+            writer.writerows(partition)
+        else:
+            stream.write(''.join(dumps(dict(zip(names, row))) + '\n' for row in partition))
+        count += len(partition)
+    db.session.rollback()
+    return count
@@ -0,0 +1,48 @@
+import os
+import sys
+import tempfile
+import pytest
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS_DIR, '..', 'src'))
+# After src, benchmarks/ has scripts named like some src modules
+sys.path.append(os.path.join(TESTS_DIR, '..', 'benchmarks'))
+
+# Read when the modules are imported, so before any of them
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'tests.db')
+os.environ['RATE_LIMIT_ENABLED'] = 'false'
+os.environ['SLOW_QUERY_MS'] = '10000'
+# The tests that count statements must not see a refresh of the table versions, the others expire them themselves
+os.environ['VERSIONS_REFRESH'] = '3600'
+
+from sqlalchemy import event
+from app import create_app
+from models import db
+from seed import seed
+import cache
+
+# One app and one seeded SQLite database for the whole run
+@pytest.fixture(scope='session')
+def app():
+    app = create_app()
+    with app.app_context():
+        seed(users=50, planets=200, people=1000, favorites=100)
+    return app
+
+# Every request starts with an empty entity cache, so the handlers run their statements
+@pytest.fixture
+def client(app):
+    cache.cache.clear()
+    return app.test_client()
+
+# (statement, parameters) of everything the requests made inside the test run on the database, executemany included
+@pytest.fixture
+def executed(app):
+    statements = []
+    def record(connection, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters, executemany))
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', record)
+    yield statements
+    event.remove(engine, 'before_cursor_execute', record)
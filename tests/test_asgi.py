@@ -0,0 +1,46 @@
+import json
+import asyncio
+import pytest
+
+pytest.importorskip('asgiref')
+pytest.importorskip('aiosqlite')
+import asgi
+
+# The async read endpoints must answer like the Flask routes they stand in for
+PATHS = [
+    '/favoritesPlanets/user/1',
+    '/favoritePeople/user/1?expand=planet',
+    '/favoritePeople/user/1000000',
+    '/users/favorites/1?people_limit=3&planets_limit=2',
+    '/people?gender=female&gender=male&limit=5',
+    '/people?name=&limit=5',
+    '/planets?sort=name&sort=-id&limit=5',
+]
+
+@pytest.fixture(scope='module')
+def loop(app):
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.run_until_complete(asgi.engine.dispose())
+    loop.close()
+
+def asgi_get(loop, url):
+    path, _, query = url.partition('?')
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': query.encode(), 'root_path': '', 'headers': [],
+        'server': ('testserver', 80), 'client': ('127.0.0.1', 50000),
+    }
+    messages = []
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+    async def send(message):
+        messages.append(message)
+    loop.run_until_complete(asgi.application(scope, receive, send))
+    body = b''.join(message.get('body', b'') for message in messages[1:])
+    return messages[0]['status'], json.loads(body)
+
+@pytest.mark.parametrize('url', PATHS)
+def test_async_endpoint_answers_like_flask(client, loop, url):
+    response = client.get(url)
+    assert asgi_get(loop, url) == (response.status_code, response.get_json())
@@ -0,0 +1,39 @@
+PATHS = ['/people/1?expand=planet', '/planets/2', '/users?limit=5', '/people/1000000', '/planets?sort=nope']
+
+def batch(client, requests):
+    response = client.post('/batch', json={'requests': requests})
+    assert response.status_code == 200
+    return [(result['status'], result['body']) for result in response.get_json()['results']]
+
+def test_results_are_the_responses_of_the_calls_made_alone(client):
+    alone = [(response.status_code, response.get_json()) for response in map(client.get, PATHS)]
+    assert batch(client, [{'path': path} for path in PATHS]) == alone
+
+def test_duplicated_gets_run_once(client, executed):
+    batch(client, [{'path': '/users?limit=5'}])
+    once = len(executed)
+    del executed[:]
+    batch(client, [{'path': '/users?limit=5'}] * 3)
+    assert len(executed) == once
+
+def favorite_planet_ids(body):
+    return {favorite['planet']['id'] for favorite in body['results'] if 'planet' in favorite}
+
+# Sub-requests run in order: a read after a write sees it, and writes are never deduplicated
+def test_reads_see_the_writes_before_them(client):
+    path = '/favorite/planet/195/user/45'
+    results = batch(client, [
+        {'method': 'POST', 'path': path},
+        {'path': '/users/favorites/45'},
+        {'method': 'POST', 'path': path},
+        {'method': 'DELETE', 'path': path},
+        {'path': '/users/favorites/45'},
+    ])
+    assert [status for status, body in results] == [201, 200, 409, 200, 200]
+    assert 195 in favorite_planet_ids(results[1][1])
+    assert 195 not in favorite_planet_ids(results[4][1])
+
+def test_invalid_batches_are_rejected(client):
+    assert client.post('/batch', json={'requests': {}}).status_code == 400
+    assert client.post('/batch', json={'requests': [{'path': 'people/1'}]}).status_code == 400
+    assert batch(client, [{'method': 'POST', 'path': '/batch', 'body': {'requests': []}}])[0][0] == 400
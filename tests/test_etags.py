@@ -0,0 +1,56 @@
+from sqlalchemy import update, select
+from models import db, People, TableVersion
+import cache
+
+# A write made by another worker: its own connection, the shared version bumped, nothing told this worker's cache
+def write_from_other_worker(name):
+    with db.engine.begin() as connection:
+        connection.execute(update(People.__table__).where(People.id == 1).values(name=name))
+        version = connection.scalar(select(TableVersion.version).where(TableVersion.table_name == 'people')) or 0
+        if version:
+            connection.execute(update(TableVersion.__table__).where(TableVersion.table_name == 'people').values(version=version + 1))
+        else:
+            connection.execute(TableVersion.__table__.insert().values(table_name='people', version=1))
+
+def test_cache_hit_and_revalidation_do_not_query(client, executed):
+    etag = client.get('/people/2').headers['ETag']
+    del executed[:]
+    assert client.get('/people/2').status_code == 200
+    assert client.get('/people/2', headers={'If-None-Match': etag}).status_code == 304
+    assert executed == []
+
+def test_write_of_another_worker_is_not_served_stale(app, client):
+    old = client.get('/people/1')
+    with app.app_context():
+        write_from_other_worker('Luke S')
+    # VERSIONS_REFRESH went by
+    cache.versions.read_at = None
+    new = client.get('/people/1')
+    assert new.headers['ETag'] != old.headers['ETag']
+    assert new.get_json()['results']['name'] == 'Luke S'
+    assert client.get('/people/1', headers={'If-None-Match': old.headers['ETag']}).status_code == 200
+
+def failing_bump(failures):
+    calls = []
+    def bump(table_names):
+        calls.append(table_names)
+        if len(calls) <= failures:
+            raise OSError('database unavailable')
+    return bump, calls
+
+def test_failed_bump_is_retried(monkeypatch):
+    bump, calls = failing_bump(1)
+    monkeypatch.setattr(cache.versions, 'bump', bump)
+    cache.set_cached(People, 1, {'id': 1}, 0)
+    cache.bump_table_versions(['people'])
+    assert len(calls) == 2
+    assert cache.get_cached(People, 1, 0) is not None
+
+def test_bump_that_keeps_failing_drops_the_cache(monkeypatch):
+    bump, calls = failing_bump(cache.VERSIONS_BUMP_ATTEMPTS)
+    monkeypatch.setattr(cache.versions, 'bump', bump)
+    monkeypatch.setattr(cache, 'VERSIONS_BUMP_RETRY_DELAY', 0)
+    cache.set_cached(People, 1, {'id': 1}, 0)
+    cache.bump_table_versions(['people'])
+    assert len(calls) == cache.VERSIONS_BUMP_ATTEMPTS
+    assert cache.get_cached(People, 1, 0) is None
@@ -0,0 +1,15 @@
+import pytest
+
+# The next cursor of each type is named like the query parameters it goes back in
+@pytest.mark.parametrize('page_name, type_name', [('people', 'person'), ('planets', 'planet')])
+def test_following_the_next_cursor_reads_every_favorite(client, page_name, type_name):
+    everything = [item for item in client.get('/users/favorites/1').get_json()['results'] if type_name in item]
+    seen = []
+    cursor = 0
+    while cursor is not None:
+        response = client.get('/users/favorites/1?{0}_after={1}&{0}_limit=10'.format(page_name, cursor)).get_json()
+        assert set(response['next']) == {'people', 'planets'}
+        seen += [item for item in response['results'] if type_name in item]
+        cursor = response['next'][page_name]
+    assert len(everything) > 10
+    assert seen == everything
@@ -0,0 +1,55 @@
+import random
+import threading
+import pytest
+from sqlalchemy import select
+from models import db, FavoritesPlanets
+from favorites import ADDED, DELETED, ALREADY_EXISTS, NOT_FOUND
+from group_commit import GroupCommitter, ADD, REMOVE
+from leaderboard import rebuild_favorites_counts
+
+# Users and planets no other test looks at
+PAIRS = [(user_id, planet_id) for user_id in range(41, 45) for planet_id in range(191, 195)]
+
+def existing_favorites(app):
+    with app.app_context():
+        return {tuple(row) for row in db.session.execute(select(FavoritesPlanets.user_id, FavoritesPlanets.planet_id))}
+
+def test_concurrent_changes_keep_favorites_and_counts_consistent(app):
+    committer = GroupCommitter(app, max_ops=16, max_delay_ms=2)
+    before = existing_favorites(app)
+    results = {pair: [] for pair in PAIRS}
+    barrier = threading.Barrier(8)
+
+    def client(seed):
+        generator = random.Random(seed)
+        barrier.wait()
+        for _ in range(50):
+            pair = generator.choice(PAIRS)
+            result = committer.submit(FavoritesPlanets, generator.choice((ADD, REMOVE)), *pair)
+            results[pair].append(result)
+
+    threads = [threading.Thread(target=client, args=(seed,)) for seed in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    after = existing_favorites(app)
+    for pair, pair_results in results.items():
+        assert set(pair_results) <= {ADDED, DELETED, ALREADY_EXISTS, NOT_FOUND}
+        # Every add that inserted and every remove that deleted changed the row once, in some order
+        assert pair_results.count(ADDED) - pair_results.count(DELETED) == (pair in after) - (pair in before)
+    with app.app_context():
+        assert rebuild_favorites_counts('planets') == 0
+        db.session.rollback()
+    for pair in PAIRS:
+        committer.submit(FavoritesPlanets, ADD if pair in before else REMOVE, *pair)
+
+def test_stopped_thread_fails_the_waiting_operations_and_is_restarted(app, monkeypatch):
+    committer = GroupCommitter(app)
+    def broken_write(batch):
+        raise RuntimeError('broken session')
+    monkeypatch.setattr(committer, 'write', broken_write)
+    with pytest.raises(RuntimeError):
+        committer.submit(FavoritesPlanets, REMOVE, 41, 191)
+    monkeypatch.undo()
+    assert committer.submit(FavoritesPlanets, REMOVE, 41, 191) in (DELETED, NOT_FOUND)
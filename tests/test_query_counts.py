@@ -0,0 +1,37 @@
+import pytest
+from sqlalchemy import select, update, func
+from models import db, People
+
+# Page sizes every route is requested with, all below EXPAND_BATCH_SIZE (each batch of homeworlds is one query)
+PAGE_SIZES = (1, 10, 100)
+
+# Every request of a route differs only by the page size, so all of them must run as many statements (no N+1)
+ROUTES = [
+    ('/people?expand=planet', '/people?expand=planet&limit={}'),
+    ('/people?expand=planet&fields=name', '/people?expand=planet&fields=name&limit={}'),
+    ('/planets/<id>?expand=residents', '/planets/1?expand=residents&residents_limit={}'),
+    ('/users/favorites/<id>?expand=planet', '/users/favorites/1?expand=planet&people_limit={}&planets_limit=1'),
+]
+
+# Planet 1 needs at least as many residents as the largest page. They are the last people, the first pages of
+# /people keep homeworlds of their own.
+@pytest.fixture(scope='module', autouse=True)
+def residents(app):
+    with app.app_context():
+        last_id = db.session.scalar(select(func.max(People.id)))
+        db.session.execute(update(People).where(People.id > last_id - max(PAGE_SIZES)).values(planet_id=1))
+        db.session.commit()
+
+def count_statements(client, executed, path):
+    del executed[:]
+    response = client.get(path)
+    assert response.status_code == 200, response.get_data(as_text=True)
+    assert len(response.get_json()['results']) > 0
+    return len(executed)
+
+@pytest.mark.parametrize('name, template', ROUTES, ids=[name for name, template in ROUTES])
+def test_expand_runs_constant_queries(client, executed, name, template):
+    # The first request fills the entity cache (user, planet), the measured ones all find it warm
+    count_statements(client, executed, template.format(PAGE_SIZES[0]))
+    counts = {size: count_statements(client, executed, template.format(size)) for size in PAGE_SIZES}
+    assert len(set(counts.values())) == 1, counts
@@ -0,0 +1,51 @@
+import re
+import pytest
+from models import db
+
+# Requests whose statements must all be served by an index: the favorites of a user (the UNION ALL of
+# /users/favorites among them), one favorite added or removed, one entity, filtered and sorted pages of the catalog
+INDEXED_REQUESTS = [
+    ('GET', '/users/favorites/1', 200),
+    ('GET', '/users/favorites/1?people_limit=2&planets_limit=2&planets_after=1', 200),
+    ('GET', '/favoritesPlanets/user/1', 200),
+    ('GET', '/favoritePeople/user/1?expand=planet', 200),
+    ('POST', '/favorite/planet/3/user/2', 201),
+    ('DELETE', '/favorite/planet/3/user/2', 200),
+    ('POST', '/favorite/people/3/user/2', 201),
+    ('DELETE', '/favorite/people/3/user/2', 200),
+    ('GET', '/people/5', 200),
+    ('GET', '/planets/5?expand=residents&residents_limit=5', 200),
+    ('GET', '/people?gender=female&limit=10', 200),
+    ('GET', '/people?sort=height&limit=10', 200),
+    ('GET', '/planets?sort=-population&limit=10', 200),
+    ('GET', '/leaderboard/planets', 200),
+]
+
+EXPLAINED = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT)\b', re.IGNORECASE)
+# "SCAN people" or "SCAN people USING COVERING INDEX ...": every row of a table or of one of its indexes.
+# Subqueries and UNION branches show up as SCAN anon_1 and are not tables.
+FULL_SCAN = re.compile(r'^SCAN (\w+)')
+
+# EXPLAIN QUERY PLAN of every statement with the parameters it ran with, EXPLAIN does not run it again
+def query_plans(statements):
+    connection = db.session.connection()
+    plans = []
+    for statement, parameters, executemany in statements:
+        if executemany or not EXPLAINED.match(statement):
+            continue
+        rows = connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters).all()
+        plans.append((statement, [row[-1] for row in rows]))
+    db.session.rollback()
+    return plans
+
+@pytest.mark.parametrize('method, path, status', INDEXED_REQUESTS, ids=['{} {}'.format(*request[:2]) for request in INDEXED_REQUESTS])
+def test_handlers_do_not_scan_tables(app, client, executed, method, path, status):
+    response = client.open(path, method=method)
+    assert response.status_code == status, response.get_data(as_text=True)
+    with app.app_context():
+        plans = query_plans(executed)
+    assert plans
+    tables = set(db.metadata.tables)
+    for statement, plan in plans:
+        scanned = [line for line in plan if FULL_SCAN.match(line) and FULL_SCAN.match(line).group(1) in tables]
+        assert not scanned, '{}\n{}'.format(statement, '\n'.join(plan))
@@ -0,0 +1,32 @@
+import pytest
+import ratelimit
+
+CAPACITY, RATE = ratelimit.get_limit('favorites')
+
+@pytest.fixture
+def limited(monkeypatch):
+    monkeypatch.setattr(ratelimit, 'RATE_LIMIT_ENABLED', True)
+    ratelimit.store.clear()
+    yield ratelimit.store
+    ratelimit.store.clear()
+
+def empty_bucket(store, key):
+    assert store.take([key], CAPACITY, RATE, cost=CAPACITY)[0]
+
+def test_empty_bucket_answers_429_with_retry_after(client, limited):
+    empty_bucket(limited, 'favorites:user:1')
+    response = client.post('/favorite/people/1/user/1')
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) >= 1
+
+def test_request_rejected_by_the_user_takes_nothing_from_the_ip(client, limited):
+    empty_bucket(limited, 'favorites:user:1')
+    for _ in range(3):
+        assert client.post('/favorite/people/1/user/1', environ_base={'REMOTE_ADDR': '10.0.0.2'}).status_code == 429
+    # The whole allowance of the IP is still there
+    assert limited.take(['favorites:ip:10.0.0.2'], CAPACITY, RATE, cost=CAPACITY)[0]
+
+def test_request_rejected_by_the_ip_takes_nothing_from_the_user(client, limited):
+    empty_bucket(limited, 'favorites:ip:10.0.0.3')
+    assert client.post('/favorite/people/1/user/2', environ_base={'REMOTE_ADDR': '10.0.0.3'}).status_code == 429
+    assert limited.take(['favorites:user:2'], CAPACITY, RATE, cost=CAPACITY)[0]
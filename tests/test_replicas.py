@@ -0,0 +1,61 @@
+import os
+import time
+import shutil
+import sqlite3
+import pytest
+from app import create_app
+from database import RoutingSession
+from models import db, Planets
+from seed import seed
+import cache
+import replicas
+
+# An app of its own on SQLite files: a primary and two copies of it as replicas, with planet 1 renamed in each copy
+# so every response tells which database answered it
+@pytest.fixture(scope='module')
+def replica_app(tmp_path_factory):
+    directory = tmp_path_factory.mktemp('replicas')
+    primary_path = str(directory / 'primary.db')
+    replica_paths = [str(directory / 'replica_a.db'), str(directory / 'replica_b.db')]
+    saved = (os.environ['DATABASE_URL'], replicas.REPLICA_URLS, replicas.REPLICA_MAX_LAG, cache.cache, cache.versions)
+    os.environ['DATABASE_URL'] = 'sqlite:///' + primary_path
+    replicas.REPLICA_URLS = ['sqlite:///' + path for path in replica_paths]
+    replicas.REPLICA_MAX_LAG = 0.5
+    app = create_app()
+    with app.app_context():
+        seed(users=2, planets=5, people=5, favorites=0)
+        db.engine.dispose()
+    connection = sqlite3.connect(primary_path)
+    connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+    connection.close()
+    for path in replica_paths:
+        shutil.copyfile(primary_path, path)
+        connection = sqlite3.connect(path)
+        connection.execute('UPDATE planets SET name = ? WHERE id = 1', (os.path.basename(path),))
+        connection.commit()
+        connection.close()
+    yield app
+    os.environ['DATABASE_URL'], replicas.REPLICA_URLS, replicas.REPLICA_MAX_LAG, cache.cache, cache.versions = saved
+    RoutingSession.router = None
+
+# Name of planet 1 in the list, which is read from a replica
+def answered_by(client):
+    return client.get('/planets?limit=1').get_json()['results'][0]['name']
+
+def test_reads_after_a_write_go_to_the_primary(replica_app):
+    client = replica_app.test_client()
+    other_client = replica_app.test_client()
+    names = [answered_by(client) for _ in range(4)]
+    assert sorted(set(names)) == ['replica_a.db', 'replica_b.db']
+    assert client.post('/favorite/planet/1/user/1').status_code == 201
+    assert answered_by(client) == 'Planet 1'
+    # Other clients did not write, they stay on the replicas
+    assert answered_by(other_client).endswith('.db')
+    time.sleep(0.6)
+    assert answered_by(client).endswith('.db')
+
+def test_entity_cache_is_filled_from_the_primary(replica_app):
+    client = replica_app.test_client()
+    cache.cache.clear()
+    assert client.get('/planets/1').get_json()['results']['name'] == 'Planet 1'
+    assert cache.cache.get(cache.cache_key(Planets, 1))['value']['name'] == 'Planet 1'
@@ -0,0 +1,15 @@
+from app import create_app
+import cache
+
+def test_sitemap_lists_the_admin_only_when_it_is_enabled(client, monkeypatch):
+    sitemap = client.get('/').get_data(as_text=True)
+    assert "href='/people'" in sitemap
+    assert '/admin/' not in sitemap
+
+    monkeypatch.setenv('ENABLE_ADMIN', 'true')
+    # create_app() sets up a cache of its own, the one of the other tests is kept
+    monkeypatch.setattr(cache, 'cache', cache.cache)
+    monkeypatch.setattr(cache, 'versions', cache.versions)
+    sitemap = create_app().test_client().get('/').get_data(as_text=True)
+    assert sitemap.count("href='/admin/'") == 1
+    assert '/admin/user/' not in sitemap
@@ -0,0 +1,53 @@
+import json
+import pytest
+from sqlalchemy import select
+from models import db, User, Planets
+
+def table_rows(app, model):
+    with app.app_context():
+        rows = [tuple(row) for row in db.session.execute(select(*model.__table__.columns).order_by(model.id))]
+        db.session.rollback()
+        return rows
+
+def run(app, *args):
+    result = app.test_cli_runner().invoke(args=list(args))
+    assert result.exit_code == 0, result.output
+    return result
+
+@pytest.mark.parametrize('extension', ['jsonl', 'csv'])
+def test_exported_planets_import_unchanged(app, tmp_path, extension):
+    path = str(tmp_path / ('planets.' + extension))
+    before = table_rows(app, Planets)
+    run(app, 'export-data', 'planets', path)
+    assert '{} rows imported'.format(len(before)) in run(app, 'import-data', 'planets', path).output
+    assert table_rows(app, Planets) == before
+
+def test_users_are_exported_without_passwords_unless_asked(app, tmp_path):
+    path = str(tmp_path / 'users.jsonl')
+    before = table_rows(app, User)
+    run(app, 'export-data', 'user', path)
+    with open(path) as stream:
+        rows = [json.loads(line) for line in stream]
+    assert len(rows) == len(before)
+    assert all('password' not in row for row in rows)
+    # Imported back, the users keep the passwords the file does not have
+    run(app, 'import-data', 'user', path)
+    assert table_rows(app, User) == before
+
+    run(app, 'export-data', 'user', path, '--include-passwords')
+    with open(path) as stream:
+        assert [json.loads(line)['password'] for line in stream] == [row[2] for row in before]
+
+def test_csv_row_longer_than_the_header_is_rejected(app, tmp_path):
+    path = tmp_path / 'planets.csv'
+    path.write_text('name,climate\nTatooine,arid,extra\n')
+    result = app.test_cli_runner().invoke(args=['import-data', 'planets', str(path)])
+    assert result.exit_code != 0
+    assert 'Line 2: 3 values for the 2 columns of the header' in result.output
+
+def test_new_user_without_password_is_rejected(app, tmp_path):
+    path = tmp_path / 'users.jsonl'
+    path.write_text('{"email": "new@example.com", "is_active": true}\n')
+    result = app.test_cli_runner().invoke(args=['import-data', 'user', str(path)])
+    assert result.exit_code != 0
+    assert '1 rows match no existing row of user and have no password' in result.output